@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Read throughput of files written by enstools.io.write with different chunk shapes.
+
+A synthetic 5-D ensemble dataset (time, ens, level, lat, lon) is written with zlib compression and the backend's
+default chunks as well as with chunking="auto", "map", and "timeseries" for two target chunk sizes. Each file is
+then read with two access patterns:
+
+    map:        complete horizontal fields for random times, members, and levels
+    timeseries: complete time series for random members, levels, and grid points
+
+usage: benchmark_io_chunking.py [output folder]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy
+import xarray
+import enstools.io
+
+
+def create_dataset(shape=(48, 10, 4, 91, 180)):
+    """
+    create a smooth random field, compressible like real data
+    """
+    rng = numpy.random.default_rng(0)
+    data = numpy.cumsum(rng.standard_normal(shape, dtype=numpy.float32), axis=-1)
+    ds = xarray.Dataset({"t": (("time", "ens", "level", "lat", "lon"), data)},
+                        coords={"time": numpy.arange(shape[0]),
+                                "ens": numpy.arange(1, shape[1] + 1),
+                                "level": numpy.arange(shape[2]),
+                                "lat": numpy.linspace(-90, 90, shape[3]),
+                                "lon": numpy.linspace(0, 358, shape[4])})
+    ds["t"].encoding = {"zlib": True, "complevel": 4}
+    return ds
+
+
+def read_pattern(filename, pattern, n_accesses=50):
+    """
+    read n_accesses selections and return the duration per access in ms
+    """
+    rng = numpy.random.default_rng(1)
+    start = time.perf_counter()
+    with xarray.open_dataset(filename, engine="h5netcdf") as ds:
+        sizes = ds.sizes
+        for _ in range(n_accesses):
+            if pattern == "map":
+                selection = {"time": rng.integers(sizes["time"]), "ens": rng.integers(sizes["ens"]),
+                             "level": rng.integers(sizes["level"])}
+            else:
+                selection = {"ens": rng.integers(sizes["ens"]), "level": rng.integers(sizes["level"]),
+                             "lat": rng.integers(sizes["lat"]), "lon": rng.integers(sizes["lon"])}
+            ds["t"].isel(selection).values
+    return (time.perf_counter() - start) / n_accesses * 1000
+
+
+def main(folder):
+    ds = create_dataset()
+    print("dataset: %s, %.1f MB" % (dict(ds.sizes), ds.nbytes / 1e6))
+    print("%-12s %-9s %-22s %8s %8s %15s %15s" % ("chunking", "kB", "chunk shape", "write s", "MB",
+                                                  "map ms/read", "timeseries ms/read"))
+    variants = [(None, None)] + [(chunking, chunk_bytes) for chunk_bytes in [2 ** 20, 2 ** 18]
+                                 for chunking in ["auto", "map", "timeseries"]]
+    for chunking, chunk_bytes in variants:
+        filename = os.path.join(folder, "chunking-%s-%s.nc" % (chunking, chunk_bytes))
+        start = time.perf_counter()
+        if chunking is None:
+            enstools.io.write(ds, filename)
+        else:
+            enstools.io.write(ds, filename, chunking=chunking, chunk_bytes=chunk_bytes)
+        write_time = time.perf_counter() - start
+        with xarray.open_dataset(filename, engine="h5netcdf") as written:
+            chunks = written["t"].encoding.get("chunksizes")
+        results = [read_pattern(filename, pattern) for pattern in ["map", "timeseries"]]
+        print("%-12s %-9s %-22s %8.2f %8.1f %15.2f %15.2f" % (chunking, chunk_bytes and chunk_bytes // 1024, chunks,
+                                                              write_time, os.path.getsize(filename) / 1e6,
+                                                              *results))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            main(folder)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Speed of the header scan of GRIB files: reading the standard keys one by one compared to the bulk key reader.
+
+For every message, all keys in standard_keys are read once with individual calls for size, type and value of each key
+and once with one call of the KeyReader.
+
+usage: benchmark_io_grib_keys.py [grib-file]
+
+Without a file name, a file with 2000 messages on a 5 degree grid is created in a temporal folder.
+"""
+import sys
+import os
+import tempfile
+import time
+from enstools.io.eccodes import eccodes_cffi
+from enstools.io.eccodes.index import GribIndex
+from grib_test_data import create_grib_file
+
+
+def read_messages(filename):
+    """
+    create header-only messages for all messages within the file
+    """
+    messages = []
+    with eccodes_cffi.open_grib_file(filename, use_mmap=False) as gfile:
+        offset = 0
+        while True:
+            msg = eccodes_cffi.GribMessage(gfile, offset)
+            if not msg.is_valid():
+                break
+            messages.append(msg)
+            offset = msg.offset + msg.length
+    return messages
+
+
+def read_keys_one_by_one(messages):
+    """
+    read all standard keys with individual calls
+    """
+    for msg in messages:
+        msg.cache.clear()
+        for one_key in eccodes_cffi.standard_keys:
+            try:
+                msg[one_key]
+            except KeyError:
+                pass
+
+
+def read_keys_bulk(messages):
+    """
+    read all standard keys with the key reader
+    """
+    for msg in messages:
+        msg.cache.clear()
+        values, failed = eccodes_cffi.standard_key_reader.read(msg.handle)
+        msg.cache.update(values)
+
+
+def benchmark(function, *args, repeat=5):
+    """
+    run the function multiple times, the fastest of all repetitions is returned.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        tmpdir = tempfile.mkdtemp()
+        filename = create_grib_file(os.path.join(tmpdir, "benchmark.grib2"), nmembers=20, nlevels=50, ntimes=2,
+                                    resolution=5.0)
+
+    messages = read_messages(filename)
+    one_by_one = benchmark(read_keys_one_by_one, messages)
+    bulk = benchmark(read_keys_bulk, messages)
+    print("%d messages, %d keys per message" % (len(messages), len(eccodes_cffi.standard_keys)))
+    print("%-24s %9.3fs" % ("keys one by one", one_by_one))
+    print("%-24s %9.3fs %7.2fx" % ("bulk key reader", bulk, one_by_one / bulk))
+    print("%-24s %9.3fs" % ("full header scan", benchmark(GribIndex.scan, filename, repeat=1)))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Scaling of the GRIB decoding with the number of threads of the dask scheduler.
+
+The data of all messages is decoded once with one global lock for all eccodes calls and once with one lock per message.
+
+usage: benchmark_io_grib_threads.py [grib-file]
+
+Without a file name, a file with 200 messages on a 0.5 degree grid is created in a temporal folder.
+"""
+import sys
+import os
+import tempfile
+import time
+import dask
+from enstools.io import read
+from enstools.io.eccodes import eccodes_cffi
+from grib_test_data import create_grib_file
+
+
+def benchmark(filename, nthreads, parallel_decoding, repeat=3):
+    """
+    read the file and compute all variables. The fastest of all repetitions is returned.
+    """
+    eccodes_cffi.set_parallel_decoding(parallel_decoding)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with dask.config.set(scheduler="threads", num_workers=nthreads):
+            read(filename).compute()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        tmpdir = tempfile.mkdtemp()
+        filename = create_grib_file(os.path.join(tmpdir, "benchmark.grib2"), nmembers=10, nlevels=10, ntimes=2)
+
+    # the first read creates the index, this is not part of the benchmark
+    read(filename)
+
+    print("%8s %14s %14s %8s" % ("threads", "global lock", "message lock", "speedup"))
+    for nthreads in [1, 2, 4, 8]:
+        serial = benchmark(filename, nthreads, parallel_decoding=False)
+        parallel = benchmark(filename, nthreads, parallel_decoding=True)
+        print("%8d %13.3fs %13.3fs %7.2fx" % (nthreads, serial, parallel, serial / parallel))
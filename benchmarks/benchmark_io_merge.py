@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Merge of many homogeneous datasets as done by enstools.io.read for multi-file inputs.
+
+Synthetic datasets with one time step and one ensemble member each are created in memory. They are merged once with
+the general merge (recursive sorting and grouping followed by xarray.combine_by_coords) and once with the fast path
+for homogeneous datasets (one combine_nested call).
+
+usage: benchmark_io_merge.py [number of files ...]
+"""
+import sys
+import time
+import numpy
+import pandas
+import xarray
+import dask.array
+from enstools.io import reader
+
+
+def create_datasets(nfiles, nmembers=10):
+    """
+    create nfiles datasets on the same grid, nmembers members per time step
+    """
+    times = pandas.date_range("2020-01-01", periods=nfiles // nmembers, freq="h")
+    lat = numpy.linspace(-90, 90, 91)
+    lon = numpy.linspace(0, 358, 180)
+    datasets = []
+    for one_time in times:
+        for member in range(1, nmembers + 1):
+            data = dask.array.zeros((1, 1, lat.size, lon.size), chunks=-1, dtype=numpy.float32)
+            datasets.append(xarray.Dataset({"t": (("time", "ens", "lat", "lon"), data)},
+                                           coords={"time": [one_time], "ens": [member], "lat": lat, "lon": lon}))
+    return datasets
+
+
+def benchmark(datasets, fast_path):
+    """
+    merge the datasets and return the duration
+    """
+    merge_homogeneous = reader.__merge_homogeneous_datasets
+    if not fast_path:
+        reader.__merge_homogeneous_datasets = lambda x: None
+    try:
+        start = time.perf_counter()
+        result = reader.__merge_datasets(list(datasets))
+        duration = time.perf_counter() - start
+    finally:
+        reader.__merge_homogeneous_datasets = merge_homogeneous
+    return duration, result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = [500, 1000, 2000, 5000]
+
+    print("%8s %14s %14s %8s" % ("files", "general", "fast path", "speedup"))
+    for nfiles in sizes:
+        datasets = create_datasets(nfiles)
+        general, result_general = benchmark(datasets, fast_path=False)
+        fast, result_fast = benchmark(datasets, fast_path=True)
+        xarray.testing.assert_identical(result_general, result_fast)
+        print("%8d %13.3fs %13.3fs %7.2fx" % (nfiles, general, fast, general / fast))
@@ -0,0 +1,57 @@
+"""
+Creation of synthetic grib files for benchmarks. The official eccodes python interface is required.
+"""
+import numpy
+
+
+def create_grib_file(filename, nmembers=10, nlevels=10, ntimes=2, resolution=0.5, packing="grid_simple"):
+    """
+    create a grib2 file with temperature on pressure levels on a global regular lon-lat grid.
+
+    Parameters
+    ----------
+    filename : str
+            name of the file to create
+
+    nmembers, nlevels, ntimes : int
+            number of ensemble members, levels and time steps. The file contains nmembers * nlevels * ntimes messages.
+
+    resolution : float
+            grid spacing in degrees
+
+    packing : str
+            value for the grib key packingType
+
+    Returns
+    -------
+    str:
+            the name of the created file
+    """
+    import eccodes
+    ni = int(round(360 / resolution))
+    nj = int(round(180 / resolution)) + 1
+    rng = numpy.random.default_rng(0)
+    values = 250.0 + 30 * rng.random(ni * nj)
+    with open(filename, "wb") as f:
+        for itime in range(ntimes):
+            for member in range(1, nmembers + 1):
+                for level in range(nlevels):
+                    handle = eccodes.codes_grib_new_from_samples("regular_ll_pl_grib2")
+                    eccodes.codes_set(handle, "productDefinitionTemplateNumber", 1)
+                    eccodes.codes_set(handle, "perturbationNumber", member)
+                    eccodes.codes_set(handle, "level", 1000 - level * 10)
+                    eccodes.codes_set(handle, "stepRange", itime * 6)
+                    eccodes.codes_set_long(handle, "Ni", ni)
+                    eccodes.codes_set_long(handle, "Nj", nj)
+                    eccodes.codes_set(handle, "latitudeOfFirstGridPointInDegrees", 90.0)
+                    eccodes.codes_set(handle, "latitudeOfLastGridPointInDegrees", -90.0)
+                    eccodes.codes_set(handle, "longitudeOfFirstGridPointInDegrees", 0.0)
+                    eccodes.codes_set(handle, "longitudeOfLastGridPointInDegrees", 360.0 - resolution)
+                    eccodes.codes_set(handle, "iDirectionIncrementInDegrees", resolution)
+                    eccodes.codes_set(handle, "jDirectionIncrementInDegrees", resolution)
+                    eccodes.codes_set(handle, "packingType", packing)
+                    eccodes.codes_set(handle, "bitsPerValue", 16)
+                    eccodes.codes_set_values(handle, values + level + member)
+                    eccodes.codes_write(handle, f)
+                    eccodes.codes_release(handle)
+    return filename
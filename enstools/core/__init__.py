@@ -17,6 +17,7 @@ from decorator import decorator
 from pint import DimensionalityError
 from .cluster import init_cluster, get_num_available_procs, get_client_and_worker, all_workers_are_local, \
     RoundRobinWorkerIterator
+from .chunking import plan_chunks, plan_dataset_chunks
 from .os_support import getstatusoutput, get_cache_dir
 
 
@@ -439,7 +440,8 @@ def check_arguments(units={}, dims={}, shape={}):
 def get_chunk_size_for_n_procs(shape, nproc):
     """
     Create a chunk distribution for dask-arrays depending on the number of available processors. Chunks are created
-    from the two right-most dimensions.
+    from the two right-most dimensions. Sizes in bytes and dimensions an operation reduces over are not considered,
+    use plan_chunks instead.
 
     Parameters
     ----------
@@ -498,8 +500,9 @@ def get_chunk_size_for_n_procs(shape, nproc):
 def parallelize_univariate_two_arg(func):
     """
     Parallelize a function with two arguments. The first argument is a (N,...)-array, the second argument is a
-    (e,N,...)-array. The array in the first argument will be divided into chunks of (almost) equal size. The array in
-    the second argument will be divided in the same way in its rightmost dimensions.
+    (e,N,...)-array. The array in the first argument will be divided into chunks of (almost) equal size planned with
+    plan_chunks. The array in the second argument will be divided in the same way in its rightmost dimensions, the
+    ensemble dimension is not divided.
 
     The first call to the underlining function will be func(arg0[0:chunk0], arg1[:,0:chunk0]),
     the second func(arg0[chunk0:chunk1], arg1[:,chunk0:chunk1]), ...
@@ -519,7 +522,7 @@ def parallelize_univariate_two_arg(func):
         # paralyze with dask
         # calculate chunk sizes
         nprocs = get_num_available_procs()
-        chunk_size = get_chunk_size_for_n_procs(arg0.shape, nprocs)
+        chunk_size = plan_chunks(arg1.shape, arg1.dtype, reduce_dims=[0], n_workers=nprocs)[1:]
         da0 = dask.array.from_array(arg0, chunks=chunk_size)
         da1 = dask.array.from_array(arg1, chunks=(arg1.shape[0],) + chunk_size)
 
@@ -0,0 +1,192 @@
+"""
+Planning of dask chunks. A chunking is chosen based on the size of the chunks in bytes instead of the number of
+processors alone:
+
+    - chunks are close to a target size: large enough to keep the scheduling overhead per task small, small enough
+      that every worker can hold the inputs, results and temporaries of a few tasks at the same time.
+    - dimensions an operation reduces over (e.g., the ensemble dimension of ensemble statistics) are never split,
+      every chunk can be processed independently.
+    - arrays are split along the leftmost dimensions first. Chunks are contiguous blocks of the C-ordered array and
+      the innermost loops run over long rows, which makes good use of the caches.
+    - large arrays are split into at least one chunk per worker.
+    - planned chunks are multiples of the chunks of the file the array is stored in.
+"""
+import math
+import numpy
+import psutil
+import xarray
+import dask
+from dask.utils import parse_bytes
+from .cluster import get_num_available_procs, get_client_and_worker
+
+# chunks smaller than this are not created to keep more workers busy, the overhead per task would dominate
+MIN_CHUNK_BYTES = 2 ** 20
+
+# a worker holds inputs, results and temporaries of a few tasks at the same time
+CHUNKS_PER_WORKER_MEMORY = 8
+
+
+def plan_chunks(shape, dtype, reduce_dims=None, dims=None, fixed=None, base_chunks=None, n_workers=None,
+                worker_memory=None, target_bytes=None):
+    """
+    Plan the chunks of an array.
+
+    Parameters
+    ----------
+    shape : int or tuple of int
+            shape of the array.
+
+    dtype : numpy.dtype or str
+            data type of the array.
+
+    reduce_dims : list
+            dimensions an operation reduces over. They are kept in one chunk. Items are either axis numbers or, if
+            dims is given, dimension names.
+
+    dims : tuple of str
+            names of the dimensions. If given, dimensions may be referenced by name and the result is a dictionary.
+
+    fixed : dict
+            fixed chunk sizes of individual dimensions, keys are axis numbers or dimension names. -1 or None: the
+            whole dimension.
+
+    base_chunks : tuple of int or dict
+            chunks of the storage of the array, e.g., of a NetCDF or zarr file. Planned chunks are multiples of these.
+
+    n_workers : int
+            number of workers. Arrays are split into at least as many chunks unless chunks would become smaller than
+            MIN_CHUNK_BYTES. Default: get_num_available_procs().
+
+    worker_memory : int or str
+            memory per worker in bytes or as string like "4GB". Default: the memory limit of the workers of a
+            distributed cluster or the available memory divided by the number of workers.
+
+    target_bytes : int or str
+            target size of the chunks. Default: dask's array.chunk-size, at most 1/8 of the memory per worker.
+
+    Returns
+    -------
+    tuple of int or dict
+            chunk size for every dimension, a dictionary with dimension names as keys if dims is given.
+
+    Examples
+    --------
+    >>> plan_chunks((10, 1000, 1000), "float64", n_workers=8, target_bytes="16MB")
+    (1, 1000, 1000)
+    >>> plan_chunks((20, 100, 1000), "float32", reduce_dims=[0], n_workers=4, target_bytes="4MB")
+    (20, 25, 1000)
+    >>> plan_chunks((4, 500, 600), "float64", base_chunks=(1, 10, 600), n_workers=2, target_bytes="1MB")
+    (1, 170, 600)
+    >>> plan_chunks((40, 1000), "float64", dims=("time", "cell"), fixed={"time": 1}, n_workers=1)
+    {'time': 1, 'cell': 1000}
+    """
+    if isinstance(shape, int):
+        shape = (shape,)
+    shape = tuple(int(size) for size in shape)
+    itemsize = numpy.dtype(dtype).itemsize
+
+    # chunk sizes given by the caller
+    chunks = list(shape)
+    keep = set()
+    for dim in reduce_dims or []:
+        keep.add(__axis(dim, dims))
+    for dim, size in (fixed or {}).items():
+        axis = __axis(dim, dims)
+        if size is not None and size != -1:
+            chunks[axis] = min(int(size), shape[axis])
+        keep.add(axis)
+    if isinstance(base_chunks, dict):
+        base_chunks = tuple(base_chunks.get(dim, 1) for dim in dims)
+    if base_chunks is None:
+        base_chunks = (1,) * len(shape)
+
+    # target size of one chunk
+    if n_workers is None:
+        n_workers = get_num_available_procs()
+    n_workers = max(int(n_workers), 1)
+    if target_bytes is None:
+        target_bytes = parse_bytes(dask.config.get("array.chunk-size"))
+        if worker_memory is None:
+            worker_memory = __get_worker_memory(n_workers)
+        target_bytes = min(target_bytes, parse_bytes(worker_memory) // CHUNKS_PER_WORKER_MEMORY)
+    else:
+        target_bytes = parse_bytes(target_bytes)
+    total_bytes = itemsize * math.prod(shape)
+    target_bytes = min(target_bytes, max(math.ceil(total_bytes / n_workers), MIN_CHUNK_BYTES))
+    target_bytes = max(target_bytes, itemsize)
+
+    # split the leftmost dimensions first
+    for axis in range(len(shape)):
+        if axis in keep or shape[axis] == 0:
+            continue
+        other_bytes = itemsize * math.prod(chunks[:axis] + chunks[axis + 1:])
+        if other_bytes * chunks[axis] <= target_bytes:
+            break
+        base = min(max(int(base_chunks[axis]), 1), shape[axis])
+        size = max(target_bytes // max(other_bytes, 1) // base * base, base)
+        # chunks of equal size instead of one small remainder
+        n_blocks = math.ceil(shape[axis] / size)
+        size = math.ceil(math.ceil(shape[axis] / n_blocks) / base) * base
+        chunks[axis] = min(size, shape[axis])
+
+    if dims is not None:
+        return dict(zip(dims, chunks))
+    return tuple(chunks)
+
+
+def plan_dataset_chunks(data, reduce_dims=None, fixed=None, n_workers=None, worker_memory=None, target_bytes=None):
+    """
+    Plan the chunks of a dataset or data array. The plan is made for the largest variable, the chunks of the files
+    the variables are stored in (encoding "preferred_chunks") are taken into account.
+
+    Parameters
+    ----------
+    data : xarray.Dataset or xarray.DataArray
+            the data to chunk.
+
+    reduce_dims, fixed, n_workers, worker_memory, target_bytes :
+            see plan_chunks. Dimensions not part of the largest variable are ignored.
+
+    Returns
+    -------
+    dict
+            chunk size for every dimension of the largest variable. Usable as argument of chunk.
+    """
+    if isinstance(data, xarray.DataArray):
+        variables = [data.variable]
+    else:
+        variables = list(data.data_vars.values())
+    if len(variables) == 0:
+        return {}
+    largest = max(variables, key=lambda one_var: one_var.size * one_var.dtype.itemsize)
+    dims = largest.dims
+    return plan_chunks(largest.shape, largest.dtype, dims=dims,
+                       reduce_dims=[dim for dim in reduce_dims or [] if dim in dims],
+                       fixed={dim: size for dim, size in (fixed or {}).items() if dim in dims},
+                       base_chunks=largest.encoding.get("preferred_chunks", None),
+                       n_workers=n_workers, worker_memory=worker_memory, target_bytes=target_bytes)
+
+
+def __axis(dim, dims):
+    """
+    axis number of a dimension given by number or by name.
+    """
+    if isinstance(dim, str):
+        if dims is None or dim not in dims:
+            raise ValueError("unknown dimension '%s', dimensions are %s" % (dim, dims))
+        return dims.index(dim)
+    return int(dim)
+
+
+def __get_worker_memory(n_workers):
+    """
+    memory limit of the smallest worker of a distributed cluster or the available memory divided by the number of
+    workers.
+    """
+    client, worker = get_client_and_worker()
+    if client is not None:
+        limits = [info.get("memory_limit", 0) for info in client.scheduler_info()["workers"].values()]
+        limits = [limit for limit in limits if limit]
+        if len(limits) > 0:
+            return min(limits)
+    return psutil.virtual_memory().available // n_workers
@@ -10,6 +10,7 @@ import numpy as np
 import logging
 import six
 from enstools.core import get_arg_spec
+from .chunking import plan_dataset_chunks
 import inspect
 
 
@@ -67,9 +68,10 @@ def __args_to_dask(*args):
     return new_args
 
 
-def rechunk_arguments(dim_type=None, dim_name=None, arg_names=None):
+def rechunk_arguments(dim_type=None, dim_name=None, arg_names=None, reduce_dim_type=None):
     """
-    rechunk all arguments along a specific dimensions
+    rechunk all arguments along a specific dimensions. The chunks of all other dimensions are planned with
+    plan_dataset_chunks based on the size of the chunks in bytes and the number of workers.
 
     Parameters
     ----------
@@ -87,10 +89,14 @@ def rechunk_arguments(dim_type=None, dim_name=None, arg_names=None):
 
     arg_names : list
             list of arguments to process. None: all arguments without defaults. This argument is not yet implemented!
+
+    reduce_dim_type : list
+            dimension types ("time", "ens") or names the function reduces over. These dimensions are not split.
     """
     # check decorator arguments
-    if dim_type is None and dim_name is None:
-        raise ValueError("the decorator rechunk_arguments needs at least one of the arguments dim_type or dim_name!")
+    if dim_type is None and dim_name is None and reduce_dim_type is None:
+        raise ValueError("the decorator rechunk_arguments needs at least one of the arguments dim_type, dim_name or "
+                         "reduce_dim_type!")
     if dim_type is None:
         dim_type = {}
     if dim_name is None:
@@ -125,8 +131,20 @@ def rechunk_arguments(dim_type=None, dim_name=None, arg_names=None):
                 for dn, cs in six.iteritems(dim_name):
                     if dn in one_arg:
                         chunks[dn] = cs
+                # dimensions the function reduces over are kept in one chunk
+                reduce_dims = []
+                for one_type in reduce_dim_type or []:
+                    if one_type == "time":
+                        reduce_dims.append(get_time_dim(one_arg))
+                    elif one_type == "ens":
+                        reduce_dims.append(get_ensemble_dim(one_arg))
+                    else:
+                        reduce_dims.append(one_type)
+                # plan the chunks of all other dimensions
+                planned = plan_dataset_chunks(one_arg, reduce_dims=reduce_dims, fixed=chunks)
+                planned.update(chunks)
                 # apply the re-chunk operation
-                one_arg = one_arg.chunk(chunks)
+                one_arg = one_arg.chunk(planned)
             # allow scalar arguments
             elif isinstance(one_arg, int) or isinstance(one_arg, float):
                 pass
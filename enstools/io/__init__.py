@@ -31,5 +31,10 @@ def __clean_HDF5_PLUGIN_PATH():
 from .file_type import get_file_type
 from .reader import read
 from .writer import write
+from .stream import StreamWriter
 from .dataset import drop_unused
+from .cache import dataset_cache
+from .references import create_references, open_references
+from .manifest import create_manifest
+from .profiling import profile_read
 
@@ -0,0 +1,192 @@
+"""
+Process-wide cache of datasets returned by read. The cache is opt-in (read(..., cache=True)) and is intended for
+interactive work and loops reading the same files again and again.
+"""
+from collections import OrderedDict
+import threading
+import logging
+import os
+import weakref
+import dask.base
+from .file_info import file_info_cache
+
+
+class DatasetCache:
+    """
+    LRU cache of opened and merged datasets. Entries are identified by the names, modification times and sizes of all
+    input files together with all arguments of read. Modified files are therefore never served from the cache.
+
+    The cache is bounded by the number of files referenced by all cached datasets (every file may hold an open file
+    handle) and by the number of bytes held in memory (data of datasets read with in_memory=True and all coordinates).
+    The least recently used datasets are removed first. The copies handed out to callers share the file handles of
+    the cached dataset, the files of a removed dataset are therefore closed only when no copy is in use anymore.
+    """
+    def __init__(self, max_files=128, max_bytes=2 ** 30):
+        """
+        Parameters
+        ----------
+        max_files : int
+                maximal number of files referenced by all cached datasets.
+
+        max_bytes : int
+                maximal number of bytes held in memory by all cached datasets.
+        """
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_read(self, read_function, filenames, *args, **kwargs):
+        """
+        return a cached dataset or read it and store it in the cache.
+
+        Parameters
+        ----------
+        read_function : callable
+                function called as read_function(filenames, *args, **kwargs) in case of a cache miss.
+
+        filenames : list
+                names of all input files. Patterns must already be expanded.
+
+        *args, **kwargs
+                all further arguments of the read function. They are part of the key of the cache entry.
+
+        Returns
+        -------
+        xarray.Dataset:
+                a shallow copy of the cached dataset. Adding or removing variables does not affect the cache.
+        """
+        paths = [os.path.abspath(str(one_file)) for one_file in filenames]
+        constant = kwargs.get("constant", None)
+        if constant is not None:
+            paths.append(os.path.abspath(str(constant)))
+        key = self.__key(paths, args, kwargs)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                logging.debug("dataset cache hit for %s" % ", ".join(paths[:3]))
+                return self.__hand_out(entry)
+            self.misses += 1
+
+        dataset = read_function(filenames, *args, **kwargs)
+        nbytes = dataset.nbytes if kwargs.get("in_memory", False) else \
+            sum(one_coord.nbytes for one_coord in dataset.coords.values())
+        with self.lock:
+            # datasets created from older versions of the same files are not needed anymore
+            files = set(key[0])
+            for other_key in list(self.entries.keys()):
+                if any(one_file not in files and one_file[0] in paths for one_file in other_key[0]):
+                    self.__remove(other_key)
+            entry = {"dataset": dataset, "paths": set(paths), "nbytes": nbytes, "users": 0, "removed": False}
+            self.entries[key] = entry
+            result = self.__hand_out(entry)
+            self.__evict()
+        return result
+
+    def invalidate(self, paths=None):
+        """
+        remove datasets from the cache.
+
+        Parameters
+        ----------
+        paths : str or list of str
+                remove all datasets created from one of these files. Default: remove all datasets.
+        """
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        if paths is not None:
+            paths = set(os.path.abspath(str(one_path)) for one_path in paths)
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if paths is None or len(self.entries[key]["paths"] & paths) > 0:
+                    self.__remove(key)
+
+    def info(self):
+        """
+        statistics of the cache usage
+
+        Returns
+        -------
+        dict:
+                number of hits, misses, and evictions, number of cached datasets, referenced files and bytes in memory.
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "datasets": len(self.entries),
+                    "files": self.__nfiles(),
+                    "bytes": self.__nbytes()}
+
+    def __key(self, paths, args, kwargs):
+        """
+        create the key from file names, modification times and sizes, and all arguments.
+        """
+        files = []
+        for one_path in paths:
+            info = file_info_cache.stat(one_path)
+            if info is None:
+                raise FileNotFoundError("file '%s' not found!" % one_path)
+            files.append((one_path, info.mtime_ns, info.size))
+        return tuple(files), dask.base.tokenize(args, sorted(kwargs.items()))
+
+    def __nfiles(self):
+        return sum(len(entry["paths"]) for entry in self.entries.values())
+
+    def __nbytes(self):
+        return sum(entry["nbytes"] for entry in self.entries.values())
+
+    def __evict(self):
+        """
+        remove the least recently used entries until the limits are met. The newest entry is always kept.
+        """
+        while len(self.entries) > 1 and (self.__nfiles() > self.max_files or self.__nbytes() > self.max_bytes):
+            self.__remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def __hand_out(self, entry):
+        """
+        create a shallow copy of a cached dataset for a caller. The entry counts the copies in use.
+        """
+        copy = entry["dataset"].copy(deep=False)
+        entry["users"] += 1
+        weakref.finalize(copy, self.__release, entry)
+        return copy
+
+    def __release(self, entry):
+        """
+        called when a copy handed out to a caller is garbage collected. The files of removed entries are closed with
+        the last copy.
+        """
+        with self.lock:
+            entry["users"] -= 1
+            if entry["removed"] and entry["users"] == 0:
+                self.__close(entry)
+
+    def __remove(self, key):
+        """
+        remove one entry. Its files are closed unless copies of the dataset are still in use.
+        """
+        entry = self.entries.pop(key)
+        entry["removed"] = True
+        if entry["users"] == 0:
+            self.__close(entry)
+
+    @staticmethod
+    def __close(entry):
+        """
+        close the files of one entry
+        """
+        try:
+            entry["dataset"].close()
+        except Exception as ex:
+            logging.debug("unable to close cached dataset: %s" % ex)
+
+
+# the cache used by read(..., cache=True)
+dataset_cache = DatasetCache()
@@ -5,23 +5,26 @@ support is available.
 import logging
 try:
     from . import eccodes_cffi
+    from .index import GribIndex, get_index
+    from .fields import GribField, iter_grib_fields, filter_messages
 except OSError:
     logging.warning("eccodes c-library not found, grib file support not available!")
     pass
 from collections import OrderedDict
 import os
-import io
-import re
+import itertools
 import xarray
 import dask.array
 import numpy
-from datetime import datetime, timedelta
-import logging
+import pandas
 import distributed
 from enstools.core import all_workers_are_local
+from .. import profiling
 
 
-def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filename=False, client=None, worker=None, decode_times=True):
+def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filename=False, client=None, worker=None,
+                   decode_times=True, use_index=True, index_dir=None, batch_messages=False, use_mmap=True,
+                   chunks=None, variables=None, levels=None, members=None, time=None, leadtime=None):
     """
     Read the contents of a grib1 or grib2 file
 
@@ -50,10 +53,51 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
     decode_times: bool
             decode the times.
 
+    use_index : bool
+            store the header information of all messages in an index file on the first read. Later reads of the
+            unchanged file construct the dataset from the index without decoding any message.
+
+    index_dir : str
+            folder for index files. Default: subfolder grib-index within the enstools cache directory.
+
+    batch_messages : bool
+            load all levels of a variable at one time and ensemble member in one task with one file handle. This
+            creates one chunk per time and member instead of one chunk per message. Shortcut for chunks={"level": -1}.
+
+    use_mmap : bool
+            map the file into memory for scanning and decoding. Messages are passed to eccodes without copying them.
+
+    chunks : int or dict
+            number of messages per chunk along the time, ensemble and level dimensions. All messages of one chunk are
+            loaded in one task with one file handle. Either one number for all three dimensions or a dictionary
+            with dimension names as keys. The key "level" is used for all vertical dimensions. A value of -1 selects
+            the whole dimension. Horizontal dimensions given in the dictionary are re-chunked after loading.
+            Default: one message per chunk.
+
+    variables : str or list of str
+            read only the given variables. Names are either the short names (e.g. "t") or the names including the
+            type of level (e.g. "t_isobaricInhPa"). Messages of other variables are skipped based on the header
+            information within the index, no eccodes handle or dask task is created for them.
+
+    levels : number or list of numbers
+            read only messages on the given levels (value of the grib key level).
+
+    members : int or list of int
+            read only the given ensemble members.
+
+    time : datetime-like or list of datetime-like
+            read only messages with the given valid times.
+
+    leadtime : datetime.timedelta
+            lead time used with leadtime_from_filename, e.g., from the manifest of read. Default: parsed from the
+            file name.
+
     Returns
     -------
     xarray.Dataset
-            a netcdf-like representation of the file-content
+            a netcdf-like representation of the file-content. Fields not present in the file are filled with the
+            missing value of the variable. In this case the attribute grib_completeness lists the number of available
+            and expected messages per variable. The dataset is empty if no message matches the selection.
     """
     if "eccodes_cffi" not in globals():
         raise ImportError("eccodes interface not found, grib file support not available!")
@@ -61,13 +105,29 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
     # use always the absolute path, the relative path may change during the lifetime of the dataset
     filename = os.path.abspath(filename)
 
+    # get the header information of all messages, either from an existing index or by scanning the file
+    with profiling.timer("grib_index"):
+        index = get_index(filename, leadtime_from_filename=leadtime_from_filename, index_dir=index_dir,
+                          use_index=use_index, use_mmap=use_mmap, leadtime=leadtime)
+
+    # select the requested messages and remove variables without any message
+    messages = index.messages
+    if variables is not None or levels is not None or members is not None or time is not None:
+        messages = filter_messages(messages, __message_selection(variables, levels, members, time))
+        if len(messages) == 0:
+            logging.debug("read_grib_file: no messages in %s match the selection" % filename)
+            return xarray.Dataset()
+    selected_levels = {}
+    for one_msg in messages:
+        selected_levels.setdefault(one_msg.variable_id, set()).add(one_msg.level)
+
     # lists of dimensions coordinates and variables
-    variables = set()
+    variables = [variable_id for variable_id in index.variables.keys() if variable_id in selected_levels]
     levels = {}
     level_values = {}
     dimensions = {}
     dimension_names = {}
-    coordinates = OrderedDict()
+    coordinates = OrderedDict(index.coordinates)
     attributes = {}
     encodings = {}
     ensemble_members = set()
@@ -75,193 +135,45 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
     datatype = {}
     msg_by_var_level_ens = {}
     rotated_pole = {}
-
-    # list of skipped grid types
-    skipped_grids = set()
+    for variable_id in variables:
+        var_info = index.variables[variable_id]
+        levels[variable_id] = [level for level in var_info["levels"].keys() if level in selected_levels[variable_id]]
+        level_values[variable_id] = OrderedDict((level, var_info["levels"][level]) for level in levels[variable_id])
+        dimensions[variable_id] = var_info["shape"]
+        dimension_names[variable_id] = var_info["dims"]
+        datatype[variable_id] = var_info["dtype"]
+        attributes[variable_id] = OrderedDict(var_info["attrs"])
+        encoding = OrderedDict()
+        encoding["_FillValue"] = var_info["fill_value"]
+        encodings[variable_id] = encoding
+        if var_info["rotated_ll"] is not None:
+            rotated_pole[variable_id] = eccodes_cffi.rotated_ll_info_from_keys(var_info["rotated_ll"],
+                                                                               dimension_names[variable_id])
 
     # The full message payload is only read if we want data in memory. In a dask cluster,
     # workers take over the data loading. Exception: if all workers are local, load the data directly.
-    load_payload = in_memory and client is None
     if client is not None:
         all_local = all_workers_are_local(client)
     else:
         all_local = False
-    if in_memory and client is not None and all_local:
-        load_payload = True
-
-    # loop to select all messages
-    logging.debug("start reading all grib messages from %s ..." % filename)
-    gfile = io.open(filename, "rb")
-    while True:
-        # read the content of the next grib message from the input file.
-        offset = gfile.tell()
-
-        # create an empty message from the message raw data.
-        msg = eccodes_cffi.GribMessage(gfile, offset, read_data=load_payload)
-        if not msg.is_valid():
-            break
-
-        # skip messages on unsupported grids
-        if msg["gridType"] not in ["sh", "regular_ll", "rotated_ll", "reduced_gg", "unstructured_grid"]:
-            if msg["gridDefinitionDescription"] not in skipped_grids:
-                skipped_grids.add(msg["gridDefinitionDescription"])
-                logging.warning("skipping grib message due to unsupported grid: %s" % msg["gridDefinitionDescription"])
-            continue
-
-        # record the name
-        variable_id = (msg.get_name(prefer_cf=False), msg["typeOfLevel"])
-        if variable_id not in variables:
-            variables.add(variable_id)
-
-        # make a list of all levels
-        if variable_id not in levels:
-            levels[variable_id] = [msg["level"]]
-            level_values[variable_id] = {}
-        else:
-            if msg["level"] not in levels[variable_id]:
-                levels[variable_id].append(msg["level"])
-        if msg["level"] not in level_values[variable_id]:
-            level_values[variable_id][msg["level"]] = msg.get_level()
-
-        # record the horizontal dimensions
-        if variable_id not in dimensions:
-            dimensions[variable_id], dimension_names[variable_id] = msg.get_dimension(dimensions, dimension_names)
-
-        # record the valid time stamp
-        if leadtime_from_filename:
-            leadtime = re.search("lfff(\d\d)(\d\d)(\d\d)(\d\d)", os.path.basename(filename))
-            if leadtime is None:
-                raise IOError("unable to read leadtime from filename: %s", filename)
-            initDate = "%08d%04d" % (msg["dataDate"], int(msg["dataTime"]))
-            if initDate.startswith("0000"):
-                initDate = "2" + initDate[1:]
-            time_stamp = datetime.strptime(initDate, "%Y%m%d%H%M")
-            time_stamp += timedelta(days=int(leadtime.group(1)), hours=int(leadtime.group(2)), minutes=int(leadtime.group(3)), seconds=int(leadtime.group(4)))
-        else:
-            validityDate = "%08d%04d" % (msg["validityDate"], int(msg["validityTime"]))
-            if validityDate.startswith("0000"):
-                validityDate = "2" + validityDate[1:]
-            time_stamp = datetime.strptime(validityDate, "%Y%m%d%H%M")
-
-        if time_stamp not in times:
-            times.add(time_stamp)
-
-        # horizontal coordinates for unstaggered variables
-        if "lon" not in coordinates and not "srlon" in dimension_names[variable_id] and not "srlat" in dimension_names[variable_id]:
-            coord_lon, coord_lat = msg.get_coordinates(dimension_names[variable_id])
-            if coord_lon is not None and coord_lat is not None:
-                coordinates["lon"], coordinates["lat"] = coord_lon, coord_lat
-
-        # for staggered vartiable add slonu/v and slatu/v
-        if dimension_names[variable_id][0] == "rlat" and dimension_names[variable_id][1] == "srlon" and "slonu" not in coordinates:
-            coord_lon, coord_lat = msg.get_coordinates(dimension_names[variable_id])
-            if coord_lon is not None and coord_lat is not None:
-                coordinates["slonu"], coordinates["slatu"] = coord_lon, coord_lat
-        if dimension_names[variable_id][0] == "srlat" and dimension_names[variable_id][1] == "rlon" and "slonv" not in coordinates:
-            coord_lon, coord_lat = msg.get_coordinates(dimension_names[variable_id])
-            if coord_lon is not None and coord_lat is not None:
-                coordinates["slonv"], coordinates["slatv"] = coord_lon, coord_lat
-
-        # create a list of all ensemble members
-        for ensemble_member_key in ["localActualNumberOfEnsembleNumber", "perturbationNumber"]:
-            if ensemble_member_key in msg:
-                ensemble_member = msg[ensemble_member_key]
-                if msg[ensemble_member_key] not in ensemble_members:
-                    ensemble_members.add(msg[ensemble_member_key])
-                break
-            else:
-                ensemble_member = -1
 
-        # select a datatype based on the number of bits per value in the grib message
-        if variable_id not in datatype:
-            if msg["bitsPerValue"] > 32:
-                datatype[variable_id] = numpy.float64
-            else:
-                datatype[variable_id] = numpy.float32
-
-        # collect attributes of this variables
-        if variable_id not in attributes:
-            attrs = OrderedDict()
-            attrs["units"] = msg["parameterUnits"]
-            attrs["long_name"] = msg["parameterName"]
-            # add alternative names
-            if "cfName" in msg and msg["cfName"] != "unknown":
-                attrs["standard_name"] = msg["cfName"]
-            if "cfVarName" in msg and msg["cfVarName"] != "unknown":
-                attrs["cf_short_name"] = msg["cfVarName"]
-            if "shortName" in msg and msg["shortName"] != "unknown":
-                attrs["short_name"] = msg["shortName"]
-
-            attrs["grid_type"] = msg["gridType"]
-            # information about the rotated pole?
-            if msg["gridType"] == "rotated_ll":
-                rotated_pole[variable_id] = msg.get_rotated_ll_info(dimension_names[variable_id])
-                attrs["grid_mapping"] = rotated_pole[variable_id][0]
-            elif msg["gridType"] in ["reduced_gg", "unstructured_grid"]:
-                attrs["coordinates"] = "lon lat"
-
-            # grib edition specific attributes
-            if msg["editionNumber"] == 1:
-                attrs["code"] = msg["indicatorOfParameter"]
-                attrs["table"] = msg["table2Version"]
-            elif msg["editionNumber"] == 2:
-                attrs["discipline"] = msg["discipline"]
-                attrs["parameterCategory"] = msg["parameterCategory"]
-                attrs["parameterNumber"] = msg["parameterNumber"]
-
-            # store attributes in dictionary for all variables
-            attributes[variable_id] = attrs
-            # values used for encoding during storage
-            encoding = OrderedDict()
-            encoding["_FillValue"] = datatype[variable_id](msg["missingValue"])
-            encodings[variable_id] = encoding
-
-        # store the values in a dict for later retrieval
-        if not in_memory:
-            msg_by_var_level_ens[(variable_id, msg["level"], ensemble_member, time_stamp)] = \
-                dask.array.from_delayed(dask.delayed(__get_one_message)
-                                                    (filename, offset, dimensions[variable_id], datatype[variable_id],
-                                                     encodings[variable_id]["_FillValue"]),
-                                        shape=dimensions[variable_id],
-                                        dtype=datatype[variable_id])
-        else:
-            # persist the data into memory
-            if client is None:
-                msg_by_var_level_ens[(variable_id, msg["level"], ensemble_member, time_stamp)] = \
-                    dask.array.from_array(msg.get_values(dimensions[variable_id], datatype[variable_id],
-                                          encodings[variable_id]["_FillValue"]),
-                                          chunks=dimensions[variable_id])
-            else:
-                if worker is not None:
-                    distributed.secede()
-                # if all workers are running on local host, load the data directly. There is no advantage of
-                # delegating the work to other workers.
-                if all_local:
-                    chunk = dask.array.from_array(msg.get_values(dimensions[variable_id], datatype[variable_id],
-                                              encodings[variable_id]["_FillValue"]),
-                                              chunks=dimensions[variable_id])
-                    chunk_uploaded = client.scatter(chunk)      # data is currently kept on local worker process.
-                    msg_by_var_level_ens[(variable_id, msg["level"], ensemble_member, time_stamp)] = \
-                        dask.array.from_delayed(
-                                            chunk_uploaded,
-                                            shape=dimensions[variable_id],
-                                            dtype=datatype[variable_id])
-                # we are running with workers distributed of multiple computers.
-                # Data reading is done distributed as well.
-                else:
-                    msg_by_var_level_ens[(variable_id, msg["level"], ensemble_member, time_stamp)] = \
-                        client.persist(dask.array.from_delayed(
-                                            dask.delayed(__get_one_message)(filename, offset, dimensions[variable_id], datatype[variable_id],
-                                                encodings[variable_id]["_FillValue"]),
-                                            shape=dimensions[variable_id],
-                                            dtype=datatype[variable_id]))
-                if worker is not None:
-                    distributed.rejoin()
-
-    # close the input file again
-    gfile.close()
-
-    logging.debug("finish reading all grib messages from %s, start construction of arrays..." % filename)
+    # position of all messages by variable, time, ensemble member, and level
+    for one_msg in messages:
+        if one_msg.member != -1:
+            ensemble_members.add(one_msg.member)
+        times.add(one_msg.time)
+        msg_by_var_level_ens.setdefault(one_msg.variable_id, {})[(one_msg.time, one_msg.member, one_msg.level)] = \
+            one_msg.offset
+
+    # number of messages per chunk
+    if chunks is None:
+        chunks = {}
+    elif not isinstance(chunks, dict):
+        chunks = {"time": chunks, "ens": chunks, "level": chunks}
+    if batch_messages and "level" not in chunks:
+        chunks = dict(chunks, level=-1)
+
+    logging.debug("start construction of arrays for %s ..." % filename)
 
     # create the coordinate definition for the dataset
     if len(ensemble_members) > 0:
@@ -308,6 +220,7 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
 
     # create the actual data arrays in a loop over all variables
     xarray_variables = OrderedDict()
+    completeness = OrderedDict()
     for one_var in variables:
         if debug:
             print(one_var)
@@ -335,61 +248,43 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
                 var_shape.append(var_shape_[ishape])
                 var_dim_names.append(var_dim_names_[ishape])
 
-        # loop over all timesteps
-        stacked_times = []
-        for one_time in coordinates["time"][1]:
-            # loop over all ensemble members
-            stacked_ensemble = []
-            if "ens" in coordinates:
-                ensemble_members = coordinates["ens"][1]
-            else:
-                ensemble_members = [-1]
-            for one_ens in ensemble_members:
-                # loop over all levels
-                stacked_levels = []
-                for one_level in var_levels:
-                    msg_key = (one_var, one_level, one_ens, one_time)
-                    if msg_key in msg_by_var_level_ens:
-                        stacked_levels.append(msg_by_var_level_ens[(one_var, one_level, one_ens, one_time)])
-                    else:
-                        stacked_levels.append(dask.array.from_delayed(
-                            dask.delayed(numpy.full)(var_dims, encodings[variable_id]["_FillValue"]),
-                            shape=dimensions[variable_id],
-                            dtype=datatype[variable_id]))
-
-                # combine all levels into one array
-                if len(stacked_levels) > 1:
-                    stacked_levels = dask.array.stack(stacked_levels)
-                elif var_has_meaningful_levels:
-                    stacked_levels = dask.array.reshape(stacked_levels[0], (1,) + stacked_levels[0].shape)
-                else:
-                    stacked_levels = stacked_levels[0]
-
-                # create a list of all ensemble members
-                stacked_ensemble.append(stacked_levels)
-
-            # combine all ensemble members into one array
-            if len(stacked_ensemble) > 1:
-                stacked_ensemble = dask.array.stack(stacked_ensemble)
-            else:
-                stacked_ensemble = stacked_ensemble[0]
-
-            # create a list of all times
-            stacked_times.append(stacked_ensemble)
+        # the level and ensemble dimensions are dropped if they are not needed
+        keep_dim = [var_shape_[ishape] > 1 or var_dim_names_[ishape] == "time" or
+                    (var_dim_names_[ishape] in level_coordinates and var_has_meaningful_levels)
+                    for ishape in range(len(var_shape_))]
 
-        # combine all times into one array
-        if len(stacked_times) > 1:
-            if debug:
-                print(stacked_times)
-                print(one_var)
-            da_var = dask.array.stack(stacked_times)
+        # create the array for all messages of this variable
+        if "ens" in coordinates:
+            var_ensemble_members = coordinates["ens"][1]
         else:
-            da_var = dask.array.reshape(stacked_times[0], (1,) + stacked_times[0].shape)
+            var_ensemble_members = [-1]
+        da_var = __create_variable_array(filename, msg_by_var_level_ens.get(one_var, {}),
+                                         [coordinates["time"][1], var_ensemble_members, var_levels],
+                                         [chunks.get("time"), chunks.get("ens"),
+                                          chunks.get(var_level_coordinate_name, chunks.get("level"))],
+                                         var_dims, datatype[one_var], encodings[one_var]["_FillValue"],
+                                         keep_dim, use_mmap)
+
+        # persist the data into memory
+        if in_memory:
+            if worker is not None:
+                distributed.secede()
+            # if all workers are running on local host, load the data directly. There is no advantage of
+            # delegating the work to other workers.
+            with profiling.timer("persist"):
+                if client is None or all_local:
+                    da_var = da_var.persist(scheduler="synchronous")
+                if client is not None:
+                    da_var = client.persist(da_var)
+            profiling.count("bytes_loaded", da_var.nbytes)
+            if worker is not None:
+                distributed.rejoin()
 
         # finally create the xarray and add it to the dataset
-        # use the level only in the name if the name is otherwise not unique
+        # use the level only in the name if the name is otherwise not unique. All variables of the file are
+        # compared, the names do not depend on the selection.
         name_is_unique = True
-        for one_var_compare in variables:
+        for one_var_compare in index.variables.keys():
             if one_var_compare[0] == one_var[0] and one_var_compare[1] != one_var[1]:
                 name_is_unique = False
                 break
@@ -419,6 +314,15 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
                                                       coords=var_coords)
         xarray_variables[var_name].encoding = encodings[one_var]
 
+        # number of messages present in the file compared to the number of fields in the array
+        completeness[var_name] = (len(msg_by_var_level_ens.get(one_var, {})),
+                                  len(coordinates["time"][1]) * len(var_ensemble_members) * len(var_levels))
+
+        # re-chunk horizontal dimensions if requested
+        horizontal_chunks = {one_dim: chunks[one_dim] for one_dim in dimension_names[one_var] if one_dim in chunks}
+        if len(horizontal_chunks) > 0:
+            xarray_variables[var_name] = xarray_variables[var_name].chunk(horizontal_chunks)
+
         # are there lon-lat values?
         if "cell" in var_dim_names[-1] and "lon" not in xarray_variables and "lon" in coordinates:
             xarray_variables["lon"] = coordinates["lon"]
@@ -458,6 +362,14 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
     if "ens" in coordinates and len(coordinates["ens"][1]) == 1:
         dataset.attrs["ensemble_member"] = coordinates["ens"][1][0]
 
+    # incomplete files? store the number of available messages per variable as attribute
+    if any(present < expected for present, expected in completeness.values()):
+        dataset.attrs["grib_completeness"] = ", ".join("%s: %d/%d" % (var_name, present, expected)
+                                                       for var_name, (present, expected) in
+                                                       sorted(completeness.items(), key=lambda i: i[0].lower()))
+        logging.warning("%s is incomplete, missing messages are filled with the missing value: %s"
+                        % (filename, dataset.attrs["grib_completeness"]))
+
     # add bounds attribute to coordinates
     for one_bounds in level_bounds.keys():
         coordinate_name = one_bounds.replace("_bnds", "")
@@ -468,23 +380,191 @@ def read_grib_file(filename, debug=False, in_memory=False, leadtime_from_filenam
     return dataset
 
 
-def __get_one_message(filename, offset, shape, dtype, missing):
+def __message_selection(variables=None, levels=None, members=None, time=None):
+    """
+    create a filter function for the selection of messages by variable, level, ensemble member and valid time.
+
+    Returns
+    -------
+    callable:
+            function which returns True for every selected MessageInfo object
+    """
+    def as_set(values, convert=lambda x: x):
+        if values is None:
+            return None
+        if isinstance(values, (str, pandas.Timestamp)) or not numpy.iterable(values):
+            values = [values]
+        return set(convert(one_value) for one_value in values)
+
+    variables = as_set(variables)
+    levels = as_set(levels)
+    members = as_set(members, int)
+    time = as_set(time, lambda x: pandas.Timestamp(x).to_pydatetime())
+
+    def selected(msg):
+        if variables is not None and msg.variable_id[0] not in variables \
+                and "%s_%s" % msg.variable_id not in variables:
+            return False
+        if levels is not None and msg.level not in levels:
+            return False
+        if members is not None and msg.member not in members:
+            return False
+        if time is not None and msg.time not in time:
+            return False
+        return True
+    return selected
+
+
+def __create_variable_array(filename, offsets, outer_coords, outer_chunks, shape, dtype, missing, keep_dim,
+                            use_mmap=True):
+    """
+    create a dask array for all messages of one variable. The graph is constructed directly with one task per chunk.
+    Every task loads all messages of its chunk.
+
+    Parameters
+    ----------
+    filename : str
+            name of the grib file
+
+    offsets : dict
+            position of all messages of this variable with (time, member, level) as key
+
+    outer_coords : list
+            values of the time, ensemble and level coordinates
+
+    outer_chunks : list
+            number of messages per chunk along time, ensemble and level dimension. None: 1, -1: all.
+
+    shape : tuple
+            shape of one message
+
+    dtype : numpy.dtype
+            datatype of the result
+
+    missing : float
+            missing value of the variable. Used as value for messages not present in the file.
+
+    keep_dim : list of bool
+            for time, ensemble, level and the horizontal dimensions: is the dimension part of the result? Only
+            dimensions of size one are allowed to be removed.
+
+    use_mmap : bool
+            read the messages from the memory-mapped file.
+
+    Returns
+    -------
+    dask.array.Array
     """
-    get the values of the message at position *imsg* from a grib file
+    # split the outer dimensions into chunks
+    chunk_bounds = []
+    for coord, chunk_size in zip(outer_coords, outer_chunks):
+        if chunk_size is None:
+            chunk_size = 1
+        elif chunk_size == -1 or chunk_size > len(coord):
+            chunk_size = len(coord)
+        chunk_bounds.append([(start, min(start + chunk_size, len(coord))) for start in range(0, len(coord), chunk_size)])
+
+    # chunks of the full array
+    full_chunks = [tuple(end - start for start, end in bounds) for bounds in chunk_bounds]
+    full_chunks.extend((one_size,) for one_size in shape)
+    chunks = tuple(one_chunks for one_chunks, keep in zip(full_chunks, keep_dim) if keep)
+
+    # create one task per chunk
+    name = "grib-" + dask.base.tokenize(filename, os.stat(filename).st_mtime_ns, offsets, outer_coords, full_chunks,
+                                        keep_dim, use_mmap)
+    graph = {}
+    missing_blocks = {}
+    for block_id in itertools.product(*(range(len(bounds)) for bounds in chunk_bounds)):
+        block_coords = [coord[bounds[ib][0]:bounds[ib][1]]
+                        for coord, bounds, ib in zip(outer_coords, chunk_bounds, block_id)]
+        block_offsets = numpy.empty(tuple(len(one_coords) for one_coords in block_coords), dtype=object)
+        for position in itertools.product(*(range(len(one_coords)) for one_coords in block_coords)):
+            block_offsets[position] = offsets.get(tuple(one_coords[ip]
+                                                        for one_coords, ip in zip(block_coords, position)))
+        block_shape = block_offsets.shape + tuple(shape)
+        block_shape = tuple(one_size for one_size, keep in zip(block_shape, keep_dim) if keep)
+        key = (name,) + tuple(ib for ib, keep in zip(block_id + (0,) * len(shape), keep_dim) if keep)
+        if any(one_offset is not None for one_offset in block_offsets.flat):
+            graph[key] = (__get_block, filename, block_offsets, shape, dtype, missing, use_mmap, block_shape)
+        else:
+            # blocks without any message are copies of one read-only constant block of the same shape. The copy
+            # is only allocated when the block is computed, callers may modify computed blocks in place.
+            if block_shape not in missing_blocks:
+                missing_key = ("%s-missing" % name,) + block_shape
+                graph[missing_key] = (__get_missing_block, block_shape, dtype, missing)
+                missing_blocks[block_shape] = missing_key
+            graph[key] = (numpy.copy, missing_blocks[block_shape])
+
+    return dask.array.Array(graph, name, chunks=chunks, dtype=dtype)
+
+
+def __get_block(filename, offsets, shape, dtype, missing, use_mmap=True, block_shape=None):
+    """
+    get the values of multiple messages of the same variable from a grib file. The file is opened only once and the
+    messages are read in the order of their position within the file.
 
     Parameters
     ----------
-    filename
-    imsg
+    filename : str
+            name of the grib file
+
+    offsets : numpy.ndarray
+            object array with the position of each message within the file. None for messages not present in the file.
+
+    shape : tuple
+            shape of one message
+
+    dtype : numpy.dtype
+            datatype of the result
+
+    missing : float
+            missing value of the variable. Used as value for messages not present in the file.
+
+    use_mmap : bool
+            read the messages from the memory-mapped file.
+
+    block_shape : tuple
+            the result is reshaped to this shape. Default: offsets.shape + shape
 
     Returns
     -------
     numpy.ndarray
     """
-    # open the input file, seek the message and read it
-    with io.open(filename, "rb") as gfile:
-        # read and decode the message
-        msg = eccodes_cffi.GribMessage(gfile, offset, read_data=True)
+    offsets = numpy.asarray(offsets, dtype=object)
+    result = numpy.empty(offsets.shape + tuple(shape), dtype=dtype)
+    flat_result = result.reshape((offsets.size,) + tuple(shape))
+    flat_offsets = offsets.ravel()
+    with eccodes_cffi.open_grib_file(filename, use_mmap=use_mmap) as gfile:
+        for index, offset in sorted(enumerate(flat_offsets), key=lambda x: -1 if x[1] is None else x[1]):
+            if offset is None:
+                flat_result[index, ...] = missing
+            else:
+                msg = eccodes_cffi.GribMessage(gfile, offset, read_data=True)
+                flat_result[index, ...] = msg.get_values(shape, dtype, missing)
+                # release the message before the file is closed
+                del msg
+    if block_shape is not None:
+        result = result.reshape(block_shape)
+    return result
+
+
+def __get_missing_block(shape, dtype, missing):
+    """
+    create a read-only block of the given shape filled with the missing value without allocating the full array.
 
-        # decode the actual values
-        return msg.get_values(shape, dtype, missing)
+    Parameters
+    ----------
+    shape : tuple
+            shape of the block
+
+    dtype : numpy.dtype
+            datatype of the result
+
+    missing : float
+            missing value of the variable
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    return numpy.broadcast_to(numpy.array(missing, dtype=dtype), shape)
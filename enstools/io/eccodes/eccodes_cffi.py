@@ -8,7 +8,10 @@ import struct
 import threading
 import platform
 import logging
+import mmap
+import io
 import os
+from contextlib import contextmanager
 
 # initialize the interface to the C-Library
 ffi = cffi.FFI()
@@ -29,6 +32,7 @@ ffi.cdef("int codes_get_size(codes_handle* h, const char* key, size_t* size);")
 ffi.cdef("int codes_get_long_array(codes_handle* h, const char* key, long* vals, size_t* length);")
 ffi.cdef("int codes_get_double_array(codes_handle* h, const char* key, double* vals, size_t* length);")
 ffi.cdef("int grib_get_native_type(codes_handle* h, const char* name, int* type);")
+ffi.cdef("int codes_get_features(char* result, size_t* length, int select);")
 
 # functions for key-iterators
 ffi.cdef("codes_keys_iterator* codes_keys_iterator_new(codes_handle *h, unsigned long filter_flags, const char* name_space);")
@@ -126,8 +130,171 @@ standard_keys = ['bitsPerValue',
                  'validityDate',
                  'validityTime']
 
-# allow only one read per time
+# keys required to construct the rotated pole description of rotated_ll grids
+rotated_ll_keys = ['latitudeOfSouthernPoleInDegrees',
+                   'longitudeOfSouthernPoleInDegrees',
+                   'longitudeOfFirstGridPointInDegrees',
+                   'longitudeOfLastGridPointInDegrees',
+                   'latitudeOfFirstGridPointInDegrees',
+                   'latitudeOfLastGridPointInDegrees',
+                   'Ni',
+                   'Nj']
+
+
+
+def _library_is_thread_safe():
+    """
+    check whether or not the eccodes library was compiled with thread support. Older versions without the function
+    codes_get_features are assumed to be not thread-safe.
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        features = ffi.new("char[1024]")
+        length = ffi.new("size_t[1]", init=[1024])
+        # 1 is the value of the C-constant CODES_FEATURES_ENABLED
+        if _eccodes.codes_get_features(features, length, 1) != 0:
+            return False
+    except (AttributeError, NameError):
+        return False
+    enabled = ffi.string(features).decode("utf-8").split()
+    return "ECCODES_THREADS" in enabled or "ECCODES_OMP_THREADS" in enabled
+
+
+# allow only one read per time. One lock per message showed no measurable speedup of read(...).compute() with up to
+# 8 threads, decoding in parallel is therefore only used if selected with set_parallel_decoding.
 read_msg_lock = threading.Lock()
+parallel_decoding = False
+
+
+def set_parallel_decoding(enabled):
+    """
+    select the locking model for the decoding of grib messages. This affects only messages created afterwards.
+    Default: one global lock.
+
+    Parameters
+    ----------
+    enabled : bool
+            True: every message is protected by its own lock, different messages are decoded concurrently. This
+            requires an eccodes library compiled with thread support. False: all calls into the eccodes library are
+            serialised by one global lock.
+    """
+    global parallel_decoding
+    if enabled and not _library_is_thread_safe():
+        logging.warning("the eccodes library was compiled without thread support, parallel decoding not possible!")
+        enabled = False
+    parallel_decoding = enabled
+
+
+def _new_message_lock():
+    """
+    get the lock for a new message depending on the selected locking model.
+    """
+    if parallel_decoding:
+        return threading.Lock()
+    return read_msg_lock
+
+
+# error code returned by eccodes for keys not available in a message
+GRIB_NOT_FOUND = -10
+
+# native types of keys by edition and key name. The types are requested only once from the library.
+_native_types = {}
+
+
+class KeyReader():
+    """
+    read a fixed set of scalar keys from messages in one pass. The key names are converted into C-strings only once,
+    the buffers for the results are allocated only once per thread and the native type of each key is looked up in a
+    table shared by all readers.
+
+    The library exports no function to read multiple keys with one call, every key still costs one call per message.
+    Most of the time is spent inside the library: the concept keys (shortName, cfVarName) and the search for keys not
+    defined in a message (e.g., keys of GRIB1 in GRIB2 messages) take about ten times longer than other keys. The
+    reader is only about 1.2-1.3x faster than reading the keys one by one (benchmarks/benchmark_io_grib_keys.py).
+    """
+    def __init__(self, keys):
+        """
+        Parameters
+        ----------
+        keys : list
+                names of the keys to read
+        """
+        self.keys = list(keys)
+        self.ckeys = [ffi.new("char[]", one_key.encode("utf-8")) for one_key in self.keys]
+        self.local = threading.local()
+
+    def __buffers(self):
+        """
+        get the result buffers of the calling thread
+        """
+        if not hasattr(self.local, "buffers"):
+            self.local.buffers = (ffi.new("long[1]"), ffi.new("double[1]"), ffi.new("char[1024]"),
+                                  ffi.new("size_t[1]"), ffi.new("int[1]"))
+        return self.local.buffers
+
+    def read(self, handle):
+        """
+        read all keys from one message. The caller is responsible for locking.
+
+        Parameters
+        ----------
+        handle : codes_handle*
+                handle of the message
+
+        Returns
+        -------
+        tuple:
+                (values, failed). values is a dictionary with the values of all keys read successfully and None for
+                keys not available in the message. failed is a list of keys which could not be read as scalar value,
+                e.g., arrays.
+        """
+        long_value, double_value, string_value, length, itype = self.__buffers()
+        values = {}
+        failed = []
+        # the types of keys may differ between the editions
+        err = _eccodes.codes_get_long(handle, b"editionNumber", long_value)
+        edition = long_value[0] if err == 0 else None
+        for one_key, ckey in zip(self.keys, self.ckeys):
+            # the edition is not read twice
+            if one_key == "editionNumber" and edition is not None:
+                values[one_key] = edition
+                continue
+            key_type = _native_types.get((edition, one_key))
+            if key_type is None:
+                err = _eccodes.grib_get_native_type(handle, ckey, itype)
+                if err == GRIB_NOT_FOUND:
+                    values[one_key] = None
+                    continue
+                elif err != 0:
+                    failed.append(one_key)
+                    continue
+                key_type = itype[0]
+                _native_types[(edition, one_key)] = key_type
+            if key_type == 1:
+                err = _eccodes.codes_get_long(handle, ckey, long_value)
+                value = long_value[0]
+            elif key_type == 2:
+                err = _eccodes.codes_get_double(handle, ckey, double_value)
+                value = double_value[0]
+            else:
+                length[0] = 1024
+                err = _eccodes.codes_get_string(handle, ckey, string_value, length)
+                if err == 0:
+                    value = ffi.string(string_value, length[0]).decode("utf-8")
+            if err == 0:
+                values[one_key] = value
+            elif err == GRIB_NOT_FOUND:
+                values[one_key] = None
+            else:
+                failed.append(one_key)
+        return values, failed
+
+
+# reader for the keys pre-read from every message
+standard_key_reader = KeyReader(standard_keys)
 
 
 # A representation of one grib message
@@ -139,37 +306,48 @@ class GribMessage():
 
         Parameters
         ----------
-        file : file-object
-                a file object which points already to the beginning of the message
+        file : file-object or mmap.mmap
+                a file object which points already to the beginning of the message. For memory-mapped files, the
+                message is not copied, the eccodes handle is created directly on the mapped memory.
 
         offset : int
                 position of the file where the message starts
 
         read_data : bool
-                False: read only the header of the message.
+                False: read only the header of the message. Memory-mapped messages have always access to the data.
         """
         # cache for all read operations of keys
         self.cache = {}
         self.has_data = read_data
+        self.lock = _new_message_lock()
 
         # read the content of the message
-        self.buffer = _read_message_raw_data(file, offset, read_data=read_data)
+        if isinstance(file, mmap.mmap):
+            self.buffer, self.offset = _read_message_from_mmap(file, offset)
+            self.has_data = True
+        else:
+            self.buffer, self.offset = _read_message_raw_data(file, offset, read_data=read_data)
         # was there a message?
         if self.buffer is None:
             self.handle = ffi.NULL
             return
+        self.length = len(self.buffer)
 
         # decode the message
-        with read_msg_lock:
+        with self.lock:
             # read the message itself
             self.handle = _eccodes.codes_handle_new_from_message(ffi.NULL, ffi.from_buffer(self.buffer), len(self.buffer))
 
-            # pre-read common keys and don't care for errors
-            for one_key in standard_keys:
-                try:
-                    self.__getitem__(one_key, use_lock=False)
-                except:
-                    pass
+            # pre-read common keys in one pass and don't care for errors. Keys not readable as scalar are read
+            # individually.
+            if self.handle != ffi.NULL:
+                values, failed = standard_key_reader.read(self.handle)
+                self.cache.update(values)
+                for one_key in failed:
+                    try:
+                        self.__getitem__(one_key, use_lock=False)
+                    except KeyError:
+                        pass
 
             # pre-read the values also if we read the data in memory
             if read_data:
@@ -189,7 +367,7 @@ class GribMessage():
             try:
                 # lock if we do not yet have a lock from a calling function
                 if use_lock:
-                    read_msg_lock.acquire()
+                    self.lock.acquire()
 
                 # read the key
                 ckey = _cstr(item)
@@ -207,7 +385,7 @@ class GribMessage():
             finally:
                 # unlock if locked
                 if use_lock:
-                    read_msg_lock.release()
+                    self.lock.release()
             return value
 
     def __contains__(self, item):
@@ -234,7 +412,7 @@ class GribMessage():
                 list of strings with the names of the keys
         """
         result = []
-        with read_msg_lock:
+        with self.lock:
             # 128 is the value of the C-constant GRIB_KEYS_ITERATOR_DUMP_ONLY and reduces the set of keys to those
             # really available
             kiter = _eccodes.codes_keys_iterator_new(self.handle, 128, ffi.NULL)
@@ -348,39 +526,12 @@ class GribMessage():
 
         Returns
         -------
-
+        tuple:
+                (name of the rotated pole variable, rotated pole, rlat, rlon)
         """
         if self["gridType"] != "rotated_ll":
             raise ValueError("The gridType '%s' has not rotated pole!" % self["gridType"])
-        rotated_pole_name = "rotated_pole"
-        if not dim_names[0].endswith("t"):
-            rotated_pole_name += dim_names[0][-1]
-        # create rotated pole description
-        rotated_pole = xarray.DataArray(np.zeros(1, dtype=np.int8), dims=(rotated_pole_name,))
-        rotated_pole.attrs["grid_mapping_name"] = "rotated_latitude_longitude"
-        rotated_pole.attrs["grid_north_pole_latitude"] = self["latitudeOfSouthernPoleInDegrees"] * -1
-        rotated_pole.attrs["grid_north_pole_longitude"] = self["longitudeOfSouthernPoleInDegrees"] - 180
-        # create rotated coordinate arrays
-        # perform calculations on large integers to avoid rounding errors
-        factor = 10 ** 10
-        first_lon = int(self["longitudeOfFirstGridPointInDegrees"] * factor)
-        last_lon = int(self["longitudeOfLastGridPointInDegrees"] * factor)
-        first_lat = int(self["latitudeOfFirstGridPointInDegrees"] * factor)
-        last_lat = int(self["latitudeOfLastGridPointInDegrees"] * factor)
-        if last_lon < first_lon and first_lon > 180 * factor:
-            first_lon -= 360 * factor
-        # using linspace instead of array and the stored increment to ensure the correct number of values.
-        rlon_int = np.linspace(first_lon, last_lon, self["Ni"], dtype=np.int64)
-        rlon = xarray.DataArray(np.asarray(rlon_int / factor, dtype=np.float32), dims=(dim_names[-1],))
-        rlon.attrs["long_name"] = "longitude in rotated pole grid"
-        rlon.attrs["units"] = "degrees"
-        rlon.attrs["standard_name"] = "grid_longitude"
-        rlat_int = np.linspace(first_lat, last_lat, self["Nj"], dtype=np.int64)
-        rlat = xarray.DataArray(np.asarray(rlat_int / factor, dtype=np.float32), dims=(dim_names[-2],))
-        rlat.attrs["long_name"] = "latitude in rotated pole grid"
-        rlat.attrs["units"] = "degrees"
-        rlat.attrs["standard_name"] = "grid_latitude"
-        return rotated_pole_name, rotated_pole, rlat, rlon
+        return rotated_ll_info_from_keys({key: self[key] for key in rotated_ll_keys}, dim_names)
 
     def get_level(self):
         """
@@ -537,12 +688,64 @@ class GribMessage():
         """
         free up the memory
         """
-        with read_msg_lock:
+        with self.lock:
             if self.handle != ffi.NULL:
                 err = _eccodes.codes_handle_delete(self.handle)
                 self.handle = ffi.NULL
                 if err != 0:
                     raise ValueError("unable to free memory of grib message!")
+            # views into memory-mapped files have to be released before the file can be closed
+            if isinstance(self.buffer, memoryview):
+                self.buffer.release()
+
+
+def rotated_ll_info_from_keys(keys, dim_names):
+    """
+    create the rotated pole and the rotated lon/lat coordinates from the values of the grib keys listed in
+    *rotated_ll_keys*. This allows the construction without access to the grib message itself.
+
+    Parameters
+    ----------
+    keys : dict
+            values of all keys in *rotated_ll_keys*
+
+    dim_names : list
+            names of the rlat and rlon dimensions
+
+    Returns
+    -------
+    tuple:
+            (name of the rotated pole variable, rotated pole, rlat, rlon)
+    """
+    rotated_pole_name = "rotated_pole"
+    if not dim_names[0].endswith("t"):
+        rotated_pole_name += dim_names[0][-1]
+    # create rotated pole description
+    rotated_pole = xarray.DataArray(np.zeros(1, dtype=np.int8), dims=(rotated_pole_name,))
+    rotated_pole.attrs["grid_mapping_name"] = "rotated_latitude_longitude"
+    rotated_pole.attrs["grid_north_pole_latitude"] = keys["latitudeOfSouthernPoleInDegrees"] * -1
+    rotated_pole.attrs["grid_north_pole_longitude"] = keys["longitudeOfSouthernPoleInDegrees"] - 180
+    # create rotated coordinate arrays
+    # perform calculations on large integers to avoid rounding errors
+    factor = 10 ** 10
+    first_lon = int(keys["longitudeOfFirstGridPointInDegrees"] * factor)
+    last_lon = int(keys["longitudeOfLastGridPointInDegrees"] * factor)
+    first_lat = int(keys["latitudeOfFirstGridPointInDegrees"] * factor)
+    last_lat = int(keys["latitudeOfLastGridPointInDegrees"] * factor)
+    if last_lon < first_lon and first_lon > 180 * factor:
+        first_lon -= 360 * factor
+    # using linspace instead of array and the stored increment to ensure the correct number of values.
+    rlon_int = np.linspace(first_lon, last_lon, keys["Ni"], dtype=np.int64)
+    rlon = xarray.DataArray(np.asarray(rlon_int / factor, dtype=np.float32), dims=(dim_names[-1],))
+    rlon.attrs["long_name"] = "longitude in rotated pole grid"
+    rlon.attrs["units"] = "degrees"
+    rlon.attrs["standard_name"] = "grid_longitude"
+    rlat_int = np.linspace(first_lat, last_lat, keys["Nj"], dtype=np.int64)
+    rlat = xarray.DataArray(np.asarray(rlat_int / factor, dtype=np.float32), dims=(dim_names[-2],))
+    rlat.attrs["long_name"] = "latitude in rotated pole grid"
+    rlat.attrs["units"] = "degrees"
+    rlat.attrs["standard_name"] = "grid_latitude"
+    return rotated_pole_name, rotated_pole, rlat, rlon
 
 
 def _cstr(pstr):
@@ -563,6 +766,83 @@ def _cstr(pstr):
     return result
 
 
+@contextmanager
+def open_grib_file(filename, use_mmap=True):
+    """
+    open a grib file for reading messages with GribMessage.
+
+    Parameters
+    ----------
+    filename : str
+            name of the file to open
+
+    use_mmap : bool
+            map the file into memory. Messages are then used without copying them. Empty files and file systems
+            without support for memory mapping fall back to normal file access.
+
+    Returns
+    -------
+    mmap.mmap or file-object
+    """
+    with io.open(filename, "rb") as infile:
+        mapped = None
+        if use_mmap:
+            try:
+                mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                mapped = None
+        if mapped is None:
+            yield infile
+        else:
+            try:
+                yield mapped
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # some messages are still in use, the memory is unmapped when the last of them is deleted.
+                    pass
+
+
+def _read_message_from_mmap(mapped, offset):
+    """
+    find a grib message within a memory-mapped file and return a view on it without copying any data.
+
+    Parameters
+    ----------
+    mapped : mmap.mmap
+            the memory-mapped file
+
+    offset : int
+            position within the file where the search for the next message starts
+
+    Returns
+    -------
+    tuple:
+            (memoryview or None, position of the message within the file)
+    """
+    # find the start word GRIB. Allow up to 1k junk in front of the actual message
+    istart = mapped.find(b"GRIB", offset, offset + 1024)
+    if istart == -1 or istart + 16 > len(mapped):
+        return None, offset
+    offset = istart
+
+    # get the length of the total message depending on the edition
+    edition = mapped[offset + 7]
+    if edition == 1:
+        length_total = struct.unpack(">I", b'\x00' + mapped[offset + 4:offset + 7])[0]
+        # check if the length is correct, the message is supposed to end with 7777. See _read_message_raw_data.
+        if mapped[offset + length_total - 4:offset + length_total] != b"7777":
+            endpos = mapped.find(b"7777", offset, offset + 16777216)
+            if endpos == -1:
+                return None, offset
+            length_total = endpos - offset + 4
+    else:
+        length_total = struct.unpack(">Q", mapped[offset + 8:offset + 16])[0]
+
+    return memoryview(mapped)[offset:offset + length_total], offset
+
+
 def _read_message_raw_data(infile, offset, read_data=False):
     """
     Read the header of a grib message and return an byte array with the length of the full message, but without
@@ -570,18 +850,26 @@ def _read_message_raw_data(infile, offset, read_data=False):
 
     Parameters
     ----------
-    infile
+    infile : file-object
+            file to read from
+
+    offset : int
+            position within the file where the search for the next message starts
+
+    read_data : bool
+            False: the data section is not read.
 
     Returns
     -------
-
+    tuple:
+            (message bytes or None, position of the message within the file)
     """
     # find the start word GRIB. Allow up to 1k junk in front of the actual message
     infile.seek(offset)
     start = infile.read(1024)
     istart = start.find(b"GRIB")
     if istart == -1:
-        return None
+        return None, offset
     offset += istart
 
     # find at first the grib edition to account for different formats
@@ -605,7 +893,7 @@ def _read_message_raw_data(infile, offset, read_data=False):
             maxdata = infile.read(16777216)
             endpos = maxdata.find(b"7777")
             if endpos == -1:
-                return None
+                return None, offset
             else:
                 length_total = endpos + 4
                 read_data = True
@@ -619,7 +907,7 @@ def _read_message_raw_data(infile, offset, read_data=False):
         # read the complete message?
         if read_data:
             infile.readinto(memoryview(bytes[8:]))
-            return bytes
+            return bytes, offset
 
         # read the first sections, but not the data
         for sec in range(1, 5):
@@ -652,7 +940,7 @@ def _read_message_raw_data(infile, offset, read_data=False):
         # read the complete message?
         if read_data:
             infile.readinto(memoryview(bytes[16:]))
-            return bytes
+            return bytes, offset
 
         # read the first sections, but not the data.
         # For standard binary data, we don't read the data section. For other formats we do to avoid decoding errors.
@@ -681,4 +969,4 @@ def _read_message_raw_data(infile, offset, read_data=False):
                     data_representation = struct.unpack(">H", bytes[pos+9:pos+11].tobytes())[0]
                 pos = pos + length_sec
 
-    return bytes
+    return bytes, offset
@@ -0,0 +1,174 @@
+"""
+Field by field access to grib files without the construction of an xarray.Dataset. Only one decoded field (or a small
+number of fields if read-ahead is enabled) is kept in memory at any time.
+"""
+from collections import namedtuple
+import threading
+import queue
+import numpy
+import pandas
+from . import eccodes_cffi
+from .index import get_index
+
+# one decoded message together with its position within the ensemble
+GribField = namedtuple("GribField", ["variable_id", "name", "level", "member", "time", "values", "attrs"])
+
+
+def iter_grib_fields(filename, filter=None, read_ahead=0, leadtime_from_filename=False, use_index=True, index_dir=None,
+                     use_mmap=True):
+    """
+    iterate over all fields of a grib file. The messages are selected based on the header information stored in the
+    grib index. Only the payload of selected messages is decoded.
+
+    Parameters
+    ----------
+    filename : str
+            name of the grib file
+
+    filter : dict or callable
+            selection of messages. A dictionary may contain the keys name, typeOfLevel, level, member, and time. The
+            values are either single values or lists of allowed values. Values of time are datetime-like, e.g.,
+            datetime, numpy.datetime64, or str. A callable is called with the MessageInfo object of each message and
+            returns True for messages to decode. Default: all messages.
+
+    read_ahead : int
+            number of fields decoded in advance by a background thread. 0 (default): fields are decoded when requested.
+
+    leadtime_from_filename : bool
+            calculate the valid time from the lead time in the file name (COSMO).
+
+    use_index : bool
+            use or create a persistent index of the file.
+
+    index_dir : str
+            folder for index files. Default: subfolder grib-index within the enstools cache directory.
+
+    use_mmap : bool
+            map the file into memory for scanning and decoding.
+
+    Yields
+    ------
+    GribField
+            variable id, name, level, ensemble member (-1 if not available), valid time, values, and attributes of one
+            message. Messages are returned in the order of their position within the file.
+
+    Examples
+    --------
+    >>> for field in iter_grib_fields("forecast.grib2", filter={"name": "t", "level": [500, 850]}):  # doctest: +SKIP
+    ...     print(field.member, field.values.mean())
+    """
+    index = get_index(filename, leadtime_from_filename=leadtime_from_filename, index_dir=index_dir,
+                      use_index=use_index, use_mmap=use_mmap)
+    messages = sorted(filter_messages(index.messages, filter), key=lambda x: x.offset)
+
+    if read_ahead is None or read_ahead <= 0:
+        yield from __decode_fields(index, messages, use_mmap)
+        return
+
+    # decode the fields in a background thread. The size of the queue limits the memory usage.
+    fields = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+    end_of_file = object()
+
+    def reader():
+        try:
+            for field in __decode_fields(index, messages, use_mmap):
+                if not __put(fields, field, stop):
+                    return
+            __put(fields, end_of_file, stop)
+        except BaseException as ex:
+            __put(fields, ex, stop)
+
+    thread = threading.Thread(target=reader, name="grib-read-ahead", daemon=True)
+    thread.start()
+    try:
+        while True:
+            field = fields.get()
+            if field is end_of_file:
+                break
+            if isinstance(field, BaseException):
+                raise field
+            yield field
+    finally:
+        # the consumer stopped early or the reader failed: let the reader end and wait for it
+        stop.set()
+        thread.join()
+
+
+def filter_messages(messages, filter=None):
+    """
+    select messages based on header information.
+
+    Parameters
+    ----------
+    messages : list of MessageInfo
+            all messages of a grib index
+
+    filter : dict or callable
+            see iter_grib_fields
+
+    Returns
+    -------
+    list of MessageInfo
+    """
+    if filter is None:
+        return list(messages)
+    if callable(filter):
+        return [one_msg for one_msg in messages if filter(one_msg)]
+
+    # convert all filter values to sets
+    getters = {"name": lambda x: x.variable_id[0],
+               "typeOfLevel": lambda x: x.variable_id[1],
+               "level": lambda x: x.level,
+               "member": lambda x: x.member,
+               "time": lambda x: x.time}
+    allowed = {}
+    for key, values in filter.items():
+        if key not in getters:
+            raise ValueError("unsupported filter key '%s', supported are: %s" % (key, ", ".join(getters.keys())))
+        if not isinstance(values, (list, tuple, set, numpy.ndarray)):
+            values = [values]
+        # times of messages are datetime objects, numpy.datetime64 values would never match them
+        if key == "time":
+            values = [__to_datetime(one_value) for one_value in values]
+        allowed[key] = set(values)
+    return [one_msg for one_msg in messages
+            if all(getters[key](one_msg) in values for key, values in allowed.items())]
+
+
+def __to_datetime(value):
+    """
+    convert a datetime-like value of a time filter into a datetime object.
+    """
+    try:
+        return pandas.Timestamp(value).to_pydatetime()
+    except (TypeError, ValueError):
+        raise ValueError("unable to convert the value '%s' of the time filter into a datetime" % (value,))
+
+
+def __decode_fields(index, messages, use_mmap):
+    """
+    decode the selected messages one by one with a single file handle.
+    """
+    with eccodes_cffi.open_grib_file(index.filename, use_mmap=use_mmap) as gfile:
+        for one_msg in messages:
+            var_info = index.variables[one_msg.variable_id]
+            msg = eccodes_cffi.GribMessage(gfile, one_msg.offset, read_data=True)
+            values = msg.get_values(var_info["shape"], var_info["dtype"], var_info["fill_value"])
+            # release the message before the file is closed
+            del msg
+            yield GribField(one_msg.variable_id, one_msg.variable_id[0], one_msg.level, one_msg.member, one_msg.time,
+                            values, dict(var_info["attrs"]))
+
+
+def __put(fields, item, stop):
+    """
+    put an item into the queue unless the consumer has stopped. Returns False if the consumer has stopped.
+    """
+    while not stop.is_set():
+        try:
+            fields.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
@@ -0,0 +1,511 @@
+"""
+Persistent index of the messages within a grib file. The index holds all header information required to construct
+an xarray.Dataset from a grib file. Once written, later reads of the same file do not need to decode any message.
+"""
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+import hashlib
+import logging
+import json
+import os
+import threading
+import numpy
+from enstools.core import get_cache_dir
+from . import eccodes_cffi
+from .. import profiling
+from ..manifest import parse_leadtime
+
+# position and dimension information of one message
+MessageInfo = namedtuple("MessageInfo", ["offset", "length", "variable_id", "level", "member", "time"])
+
+
+class CoordinateCache:
+    """
+    Coordinate arrays of recently used grids. The arrays are identified by the md5 sum of the grid definition section,
+    the name of the coordinate and its dimensions. Files on the same grid share one read-only array object for each
+    coordinate. This avoids recomputing the coordinates for every file and makes the comparison of the coordinates
+    during the merge of datasets cheap.
+    """
+    def __init__(self, maxsize=64):
+        """
+        Parameters
+        ----------
+        maxsize : int
+                maximal number of arrays kept in the cache. The least recently used array is removed first.
+        """
+        self.maxsize = maxsize
+        self.arrays = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, grid_hash, name, dims):
+        """
+        get a coordinate array from the cache. Returns None if not found.
+        """
+        if grid_hash is None:
+            return None
+        key = (grid_hash, name, tuple(numpy.atleast_1d(dims)))
+        with self.lock:
+            values = self.arrays.get(key)
+            if values is not None:
+                self.arrays.move_to_end(key)
+        return values
+
+    def put(self, grid_hash, name, dims, values):
+        """
+        store a coordinate array in the cache. If the array is already present, the cached object is returned.
+
+        Returns
+        -------
+        numpy.ndarray:
+                the read-only array stored in the cache
+        """
+        if grid_hash is None:
+            return values
+        key = (grid_hash, name, tuple(numpy.atleast_1d(dims)))
+        with self.lock:
+            if key in self.arrays:
+                self.arrays.move_to_end(key)
+                return self.arrays[key]
+            values = numpy.asarray(values)
+            values.flags.writeable = False
+            self.arrays[key] = values
+            while len(self.arrays) > self.maxsize:
+                self.arrays.popitem(last=False)
+        return values
+
+    def clear(self):
+        """
+        remove all arrays from the cache
+        """
+        with self.lock:
+            self.arrays.clear()
+
+
+# coordinates shared by all grib files
+coordinate_cache = CoordinateCache()
+
+
+class GribIndex:
+    """
+    Header information of all messages within one grib file.
+
+    Attributes
+    ----------
+    messages : list of MessageInfo
+            offset, length, variable id, level, ensemble member and valid time of every supported message.
+
+    variables : OrderedDict
+            per variable id: shape, dimension names, datatype, attributes, encoding, levels and rotated pole keys.
+
+    coordinates : OrderedDict
+            horizontal coordinates found in the file in the format name: (dims, values).
+
+    grid_hashes : dict
+            md5 sum of the grid definition section for every coordinate. Used as key for the coordinate cache.
+    """
+
+    # increased whenever the content of the index changes
+    version = 2
+
+    def __init__(self, filename, leadtime_from_filename=False, leadtime=None):
+        self.filename = os.path.abspath(filename)
+        stat = os.stat(self.filename)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        self.leadtime_from_filename = leadtime_from_filename
+        self.leadtime = leadtime
+        self.messages = []
+        self.variables = OrderedDict()
+        self.coordinates = OrderedDict()
+        self.grid_hashes = {}
+
+    @classmethod
+    def scan(cls, filename, leadtime_from_filename=False, use_mmap=True, leadtime=None):
+        """
+        read the header of all messages within a grib file.
+
+        Parameters
+        ----------
+        filename : str
+                name of the file to read
+
+        leadtime_from_filename : bool
+                COSMO-GRIB1-Files do not contain exact times. If this argument is set, then the timestamp is calculated
+                from the init time and the lead time from the file name.
+
+        use_mmap : bool
+                map the file into memory instead of reading the header of every message into a new buffer.
+
+        leadtime : datetime.timedelta
+                lead time used with leadtime_from_filename, e.g., from the manifest of read. Default: parsed from the
+                file name.
+
+        Returns
+        -------
+        GribIndex
+        """
+        index = cls(filename, leadtime_from_filename=leadtime_from_filename, leadtime=leadtime)
+        filename = index.filename
+
+        # dictionaries used by GribMessage.get_dimension to create unique dimension names
+        dimensions = {}
+        dimension_names = {}
+
+        # list of skipped grid types
+        skipped_grids = set()
+
+        # loop to select all messages
+        logging.debug("start reading all grib messages from %s ..." % filename)
+        offset = 0
+        with eccodes_cffi.open_grib_file(filename, use_mmap=use_mmap) as gfile:
+            while True:
+                # create an empty message from the message raw data.
+                msg = eccodes_cffi.GribMessage(gfile, offset, read_data=False)
+                if not msg.is_valid():
+                    break
+                # the next message starts behind the current one
+                offset = msg.offset + msg.length
+
+                # skip messages on unsupported grids
+                if msg["gridType"] not in ["sh", "regular_ll", "rotated_ll", "reduced_gg", "unstructured_grid"]:
+                    if msg["gridDefinitionDescription"] not in skipped_grids:
+                        skipped_grids.add(msg["gridDefinitionDescription"])
+                        logging.warning("skipping grib message due to unsupported grid: %s" % msg["gridDefinitionDescription"])
+                    continue
+
+                # record the name and all variable related information
+                variable_id = (msg.get_name(prefer_cf=False), msg["typeOfLevel"])
+                if variable_id not in index.variables:
+                    dimensions[variable_id], dimension_names[variable_id] = msg.get_dimension(dimensions, dimension_names)
+                    index.variables[variable_id] = index.__variable_info(msg, dimensions[variable_id], dimension_names[variable_id])
+                var_info = index.variables[variable_id]
+
+                # make a list of all levels
+                if msg["level"] not in var_info["levels"]:
+                    var_info["levels"][msg["level"]] = msg.get_level()
+
+                # horizontal coordinates for unstaggered variables
+                var_dim_names = var_info["dims"]
+                coordinates = index.coordinates
+                if "lon" not in coordinates and not "srlon" in var_dim_names and not "srlat" in var_dim_names:
+                    index.__add_coordinates(msg, var_dim_names, "lon", "lat")
+
+                # for staggered vartiable add slonu/v and slatu/v
+                if var_dim_names[0] == "rlat" and var_dim_names[1] == "srlon" and "slonu" not in coordinates:
+                    index.__add_coordinates(msg, var_dim_names, "slonu", "slatu")
+                if var_dim_names[0] == "srlat" and var_dim_names[1] == "rlon" and "slonv" not in coordinates:
+                    index.__add_coordinates(msg, var_dim_names, "slonv", "slatv")
+
+                # find the ensemble member of this message
+                for ensemble_member_key in ["localActualNumberOfEnsembleNumber", "perturbationNumber"]:
+                    if ensemble_member_key in msg:
+                        ensemble_member = msg[ensemble_member_key]
+                        break
+                    else:
+                        ensemble_member = -1
+
+                # store the position of the message for later retrieval
+                index.messages.append(MessageInfo(msg.offset, msg.length, variable_id, msg["level"], ensemble_member,
+                                                  index.__valid_time(msg)))
+
+            # release the last message before the file is closed
+            del msg
+
+        logging.debug("finish reading all grib messages from %s" % filename)
+        profiling.count("grib_files_scanned")
+        profiling.count("grib_messages_scanned", len(index.messages))
+        profiling.count("grib_bytes_scanned", offset)
+        return index
+
+    def __add_coordinates(self, msg, dim_names, lon_name, lat_name):
+        """
+        add the longitude and latitude coordinates of a message. The coordinates are only calculated if the grid is
+        not yet in the coordinate cache.
+        """
+        try:
+            grid_hash = msg["md5GridSection"]
+        except KeyError:
+            grid_hash = None
+
+        # the dimensions of the coordinates depend on the grid type
+        if msg["gridType"] in ["sh", "reduced_gg", "unstructured_grid"]:
+            lon_dims, lat_dims = dim_names[0], dim_names[0]
+        elif msg["gridType"] == "rotated_ll":
+            lon_dims, lat_dims = dim_names, dim_names
+        else:
+            lon_dims, lat_dims = dim_names[1], dim_names[0]
+        lon_values = coordinate_cache.get(grid_hash, lon_name, lon_dims)
+        lat_values = coordinate_cache.get(grid_hash, lat_name, lat_dims)
+        if lon_values is not None and lat_values is not None:
+            coord_lon, coord_lat = (lon_dims, lon_values), (lat_dims, lat_values)
+        else:
+            coord_lon, coord_lat = msg.get_coordinates(dim_names)
+            if coord_lon is None or coord_lat is None:
+                return
+            coord_lon = (coord_lon[0], coordinate_cache.put(grid_hash, lon_name, coord_lon[0], coord_lon[1]))
+            coord_lat = (coord_lat[0], coordinate_cache.put(grid_hash, lat_name, coord_lat[0], coord_lat[1]))
+        self.coordinates[lon_name], self.coordinates[lat_name] = coord_lon, coord_lat
+        self.grid_hashes[lon_name], self.grid_hashes[lat_name] = grid_hash, grid_hash
+
+    def __variable_info(self, msg, shape, dim_names):
+        """
+        collect all information of a variable which is stored only once per variable.
+        """
+        # select a datatype based on the number of bits per value in the grib message
+        if msg["bitsPerValue"] > 32:
+            dtype = numpy.float64
+        else:
+            dtype = numpy.float32
+
+        # collect attributes of this variables
+        attrs = OrderedDict()
+        attrs["units"] = msg["parameterUnits"]
+        attrs["long_name"] = msg["parameterName"]
+        # add alternative names
+        if "cfName" in msg and msg["cfName"] != "unknown":
+            attrs["standard_name"] = msg["cfName"]
+        if "cfVarName" in msg and msg["cfVarName"] != "unknown":
+            attrs["cf_short_name"] = msg["cfVarName"]
+        if "shortName" in msg and msg["shortName"] != "unknown":
+            attrs["short_name"] = msg["shortName"]
+
+        attrs["grid_type"] = msg["gridType"]
+        # information about the rotated pole?
+        rotated_ll = None
+        if msg["gridType"] == "rotated_ll":
+            rotated_ll = {key: msg[key] for key in eccodes_cffi.rotated_ll_keys}
+            attrs["grid_mapping"] = eccodes_cffi.rotated_ll_info_from_keys(rotated_ll, dim_names)[0]
+        elif msg["gridType"] in ["reduced_gg", "unstructured_grid"]:
+            attrs["coordinates"] = "lon lat"
+
+        # grib edition specific attributes
+        if msg["editionNumber"] == 1:
+            attrs["code"] = msg["indicatorOfParameter"]
+            attrs["table"] = msg["table2Version"]
+        elif msg["editionNumber"] == 2:
+            attrs["discipline"] = msg["discipline"]
+            attrs["parameterCategory"] = msg["parameterCategory"]
+            attrs["parameterNumber"] = msg["parameterNumber"]
+
+        return {"shape": tuple(shape),
+                "dims": list(dim_names),
+                "dtype": dtype,
+                "fill_value": dtype(msg["missingValue"]),
+                "attrs": attrs,
+                "rotated_ll": rotated_ll,
+                "levels": OrderedDict()}
+
+    def __valid_time(self, msg):
+        """
+        get the valid time stamp of a message
+        """
+        if self.leadtime_from_filename:
+            if self.leadtime is None:
+                self.leadtime = parse_leadtime(self.filename)
+                if self.leadtime is None:
+                    raise IOError("unable to read leadtime from filename: %s" % self.filename)
+            initDate = "%08d%04d" % (msg["dataDate"], int(msg["dataTime"]))
+            if initDate.startswith("0000"):
+                initDate = "2" + initDate[1:]
+            time_stamp = datetime.strptime(initDate, "%Y%m%d%H%M")
+            time_stamp += self.leadtime
+        else:
+            validityDate = "%08d%04d" % (msg["validityDate"], int(msg["validityTime"]))
+            if validityDate.startswith("0000"):
+                validityDate = "2" + validityDate[1:]
+            time_stamp = datetime.strptime(validityDate, "%Y%m%d%H%M")
+        return time_stamp
+
+    def is_valid_for(self, filename, leadtime_from_filename=False):
+        """
+        check whether or not this index describes the current content of a file. The check is based on the size and
+        the modification time of the file.
+
+        Returns
+        -------
+        bool
+        """
+        filename = os.path.abspath(filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        return self.filename == filename \
+            and self.size == stat.st_size \
+            and self.mtime == stat.st_mtime_ns \
+            and self.leadtime_from_filename == leadtime_from_filename
+
+    def save(self, index_file):
+        """
+        store the index. The header information is stored as json, coordinates as numpy arrays, both together within
+        a npz-file. The file is first written to a temporal name and then renamed to be visible only when complete.
+
+        Parameters
+        ----------
+        index_file : str
+                name of the file to create
+        """
+        header = {"version": self.version,
+                  "filename": self.filename,
+                  "size": self.size,
+                  "mtime": self.mtime,
+                  "leadtime_from_filename": self.leadtime_from_filename,
+                  "messages": [[one_msg.offset, one_msg.length, list(one_msg.variable_id), one_msg.level,
+                                one_msg.member, one_msg.time.isoformat()] for one_msg in self.messages],
+                  "variables": [],
+                  "coordinates": []}
+        for variable_id, var_info in self.variables.items():
+            header["variables"].append({"id": list(variable_id),
+                                        "shape": list(var_info["shape"]),
+                                        "dims": var_info["dims"],
+                                        "dtype": numpy.dtype(var_info["dtype"]).name,
+                                        "fill_value": float(var_info["fill_value"]),
+                                        "attrs": list(var_info["attrs"].items()),
+                                        "rotated_ll": var_info["rotated_ll"],
+                                        "levels": list(var_info["levels"].items())})
+        arrays = {}
+        for icoord, (name, (dims, values)) in enumerate(self.coordinates.items()):
+            header["coordinates"].append([name, dims, self.grid_hashes.get(name)])
+            arrays["coord%d" % icoord] = values
+        arrays["header"] = numpy.frombuffer(json.dumps(header).encode("utf-8"), dtype=numpy.uint8)
+
+        tmp_file = "%s.%d.tmp" % (index_file, os.getpid())
+        with open(tmp_file, "wb") as f:
+            numpy.savez(f, **arrays)
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, index_file):
+        """
+        read an index file created by *save*.
+
+        Parameters
+        ----------
+        index_file : str
+                name of the file to read
+
+        Returns
+        -------
+        GribIndex or None:
+                None is returned if the file was written by an incompatible version.
+        """
+        with numpy.load(index_file, allow_pickle=False) as content:
+            header = json.loads(content["header"].tobytes().decode("utf-8"))
+            if header["version"] != cls.version:
+                return None
+            index = cls.__new__(cls)
+            index.filename = header["filename"]
+            index.size = header["size"]
+            index.mtime = header["mtime"]
+            index.leadtime_from_filename = header["leadtime_from_filename"]
+            index.messages = [MessageInfo(offset, length, tuple(variable_id), level, member,
+                                          datetime.fromisoformat(time))
+                              for offset, length, variable_id, level, member, time in header["messages"]]
+            index.variables = OrderedDict()
+            for var_info in header["variables"]:
+                dtype = numpy.dtype(var_info["dtype"]).type
+                index.variables[tuple(var_info["id"])] = {
+                    "shape": tuple(var_info["shape"]),
+                    "dims": var_info["dims"],
+                    "dtype": dtype,
+                    "fill_value": dtype(var_info["fill_value"]),
+                    "attrs": OrderedDict(var_info["attrs"]),
+                    "rotated_ll": var_info["rotated_ll"],
+                    "levels": OrderedDict((level, tuple(value) if isinstance(value, list) else value)
+                                          for level, value in var_info["levels"])}
+            index.coordinates = OrderedDict()
+            index.grid_hashes = {}
+            for icoord, (name, dims, grid_hash) in enumerate(header["coordinates"]):
+                # coordinates of known grids are taken from the cache without reading them
+                values = coordinate_cache.get(grid_hash, name, dims)
+                if values is None:
+                    values = coordinate_cache.put(grid_hash, name, dims, content["coord%d" % icoord])
+                index.coordinates[name] = (dims, values)
+                index.grid_hashes[name] = grid_hash
+        return index
+
+
+def get_index_file_name(filename, index_dir=None):
+    """
+    get the name of the index file for a grib file. Index files are not stored next to the grib files to keep data
+    folders clean and file name patterns like "*" usable. The name is derived from the absolute path of the grib file.
+
+    Parameters
+    ----------
+    filename : str
+            name of the grib file
+
+    index_dir : str
+            folder for index files. Default: subfolder grib-index within the enstools cache directory.
+
+    Returns
+    -------
+    str
+    """
+    filename = os.path.abspath(filename)
+    if index_dir is None:
+        index_dir = os.path.join(get_cache_dir(), "grib-index")
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+    path_hash = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    return os.path.join(index_dir, "%s-%s.npz" % (os.path.basename(filename), path_hash))
+
+
+def get_index(filename, leadtime_from_filename=False, index_dir=None, use_index=True, use_mmap=True, leadtime=None):
+    """
+    get the index of a grib file. An existing index is used if it is still valid, otherwise the file is scanned and
+    a new index is written.
+
+    Parameters
+    ----------
+    filename : str
+            name of the grib file
+
+    leadtime_from_filename : bool
+            calculate the valid time from the lead time in the file name (COSMO).
+
+    index_dir : str
+            folder for index files. Default: subfolder grib-index within the enstools cache directory.
+
+    use_index : bool
+            if False, the file is always scanned and no index file is written.
+
+    use_mmap : bool
+            map the file into memory if it has to be scanned.
+
+    leadtime : datetime.timedelta
+            lead time used with leadtime_from_filename. Default: parsed from the file name.
+
+    Returns
+    -------
+    GribIndex
+    """
+    if not use_index:
+        return GribIndex.scan(filename, leadtime_from_filename=leadtime_from_filename, use_mmap=use_mmap,
+                              leadtime=leadtime)
+
+    # try to read an existing index.
+    try:
+        index_file = get_index_file_name(filename, index_dir)
+    except OSError as ex:
+        logging.warning("unable to create grib index directory: %s" % ex)
+        return GribIndex.scan(filename, leadtime_from_filename=leadtime_from_filename, use_mmap=use_mmap,
+                              leadtime=leadtime)
+    if os.path.exists(index_file):
+        try:
+            index = GribIndex.load(index_file)
+            if index is not None and index.is_valid_for(filename, leadtime_from_filename):
+                logging.debug("using grib index %s for %s" % (index_file, filename))
+                profiling.count("grib_indexes_loaded")
+                return index
+        except (OSError, ValueError, KeyError) as ex:
+            logging.debug("unable to read grib index %s: %s" % (index_file, ex))
+
+    # scan the file and store the result
+    index = GribIndex.scan(filename, leadtime_from_filename=leadtime_from_filename, use_mmap=use_mmap,
+                           leadtime=leadtime)
+    try:
+        index.save(index_file)
+    except OSError as ex:
+        logging.warning("unable to write grib index %s: %s" % (index_file, ex))
+    return index
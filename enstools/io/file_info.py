@@ -0,0 +1,178 @@
+"""
+Cached file system information of input files. On parallel file systems, metadata operations like stat, open, and
+glob are expensive. The cache avoids repeated operations on the same files during one call of read and between calls.
+
+    - file types are determined once per file and cached as long as size and modification time are unchanged.
+    - stat results are shared between all functions used by one call of read (clean_paths, get_file_type, the
+      reader and the dataset cache). Outside of a call of read, every stat call is passed to the file system.
+      Concurrent calls of read in other threads do not share stat results.
+    - patterns matching files within one directory are expanded with one os.scandir call, the stat results of
+      the matching files are cached at the same time.
+"""
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+import contextvars
+import threading
+import fnmatch
+import stat
+import os
+from . import profiling
+
+# stat result of one file
+FileInfo = namedtuple("FileInfo", ["path", "mtime_ns", "size", "is_dir"])
+
+
+class FileInfoCache:
+    """
+    Cache of stat results and file types.
+    """
+    def __init__(self, max_types=100000):
+        """
+        Parameters
+        ----------
+        max_types : int
+                maximal number of cached file types.
+        """
+        self.max_types = max_types
+        self.lock = threading.RLock()
+        self.types = OrderedDict()
+        # stat results of the scope of the current context, None outside of a scope
+        self.scope_stats = contextvars.ContextVar("file_info_scope_%d" % id(self), default=None)
+
+    @contextmanager
+    def scope(self):
+        """
+        context manager for one operation on a set of files. Within the scope, every file is only stat'ed once.
+        The scope belongs to the context of the calling thread, nested scopes share the stat results of the outer
+        scope. Threads of a pool share the scope if their tasks run in a copy of the context (profiling.bind).
+        """
+        if self.scope_stats.get() is not None:
+            yield self
+            return
+        token = self.scope_stats.set({})
+        try:
+            yield self
+        finally:
+            self.scope_stats.reset(token)
+
+    def stat(self, path):
+        """
+        stat one file.
+
+        Parameters
+        ----------
+        path : str or Path
+                name of the file
+
+        Returns
+        -------
+        FileInfo or None:
+                None if the file does not exist.
+        """
+        path = os.fspath(path)
+        stats = self.scope_stats.get()
+        with self.lock:
+            if stats is not None and path in stats:
+                return stats[path]
+        profiling.count("stat_calls")
+        try:
+            result = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            info = None
+        else:
+            info = FileInfo(path, result.st_mtime_ns, result.st_size, stat.S_ISDIR(result.st_mode))
+        if stats is not None:
+            with self.lock:
+                stats[path] = info
+        return info
+
+    def scan_directory(self, directory, pattern="*"):
+        """
+        find all files within one directory matching a pattern. The directory is listed with one os.scandir call.
+        Like glob, names starting with a dot are only matched by patterns starting with a dot.
+
+        Parameters
+        ----------
+        directory : str
+                the directory to scan.
+
+        pattern : str
+                shell-like pattern for the file names.
+
+        Returns
+        -------
+        list of str:
+                resolved paths of all matching files in the order returned by the file system.
+        """
+        profiling.count("directory_scans")
+        stats = self.scope_stats.get()
+        resolved_directory = os.path.realpath(directory)
+        result = []
+        try:
+            entries = list(os.scandir(directory))
+        except (FileNotFoundError, NotADirectoryError):
+            return result
+        for entry in entries:
+            if entry.name.startswith(".") and not pattern.startswith("."):
+                continue
+            if not fnmatch.fnmatch(entry.name, pattern):
+                continue
+            if entry.is_symlink():
+                path = os.path.realpath(entry.path)
+            else:
+                path = os.path.join(resolved_directory, entry.name)
+            result.append(path)
+            if stats is None:
+                continue
+            try:
+                entry_stat = entry.stat()
+                info = FileInfo(path, entry_stat.st_mtime_ns, entry_stat.st_size, stat.S_ISDIR(entry_stat.st_mode))
+            except FileNotFoundError:
+                info = None
+            with self.lock:
+                stats[path] = info
+        return result
+
+    def file_type(self, info, detect):
+        """
+        get the cached type of a file or determine it.
+
+        Parameters
+        ----------
+        info : FileInfo
+                stat result of the file
+
+        detect : callable
+                function called with the file name to determine the type in case of a cache miss.
+
+        Returns
+        -------
+        str or None:
+                the result of detect
+        """
+        key = (info.path, info.mtime_ns, info.size)
+        with self.lock:
+            if key in self.types:
+                self.types.move_to_end(key)
+                return self.types[key]
+        profiling.count("file_type_checks")
+        file_type = detect(info.path)
+        with self.lock:
+            self.types[key] = file_type
+            while len(self.types) > self.max_types:
+                self.types.popitem(last=False)
+        return file_type
+
+    def clear(self):
+        """
+        remove all cached information.
+        """
+        stats = self.scope_stats.get()
+        with self.lock:
+            if stats is not None:
+                stats.clear()
+            self.types.clear()
+
+
+# the cache used by read, clean_paths and get_file_type
+file_info_cache = FileInfoCache()
@@ -1,4 +1,5 @@
 from enstools.core import getstatusoutput
+from .file_info import file_info_cache
 import logging
 import re
 import os
@@ -19,7 +20,7 @@ def get_file_type(filename: str, only_extension=False):
     Returns
     -------
     string
-            NC, HDF, GRIB
+            NC, HDF, GRIB, ZARR, REF (reference map created by create_references)
     """
     # guess the type based on extension
     file_type_based_on_extension = None
@@ -29,25 +30,21 @@ def get_file_type(filename: str, only_extension=False):
         file_type_based_on_extension = "NC"
     elif extension in [".grb", ".grib", ".grb2", ".grib2"]:
         file_type_based_on_extension = "GRIB"
+    elif extension == ".zarr":
+        file_type_based_on_extension = "ZARR"
+    elif extension == ".json":
+        file_type_based_on_extension = "REF"
 
     if not only_extension:
         # is the file present at all?
-        if not os.path.exists(filename):
+        info = file_info_cache.stat(filename)
+        if info is None:
             raise IOError("file '%s' not found!" % filename)
 
-        # read the first bytes and decide based on the content
-        with open(filename, "rb") as f:
-            first_bytes = f.read(12)
-
-            # netcdf3 file
-            if first_bytes.startswith(b"CDF"):
-                file_type = "NC"
-            # netcdf4
-            elif b"HDF" in first_bytes[0:4]:
-                file_type = "HDF"
-            # grib
-            elif b"GRIB" in first_bytes:
-                file_type = "GRIB"
+        # the content is only inspected once as long as size and modification time are unchanged
+        file_type = file_info_cache.file_type(info, __sniff_file_type)
+        if info.is_dir:
+            return file_type
 
     # return the best knowledge of the file type
     if file_type is not None:
@@ -55,3 +52,41 @@ def get_file_type(filename: str, only_extension=False):
     else:
         return file_type_based_on_extension
 
+
+def __sniff_file_type(filename):
+    """
+    read the first bytes of a file or look into a directory to determine the type.
+
+    Parameters
+    ----------
+    filename : string
+            name of an existing file or directory
+
+    Returns
+    -------
+    string or None
+            NC, HDF, GRIB, ZARR, REF or None if unknown
+    """
+    # zarr stores are directories
+    if os.path.isdir(filename):
+        if any(os.path.exists(os.path.join(filename, name)) for name in [".zgroup", "zarr.json"]):
+            return "ZARR"
+        return None
+
+    # read the first bytes and decide based on the content
+    with open(filename, "rb") as f:
+        first_bytes = f.read(12)
+
+    # netcdf3 file
+    if first_bytes.startswith(b"CDF"):
+        return "NC"
+    # netcdf4
+    elif b"HDF" in first_bytes[0:4]:
+        return "HDF"
+    # grib
+    elif b"GRIB" in first_bytes:
+        return "GRIB"
+    # reference map
+    elif first_bytes.startswith(b'{"enstools'):
+        return "REF"
+    return None
@@ -0,0 +1,138 @@
+"""
+Discovery of input files. The manifest is a table with one row per input file holding the information read takes from
+file and folder names: the ensemble member, the lead time, and whether the member is complete. The names are parsed
+in one vectorised pass for all files.
+"""
+import logging
+import os
+import re
+from datetime import timedelta
+import numpy as np
+import pandas
+from .paths import clean_paths
+
+# lead time within COSMO file names: lfffDDHHMMSS
+leadtime_pattern = r"lfff(\d\d)(\d\d)(\d\d)(\d\d)"
+
+
+def create_manifest(filenames, member_by_filename=None, members_by_folder=False, max_workers=None):
+    """
+    Find all input files and parse ensemble member and lead time information from their names.
+
+    Parameters
+    ----------
+    filenames : list of str or tuple of str or str or Path
+            names of individual files or filename patterns. Patterns with wildcards in directory names are expanded
+            concurrently.
+
+    member_by_filename : str
+            regular expression, the first group of which matches the ensemble member number within the file name.
+
+    members_by_folder : bool
+            files within one folder belong to one ensemble member. The member numbers are taken from the digits in the
+            folder names. If these are missing or not unique, consecutive numbers are used.
+
+    max_workers : int
+            number of threads used to scan directories.
+
+    Returns
+    -------
+    pandas.DataFrame
+            one row per file in the order of the file names with the columns path (resolved file name), folder,
+            member (nullable integer, <NA> if unknown), leadtime (timedelta, NaT if not part of the file name), and
+            complete (False for files of ensemble members with fewer files than other members).
+    """
+    if member_by_filename is not None and members_by_folder:
+        raise IOError("member_by_filename and members_by_folder are not allowed at the same time!")
+
+    paths = pandas.Series([str(one_file) for one_file in clean_paths(filenames, max_workers=max_workers)],
+                          dtype=str)
+    folder_and_name = paths.str.rpartition(os.sep)
+    manifest = pandas.DataFrame({"path": paths, "folder": folder_and_name[0]})
+    basenames = folder_and_name[2]
+
+    # lead time from the file name
+    leadtime = basenames.str.extract(leadtime_pattern).astype("float64")
+    manifest["leadtime"] = pandas.to_timedelta(leadtime[0] * 86400 + leadtime[1] * 3600 + leadtime[2] * 60
+                                               + leadtime[3], unit="s")
+
+    # ensemble member
+    manifest["member"] = pandas.Series(pandas.NA, index=manifest.index, dtype="Int64")
+    if member_by_filename is not None:
+        members = basenames.str.extract(member_by_filename, expand=True)[0]
+        missing = members.isna()
+        if missing.any():
+            raise IOError("pattern for ensemble member ('%s') information not found in filename '%s'" % (
+                member_by_filename, basenames[missing].iloc[0]))
+        manifest["member"] = members.astype("int64").astype("Int64")
+        group_by = "member"
+    elif members_by_folder and manifest["folder"].nunique() > 1:
+        folders = np.sort(manifest["folder"].unique())
+        members = __assign_ensemble_member_number_to_folders(folders)
+        manifest["member"] = manifest["folder"].map(members).astype("Int64")
+        group_by = "folder"
+    else:
+        group_by = None
+
+    # members with fewer files than other members are incomplete
+    manifest["complete"] = True
+    if group_by is not None:
+        n_files = manifest.groupby(group_by, sort=True)["path"].transform("size")
+        manifest["complete"] = n_files == n_files.max()
+        incomplete = manifest.loc[~manifest["complete"]].groupby(group_by, sort=True).size()
+        if group_by == "folder":
+            message = "The ensemble member in folder '%s' seems to be incomplete with only %d of %d files. " \
+                      "This member will not be part of the merged dataset."
+        else:
+            message = "The ensemble member '%s' seems to be incomplete with only %d of %d files. " \
+                      "This member will not be part of the merged dataset."
+        for name, count in incomplete.items():
+            logging.warning(message, name, count, n_files.max())
+    return manifest
+
+
+def parse_leadtime(filename):
+    """
+    parse the lead time from the name of one file (lfffDDHHMMSS).
+
+    Parameters
+    ----------
+    filename : str
+            name of the file, only the base name is used.
+
+    Returns
+    -------
+    datetime.timedelta or None
+            None if the file name contains no lead time.
+    """
+    leadtime = re.search(leadtime_pattern, os.path.basename(filename))
+    if leadtime is None:
+        return None
+    return timedelta(days=int(leadtime.group(1)), hours=int(leadtime.group(2)), minutes=int(leadtime.group(3)),
+                     seconds=int(leadtime.group(4)))
+
+
+def __assign_ensemble_member_number_to_folders(folders):
+    """
+    used internally to extract numbers from the folders and use them as ensemble member numbers. If not all folders
+    contain numbers, or if they are not unique, then create consecutive numbers.
+
+    Parameters
+    ----------
+    folders : list
+            sorted list of absolute paths
+
+    Returns
+    -------
+    dict :
+            dictionary where the key is the absolute path and the value if the ensemble member number
+    """
+    # extract all digits from the last parts of the folders
+    digits = pandas.Series(folders, dtype=str).str.rpartition(os.sep)[2].str.replace(r"\D", "", regex=True)
+    digits = digits.where(digits != "", None)
+    digits = digits.fillna(pandas.Series(np.arange(1, len(folders) + 1).astype(str))).astype("int64").to_numpy()
+
+    # are all numbers unique?
+    if len(np.unique(digits)) < len(folders):
+        digits = np.arange(1, len(folders) + 1)
+    return dict(zip(folders, digits))
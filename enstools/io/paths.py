@@ -1,32 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Union, List
 import glob
+import os
+from .file_info import file_info_cache
+from . import profiling
 
 
 def clean_paths(paths: Union[Path, List[Path], List[str], str],
-                check_files_exist: bool = True
-                ,) -> List[Path]:
+                check_files_exist: bool = True,
+                max_workers: int = None,
+                ) -> List[Path]:
     """
     Take the paths in all the usual forms and convert them to a list of Path objects.
+
+    Patterns are expanded like glob.glob. Patterns with wildcards in directory names (e.g., data/member*/*.nc) are
+    expanded level by level, all directories of one level are scanned concurrently. Paths without wildcards are
+    stat'ed concurrently.
+
     Parameters
     ----------
-    paths
+    paths : str or Path or list of str or list of Path
+            file names and patterns.
+
+    check_files_exist : bool
+            check that all files exist.
+
+    max_workers : int
+            number of threads used to scan directories and to stat files. Default: ThreadPoolExecutor's default.
 
     Returns
     -------
-
+    list of Path
+            resolved paths of all files in the order of the patterns. Files matching one pattern are returned in the
+            order given by the file system, like glob.glob.
     """
 
     # Check arguments
 
     if not isinstance(paths, (list, str, tuple, Path)):
-        raise NotImplementedError("Unsupported type of argument: %s" % type(paths))    
+        raise NotImplementedError("Unsupported type of argument: %s" % type(paths))
 
     if not isinstance(paths, list):
         paths = [paths]
+    paths = [str(fp) for fp in paths]
 
-    # Expand paths using glob
-    expanded_paths = [glob.glob(str(fp)) for fp in paths]
+    # Expand paths using glob and convert the elements to resolved Path objects
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="clean-paths") as executor:
+        plain_paths = [fp for fp in paths if not glob.has_magic(fp)]
+        plain_infos = dict(zip(plain_paths, executor.map(profiling.bind(file_info_cache.stat), plain_paths)))
+        expanded_paths = []
+        for fp in paths:
+            if fp in plain_infos:
+                if plain_infos[fp] is not None:
+                    expanded_paths.append([Path(fp).resolve()])
+            else:
+                expanded_paths.append(__expand_pattern(fp, executor))
 
     # Merge elements in a flat list
     expanded_paths = [item for sublist in expanded_paths for item in sublist]
@@ -35,9 +64,41 @@ def clean_paths(paths: Union[Path, List[Path], List[str], str],
     if not expanded_paths:
         raise FileNotFoundError(f"Files {str(paths)} don't exist.")
 
-    # Convert the elements to Path and expand
-    path_objects = [Path(fp).resolve() for fp in expanded_paths]
+    path_objects = expanded_paths
     if check_files_exist:
         for fp in path_objects:
-            assert fp.exists()
+            assert file_info_cache.stat(fp) is not None
     return path_objects
+
+
+def __expand_pattern(pattern: str, executor: ThreadPoolExecutor) -> List[Path]:
+    """
+    Expand one pattern like glob. Every directory is listed with one scan, which also caches the stat results of all
+    matching files. The directories of one level of the tree are scanned concurrently.
+    """
+    directory, name = os.path.split(pattern)
+    if not glob.has_magic(directory):
+        # the directory is resolved once, not every single file
+        return [Path(fp) for fp in file_info_cache.scan_directory(directory or os.curdir, name)]
+
+    # split the pattern into the part without wildcards and the remaining components
+    components = []
+    while glob.has_magic(directory):
+        directory, component = os.path.split(directory)
+        components.insert(0, component)
+    components.append(name)
+
+    # walk down the tree, the result of every level keeps the order of the parent directories
+    current = [directory or os.curdir]
+    for level, component in enumerate(components):
+        last_level = level == len(components) - 1
+        if glob.has_magic(component):
+            scans = executor.map(profiling.bind(lambda one_dir: file_info_cache.scan_directory(one_dir, component)),
+                                 current)
+            current = [fp for scan in scans for fp in scan]
+        else:
+            current = [os.path.join(one_dir, component) for one_dir in current]
+            if last_level:
+                infos = executor.map(profiling.bind(file_info_cache.stat), current)
+                current = [os.path.realpath(fp) for fp, info in zip(current, infos) if info is not None]
+    return [Path(fp) for fp in current]
@@ -0,0 +1,148 @@
+"""
+Timers and counters of the steps of read. Profiling is inactive by default and costs nothing in this case. It is
+activated for one call with read(..., profile=True) or for all calls within a block with profile_read():
+
+    >>> with profile_read() as profile:  # doctest: +SKIP
+    ...     ds = read("data/*.nc")
+    >>> profile.report()  # doctest: +SKIP
+    {'wall_time': 0.41, 'timers': {'read': {...}, 'open': {...}, 'merge': {...}}, 'counters': {...}, 'maxima': {...}}
+
+Timers measure the accumulated time and the number of calls of one step. Steps running in several threads at the
+same time add up, the sum may therefore exceed the wall time. Counters are summed up, maxima keep the largest value.
+
+Profiles are bound to the context of the calling thread. Reads in other threads are not part of the report, tasks of
+the pools of threads used by read are bound to the context of the thread submitting them.
+"""
+from contextlib import contextmanager
+import contextvars
+import threading
+import json
+import time
+
+# profiles collecting the timers and counters in the current context
+__active_profiles = contextvars.ContextVar("active_read_profiles", default=())
+
+
+class ReadProfile:
+    """
+    collection of timers and counters of one or more calls of read.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.maxima = {}
+        self.start = time.perf_counter()
+        self.end = None
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"seconds": 0.0, "calls": 0})
+            timer["seconds"] += seconds
+            timer["calls"] += 1
+
+    def add_count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_maximum(self, name, value):
+        with self.lock:
+            self.maxima[name] = max(self.maxima.get(name, value), value)
+
+    def report(self):
+        """
+        structured report of all timers and counters.
+
+        Returns
+        -------
+        dict
+                wall_time: seconds since the profile was started until it was stopped.
+                timers: accumulated seconds and number of calls per step.
+                counters: e.g. files_opened, stat_calls, grib_messages_scanned, bytes_loaded.
+                maxima: e.g. merge_depth.
+        """
+        end = self.end if self.end is not None else time.perf_counter()
+        with self.lock:
+            return {"wall_time": end - self.start,
+                    "timers": {name: dict(timer) for name, timer in sorted(self.timers.items())},
+                    "counters": dict(sorted(self.counters.items())),
+                    "maxima": dict(sorted(self.maxima.items()))}
+
+    def to_json(self, **kwargs):
+        """
+        the report as JSON string. All arguments are passed on to json.dumps.
+        """
+        return json.dumps(self.report(), **kwargs)
+
+
+@contextmanager
+def profile_read():
+    """
+    context manager collecting timers and counters of all calls of read within the block. Calls in threads started
+    within the block are only included if they run in a copy of the context, e.g., with bind.
+
+    Returns
+    -------
+    ReadProfile
+    """
+    profile = ReadProfile()
+    token = __active_profiles.set(__active_profiles.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        profile.end = time.perf_counter()
+        __active_profiles.reset(token)
+
+
+def is_active():
+    """
+    True if at least one profile collects timers and counters.
+    """
+    return len(__active_profiles.get()) > 0
+
+
+def bind(func):
+    """
+    bind a function to the profiles and the file information scope of the calling thread. Threads of a pool do not
+    inherit the context of the thread submitting tasks, every call of the returned function runs in a copy of the
+    calling thread's context.
+    """
+    context = contextvars.copy_context()
+
+    def run_in_context(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run_in_context
+
+
+@contextmanager
+def timer(name):
+    """
+    measure the time of one step for all active profiles.
+    """
+    profiles = __active_profiles.get()
+    if not profiles:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        for profile in profiles:
+            profile.add_time(name, seconds)
+
+
+def count(name, value=1):
+    """
+    increment a counter in all active profiles.
+    """
+    for profile in __active_profiles.get():
+        profile.add_count(name, value)
+
+
+def maximum(name, value):
+    """
+    keep the largest value of a quantity in all active profiles.
+    """
+    for profile in __active_profiles.get():
+        profile.add_maximum(name, value)
@@ -2,18 +2,23 @@ import logging
 from collections import OrderedDict
 import xarray
 import dask
+import dask.array
 import distributed
+import psutil
 import six
 import os
-import re
 import numpy as np
+import pandas
 import glob
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union, Tuple, List
 from pathlib import Path
-from .paths import clean_paths
+from .manifest import create_manifest
 from enstools.misc import add_ensemble_dim, is_additional_coordinate_variable, first_element, \
     set_ensemble_member
-from enstools.core import get_client_and_worker
+from enstools.core import get_client_and_worker, plan_dataset_chunks
 from packaging import version
 
 try:
@@ -24,14 +29,24 @@ except ModuleNotFoundError:
 
 from .dataset import drop_unused
 from .file_type import get_file_type
+from .file_info import file_info_cache
+from . import profiling
+from .cache import dataset_cache
+from .references import open_references
 
 try:
     from .eccodes import read_grib_file
 except ImportError:
     pass
 
+# keyword arguments of read, which are handled by enstools and not passed on to xarray.open_dataset
+enstools_read_kwargs = ["create_ens_dim", "debug", "drop_unused", "in_memory", "leadtime_from_filename", "grib_index",
+                        "grib_index_dir", "batch_messages", "grib_mmap", "chunks", "variables", "levels", "members",
+                        "time", "metadata_only", "max_open_workers", "max_open_files", "cache",
+                        "memory_limit"]
 
-def __read_one_file(filename: Path, constant=None, decode_times=True, **kwargs):
+
+def __read_one_file(filename: Path, decode_times=True, leadtime=None, **kwargs):
     """
     Read one or more input files
 
@@ -40,8 +55,8 @@ def __read_one_file(filename: Path, constant=None, decode_times=True, **kwargs):
     filename : Path object
             name of one individual file of unix shell-like file name pattern for multiple files
 
-    constant : str
-            name of a file containing constant variables.
+    leadtime : datetime.timedelta
+            lead time of the file from the manifest, used for GRIB files with leadtime_from_filename.
 
     **kwargs
             all arguments accepted by xarray.open_dataset() of xarray.open_mfdataset()
@@ -51,16 +66,13 @@ def __read_one_file(filename: Path, constant=None, decode_times=True, **kwargs):
     xarray.Dataset
             in-memory representation of the content of the input file(s)
     """
-    if constant is not None:
-        return read(filename, constant=constant, **kwargs)
-    else:
-        # are we inside of a worker and is a distributed client available?
-        client, worker = get_client_and_worker()
-        # do we have a client, but we are not running inside of a worker?
-        if client is not None and worker is None:
-            return dask.compute(dask.delayed(read)(filename, **kwargs))[0]
+    # are we inside of a worker and is a distributed client available?
+    client, worker = get_client_and_worker()
+    # do we have a client, but we are not running inside of a worker?
+    if client is not None and worker is None:
+        return dask.compute(dask.delayed(read)(filename, **kwargs))[0]
 
-        return __open_dataset(filename, client, worker, decode_times=decode_times, **kwargs)
+    return __open_dataset(filename, client, worker, decode_times=decode_times, leadtime=leadtime, **kwargs)
 
 
 def read(
@@ -78,7 +90,9 @@ def read(
     Parameters
     ----------
     filenames : list of str or tuple of str or str
-            names of individual files or filename pattern
+            names of individual files or filename pattern. A reference map created by
+            enstools.io.create_references is opened directly as one dataset without reading the metadata of the
+            referenced files.
 
     merge_same_size_dim : bool
             dimensions of the same size but with different names are merged together. This is sometimes useful to
@@ -94,7 +108,8 @@ def read(
             12 from the file name AROME-EPS_2012110500_P12.nc.
 
     constant : str
-            name of a file containing constant variables.
+            name of a file containing constant variables. The file is opened once, its variables are aligned with the
+            coordinates of the other files and added to the result. A time dimension of the constant file is removed.
     decode_times: bool
             decode the times
     **kwargs
@@ -106,169 +121,430 @@ def read(
 
             *in_memory*: bool
                 store the complete arrays in memory. Data is still handled as dask arrays, but not backed by the input
-                files anymore. This works of course only for datasets which fit into memory.
+                files anymore. This works of course only for datasets which fit into memory. Without a dask cluster,
+                NetCDF, HDF5, and zarr inputs are merged first and then read concurrently into one array per variable.
+
+            *memory_limit*: int or str
+                maximal size of the data loaded with in_memory=True, e.g. "8GB". If the selected data is larger, a
+                MemoryError with the estimated size is raised before anything is read. Default: the memory available
+                when read is called.
 
             *leadtime_from_filename*: bool
                 COSMO-GRIB1-Files do not contain exact times. If this argument is set, then the timestamp is calculated
                 from the init time and the lead time from the file name.
 
+            *grib_index*: bool
+                store the header information of GRIB files in an index file on the first read. Later reads of the
+                unchanged files do not need to scan the files again. Default: True.
+
+            *grib_index_dir*: str
+                folder for GRIB index files. Default: subfolder grib-index within the enstools cache directory.
+
+            *batch_messages*: bool
+                load all levels of a GRIB variable at one time and ensemble member in one task with one file handle
+                instead of creating one task per message.
+
+            *chunks*: int or dict or "auto"
+                chunk sizes of the dask arrays. For NetCDF and HDF5 files, the argument is passed on to
+                xarray.open_dataset. For GRIB files, it is the number of messages per chunk along the time, ensemble
+                and level dimensions, where the key "level" applies to all vertical dimensions. "auto": chunks of every
+                file are planned with enstools.core.plan_dataset_chunks, they are close to dask's array.chunk-size
+                and multiples of the chunks of the file. Default: one chunk per GRIB message or the chunks of the
+                NetCDF file.
+
+            *grib_mmap*: bool
+                map GRIB files into memory. Messages are handed to eccodes without copying them. Default: True.
+
+            *variables*: str or list of str
+                read only the given variables. For GRIB files, the names may also include the type of level
+                (e.g. "t_isobaricInhPa"). A ValueError is raised for variables which are not part of any file.
+
+            *levels*: number or list of numbers
+                read only the given levels. Only supported for GRIB files.
+
+            *members*: int or list of int
+                read only the given ensemble members.
+
+            *time*: datetime-like or list of datetime-like
+                read only the given valid times.
+
+                For GRIB files, the selections are applied to the header information of the messages before any
+                message is decoded. Unselected messages create neither eccodes handles nor dask tasks. For other
+                files, the selection is applied lazily after opening.
+
+            *metadata_only*: bool
+                read only variables, dimensions, coordinates and attributes. The files are opened concurrently by a
+                pool of threads without using a dask cluster. Data variables are replaced by placeholders with the
+                correct shape and type, which raise an error when computed. Default: False.
+
+            *max_open_workers*: int
+                number of threads used to open the files. Without a dask-distributed client, files are always
+                opened by a local pool of threads. With a client, files are opened on the cluster unless this argument
+                is given. Default: the default of concurrent.futures.ThreadPoolExecutor.
+
+            *max_open_files*: int
+                maximal number of files opened at the same time. This limits the number of threads working on
+                different files as well as the number of file handles kept open by xarray while reading. For later
+                access to the data, xarray's global option file_cache_maxsize applies. Default: no limit.
+
+            *cache*: bool
+                store the result in the process-wide cache enstools.io.dataset_cache and return the cached dataset if
+                the same files (with unchanged modification times) are read again with the same arguments. Use
+                dataset_cache.invalidate() to remove datasets from the cache and dataset_cache.info() to get the number
+                of hits and misses. Default: False.
+
+            *profile*: bool
+                measure the time spent in the steps of read (discovery, opening per file type, GRIB scans, merge,
+                loading) and count files, stat calls, scanned GRIB messages, and loaded bytes. The report is stored as
+                dictionary in the encoding of the result (ds.encoding["read_profile"]). Use
+                enstools.io.profile_read() to profile several calls. Default: False.
+
     Returns
     -------
     xarray.Dataset
             in-memory representation of the content of the input file(s)
     """
+    # collect timers and counters for this call
+    if kwargs.pop("profile", False):
+        with profiling.profile_read() as read_profile:
+            result = read(filenames, constant=constant, merge_same_size_dim=merge_same_size_dim,
+                          members_by_folder=members_by_folder, member_by_filename=member_by_filename,
+                          decode_times=decode_times, **kwargs)
+        result.encoding["read_profile"] = read_profile.report()
+        logging.debug("read profile: %s" % read_profile.to_json())
+        return result
+
+    # every input file is stat'ed only once within one call of read
+    with file_info_cache.scope(), profiling.timer("read"):
+        return __read(filenames, constant=constant, merge_same_size_dim=merge_same_size_dim,
+                      members_by_folder=members_by_folder, member_by_filename=member_by_filename,
+                      decode_times=decode_times, **kwargs)
+
+
+def __read(filenames, constant=None, merge_same_size_dim=False, members_by_folder=False, member_by_filename=None,
+           decode_times=True, **kwargs):
+    """
+    implementation of read, see read for the arguments.
+    """
     if enstools_encoding_available:
         # We need to make sure that we are able to read compressed files
             import hdf5plugin # noqa
 
-    filenames = clean_paths(filenames)
-
+    # find all input files and parse member information from file and folder names
+    with profiling.timer("discover"):
+        manifest = create_manifest(filenames, member_by_filename=member_by_filename,
+                                   members_by_folder=members_by_folder,
+                                   max_workers=kwargs.get("max_open_workers", None))
+    filenames = [Path(one_file) for one_file in manifest["path"]]
+
+    # return a cached dataset if available. On a miss, the files are read without discovering them again.
+    if kwargs.pop("cache", False):
+        return dataset_cache.get_or_read(lambda filenames, **read_kwargs: __read_manifest(manifest, **read_kwargs),
+                                         filenames, constant=constant, merge_same_size_dim=merge_same_size_dim,
+                                         members_by_folder=members_by_folder, member_by_filename=member_by_filename,
+                                         decode_times=decode_times, **kwargs)
+    return __read_manifest(manifest, constant=constant, merge_same_size_dim=merge_same_size_dim,
+                           members_by_folder=members_by_folder, member_by_filename=member_by_filename,
+                           decode_times=decode_times, **kwargs)
+
+
+def __read_manifest(manifest, constant=None, merge_same_size_dim=False, members_by_folder=False,
+                    member_by_filename=None, decode_times=True, **kwargs):
+    """
+    open, select and merge the files listed in the manifest created by create_manifest. See read for the arguments.
+    """
     # Hint: the \\\ the the docstring for member_by_filename is only included because the html-documentation is
     # otherwise not rendered correctly.
-    # create at first a list of all input files
-    datasets = []
-    # loop over all input files and create delayed read objects
-    expanded_filenames = []
-    parent_folders = []
     # do we want to create an ensemble dimension?
     if member_by_filename is not None or members_by_folder is True:
         kwargs["create_ens_dim"] = True
-    for filename in filenames:
-        # is the filename a pattern?
-        one_file = os.path.abspath(filename)
-        datasets.append(dask.delayed(__read_one_file)(filename, decode_times=decode_times, **kwargs))
-        expanded_filenames.append(filename)
-        parent = os.path.dirname(filename)
-        if not parent in parent_folders:
-            parent_folders.append(parent)
-
-    datasets = dask.compute(*datasets, traverse=False)
-
-    # are there ensemble members in different folders?
-    if members_by_folder and len(parent_folders) > 1:
-        # sort all parent folders and assign ensemble member numbers to them
-        parent_folders = sorted(parent_folders)
-        ens_member_by_folder = __assign_ensemble_member_number_to_folders(parent_folders)
-
-        # create the ensemble dimension within the datasets
-        n_files_per_folder = {}
-        for ids in range(len(datasets)):
-            folder = os.path.dirname(expanded_filenames[ids])
-
-            # count the files per member and remove incomplete members
-            if folder in n_files_per_folder:
-                n_files_per_folder[folder] += 1
-            else:
-                n_files_per_folder[folder] = 1
-
-            # create missing ensemble dimension
-            set_ensemble_member(datasets[ids], ens_member_by_folder[folder])
-
-        # check the number of files per folder
-        incomplete_folders = []
-        max_files = 0
-        for folder, n_files in six.iteritems(n_files_per_folder):
-            if n_files > max_files:
-                max_files = n_files
-        for folder, n_files in six.iteritems(n_files_per_folder):
-            if n_files < max_files:
-                incomplete_folders.append(folder)
-
-        # remove incomplete ensemble members
-        if len(incomplete_folders) > 0:
-            incomplete_folders.sort()
-            for folder in incomplete_folders:
-                logging.warning(
-                    "The ensemble member in folder '%s' seems to be incomplete with only %d of %d files.This member will not be part of the merged dataset.",
-                    folder, n_files_per_folder[folder], max_files)
-            new_datasets = []
-            for ids in range(len(datasets)):
-                if os.path.dirname(expanded_filenames[ids]) not in incomplete_folders:
-                    new_datasets.append(datasets[ids])
-            datasets = new_datasets
 
-    # create the ensemble dimension based on integers included in the filename
-    if member_by_filename is not None:
-        if members_by_folder:
-            raise IOError("member_by_filename and members_by_folder are not allowed at the same time!")
-
-        # create the ensemble dimension for all datasets
-        n_files_per_member = {}
-        for ids in range(len(datasets)):
-            # find the member information within the filename
-            match = re.search(member_by_filename, os.path.basename(expanded_filenames[ids]))
-            if match is None:
-                raise IOError("pattern for ensemble member ('%s') information not found in filename '%s'" % (
-                    member_by_filename, os.path.basename(expanded_filenames[ids])))
-            member = int(match.group(1))
-
-            # create missing ensemble dimension
-            set_ensemble_member(datasets[ids], member)
-
-            # count the files per member and remove incomplete members
-            if member in n_files_per_member:
-                n_files_per_member[member] += 1
-            else:
-                n_files_per_member[member] = 1
-
-            # check the number of files per folder
-            incomplete_members = []
-            max_files = 0
-            for member, n_files in six.iteritems(n_files_per_member):
-                if n_files > max_files:
-                    max_files = n_files
-            for member, n_files in six.iteritems(n_files_per_member):
-                if n_files < max_files:
-                    incomplete_members.append(member)
-
-        # remove incomplete ensemble members
-        if len(incomplete_members) > 0:
-            incomplete_members.sort()
-            for member in incomplete_members:
-                logging.warning(
-                    "The ensemble member '%s' seems to be incomplete with only %d of %d files. This member will not be part of the merged dataset.",
-                    member, n_files_per_member[member], max_files)
-            new_datasets = []
-            for ids in range(len(datasets)):
-                member = int(re.search(member_by_filename, os.path.basename(expanded_filenames[ids])).group(1))
-                if member not in incomplete_members:
-                    new_datasets.append(datasets[ids])
-            datasets = new_datasets
+    # files of incomplete ensemble members are not opened at all
+    manifest = manifest.loc[manifest["complete"]]
+    # ensemble members given by file or folder names are selected before the files are opened
+    if kwargs.get("members", None) is not None:
+        member_known = manifest["member"].notna()
+        manifest = manifest.loc[~member_known | manifest["member"].isin(np.atleast_1d(kwargs["members"]))]
+    expanded_filenames = [Path(one_file) for one_file in manifest["path"]]
+    # lead times parsed from the file names are used for the valid time of GRIB messages
+    leadtimes = {Path(path): None if pandas.isna(leadtime) else leadtime.to_pytimedelta()
+                 for path, leadtime in zip(manifest["path"], manifest["leadtime"])}
+
+    # open the files in a local pool of threads unless a dask cluster should take over
+    metadata_only = kwargs.get("metadata_only", False)
+    client, worker = get_client_and_worker()
+    use_thread_pool = metadata_only or client is None or worker is not None \
+        or kwargs.get("max_open_workers", None) is not None
+
+    # without a cluster, in_memory data is loaded after merging directly into the final arrays. GRIB files are
+    # loaded by read_grib_file.
+    load_merged = kwargs.get("in_memory", False) and client is None and not metadata_only \
+        and all(get_file_type(one_file) != "GRIB" for one_file in expanded_filenames)
+    if load_merged:
+        kwargs = dict(kwargs, in_memory=False)
+    profiling.count("input_files", len(expanded_filenames))
+    with profiling.timer("open_all"):
+        if metadata_only:
+            datasets = __open_files(expanded_filenames,
+                                    lambda x: __read_metadata(x, decode_times=decode_times, leadtime=leadtimes[x],
+                                                              **kwargs),
+                                    max_open_workers=kwargs.get("max_open_workers", None),
+                                    max_open_files=kwargs.get("max_open_files", None))
+        elif use_thread_pool:
+            datasets = __open_files(expanded_filenames,
+                                    lambda x: __open_dataset(x, client, worker, decode_times=decode_times,
+                                                             leadtime=leadtimes[x], **kwargs),
+                                    max_open_workers=kwargs.get("max_open_workers", None),
+                                    max_open_files=kwargs.get("max_open_files", None))
+        else:
+            datasets = [dask.delayed(__read_one_file)(filename, decode_times=decode_times,
+                                                      leadtime=leadtimes[filename], **kwargs)
+                        for filename in expanded_filenames]
+            datasets = list(dask.compute(*datasets, traverse=False))
+
+    # files without data matching the selection are skipped
+    if __has_selection(kwargs):
+        not_empty = [len(one_ds.data_vars) > 0 for one_ds in datasets]
+        if not any(not_empty):
+            raise ValueError("no data in the input files matches the selection of variables, levels, members, "
+                             "and time")
+        datasets = [one_ds for one_ds, keep in zip(datasets, not_empty) if keep]
+        manifest = manifest.loc[not_empty]
+        __check_selected_variables(kwargs.get("variables", None), datasets)
+
+    # create the ensemble dimension within the datasets
+    for ids, member in enumerate(manifest["member"]):
+        if member is not pandas.NA:
+            set_ensemble_member(datasets[ids], int(member))
 
     # if dimensions have the same size but different names, then merge them by renaming
     if merge_same_size_dim:
         datasets = __rename_same_size_dim(datasets)
 
     # combine datsets from different files
-    result = __merge_datasets(datasets)
+    with profiling.timer("merge"):
+        result = __merge_datasets(datasets)
 
     # is there a file with constant data?
     if constant is not None:
-        # read constant data
+        with profiling.timer("constant"):
+            result = __attach_constant(result, constant, metadata_only=metadata_only, decode_times=decode_times,
+                                       merge_same_size_dim=merge_same_size_dim)
+
+    if load_merged:
+        with profiling.timer("load"):
+            result = __load_into_memory(result, memory_limit=kwargs.get("memory_limit", None),
+                                        max_workers=kwargs.get("max_open_workers", None))
+
+    return result
+
+
+def __load_into_memory(dataset, memory_limit=None, max_workers=None):
+    """
+    load all lazy variables of a merged dataset. All chunks of all variables are read concurrently and used as the
+    chunks of new dask arrays without copying or concatenating them.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+            merged dataset with lazy variables
+
+    memory_limit : int or str
+            maximal number of bytes to load, e.g. 2**30 or "4GB". Default: the memory currently available.
+
+    max_workers : int
+            number of threads reading the data.
+
+    Returns
+    -------
+    xarray.Dataset
+            dataset with all variables in memory
+    """
+    lazy = [name for name, variable in dataset.variables.items() if isinstance(variable.data, dask.array.Array)]
+    nbytes = sum(dataset.variables[name].nbytes for name in lazy)
+
+    # fail before anything is read if the data does not fit
+    if memory_limit is None:
+        memory_limit = psutil.virtual_memory().available
+        limit_name = "available memory"
+    else:
+        memory_limit = dask.utils.parse_bytes(memory_limit)
+        limit_name = "memory_limit"
+    if nbytes > memory_limit:
+        raise MemoryError("in_memory=True: the selected data needs %s, but the %s is %s. Select fewer variables, "
+                          "levels, members, or times, or read the data without in_memory."
+                          % (dask.utils.format_bytes(nbytes), limit_name, dask.utils.format_bytes(memory_limit)))
+
+    # read all chunks of all variables concurrently. The loaded chunks become the chunks of the new dask arrays
+    # without concatenating or copying them.
+    sources = [dataset.variables[name].data for name in lazy]
+    blocks = [source.to_delayed().ravel() for source in sources]
+    loaded = dask.compute(*[block for source_blocks in blocks for block in source_blocks], scheduler="threads",
+                          num_workers=max_workers)
+    profiling.count("bytes_loaded", nbytes)
+    logging.debug("in_memory: %s loaded for %d variables" % (dask.utils.format_bytes(nbytes), len(lazy)))
+
+    # the names are derived from the lazy arrays to avoid hashing the content.
+    variables = {}
+    start = 0
+    for name, source, source_blocks in zip(lazy, sources, blocks):
+        array_name = "in-memory-%s" % source.name
+        block_ids = itertools.product(*(range(len(chunks)) for chunks in source.chunks))
+        graph = dict(zip(((array_name,) + block_id for block_id in block_ids),
+                         loaded[start:start + len(source_blocks)]))
+        start += len(source_blocks)
+        data = dask.array.Array(graph, array_name, chunks=source.chunks, dtype=source.dtype, meta=source._meta)
+        variables[name] = dataset.variables[name].copy(deep=False, data=data)
+    coords = {name: variable for name, variable in variables.items() if name in dataset.coords}
+    data_vars = {name: variable for name, variable in variables.items() if name not in dataset.coords}
+    return dataset.assign_coords(coords).assign(data_vars)
+
+
+
+def __attach_constant(result, constant, metadata_only=False, decode_times=True, merge_same_size_dim=False):
+    """
+    add the variables of a file with constant data to the merged dataset. The constant file is opened once per call
+    of read. Its variables are aligned to the coordinates of the merged dataset and added without merging the
+    non-constant data again.
+
+    Parameters
+    ----------
+    result : xarray.Dataset
+            merged non-constant data
+
+    constant : str
+            name of a file containing constant variables.
+
+    Returns
+    -------
+    xarray.Dataset
+            result with the constant variables added
+    """
+    # read constant data
+    if metadata_only:
+        constant_data = __read_metadata(constant, decode_times=decode_times)
+    else:
         constant_data = __open_dataset(constant, None, None, decode_times=decode_times)
-        # remove time axes if present
-        if "time" in constant_data.dims:
-            constant_data = constant_data.isel(time=0)
-        # remove variables also present in the non constant data
-        for one_var in constant_data.data_vars:
-            if one_var in result or one_var.lower() in result or one_var.upper() in result:
-                logging.warning("variable '%s' in constant and non-constant data => renamed to '%s_constant'!", one_var,
-                                one_var)
-                constant_data = constant_data.rename({one_var: "%s_constant" % one_var})
-        # rename dimensions?
-        if merge_same_size_dim:
-            datasets = __rename_same_size_dim([result, constant_data])
-        else:
-            datasets = [result, constant_data]
-        # merge constant data
-        if hasattr(xarray, "combine_by_coords"):
-            result = xarray.combine_by_coords(datasets)
-        else:
-            result = xarray.auto_combine(datasets)
+    # remove time axes if present
+    if "time" in constant_data.dims:
+        constant_data = constant_data.isel(time=0, drop=True)
+    elif "time" in constant_data.coords:
+        constant_data = constant_data.drop_vars("time")
+    # remove variables also present in the non constant data
+    for one_var in constant_data.data_vars:
+        if one_var in result or one_var.lower() in result or one_var.upper() in result:
+            logging.warning("variable '%s' in constant and non-constant data => renamed to '%s_constant'!", one_var,
+                            one_var)
+            constant_data = constant_data.rename({one_var: "%s_constant" % one_var})
+    # rename dimensions?
+    if merge_same_size_dim:
+        result, constant_data = __rename_same_size_dim([result, constant_data])
 
+    # align the constant data with the merged dataset. Only the small constant dataset is reindexed if the
+    # coordinates differ, the non-constant data is left as it is.
+    common_indexes = {name: result.indexes[name] for name in constant_data.indexes if name in result.indexes}
+    if any(not constant_data.indexes[name].equals(index) for name, index in common_indexes.items()):
+        constant_data = constant_data.reindex(common_indexes)
+    else:
+        constant_data = constant_data.assign_coords({name: result.coords[name] for name in common_indexes})
+    new_coords = {name: coord for name, coord in constant_data.coords.items() if name not in result.coords}
+    return result.assign_coords(new_coords).assign({name: variable for name, variable in
+                                                    constant_data.data_vars.items()})
+
+
+def __open_files(filenames, open_function, max_open_workers=None, max_open_files=None):
+    """
+    open multiple files concurrently in a pool of threads.
+
+    Parameters
+    ----------
+    filenames : list of str
+            names of all files to open
+
+    open_function : callable
+            function called with one file name, returns a dataset
+
+    max_open_workers : int
+            number of threads. Default: the default of concurrent.futures.ThreadPoolExecutor.
+
+    max_open_files : int
+            maximal number of files opened at the same time. Default: no limit.
+
+    Returns
+    -------
+    list of xarray.Dataset
+            datasets in the same order as the file names
+    """
+    if max_open_files is None:
+        semaphore = None
+        cache_options = {}
+    else:
+        semaphore = threading.BoundedSemaphore(max_open_files)
+        # xarray keeps files open after reading the header, limit the number of cached handles as well
+        cache_options = {"file_cache_maxsize": max_open_files}
+
+    def open_one_file(filename):
+        if semaphore is None:
+            return open_function(filename)
+        with semaphore:
+            return open_function(filename)
+
+    with xarray.set_options(**cache_options):
+        with ThreadPoolExecutor(max_workers=max_open_workers) as pool:
+            # the tasks report to the profiles of the calling thread
+            return list(pool.map(profiling.bind(open_one_file), filenames))
+
+
+def __read_metadata(filename, decode_times=True, leadtime=None, **kwargs):
+    """
+    read variables, dimensions, coordinates and attributes of one file. Data variables are replaced by placeholders.
+
+    Parameters
+    ----------
+    filename : str
+            name of the file to read
+
+    decode_times: bool
+            decode the times
+
+    leadtime : datetime.timedelta
+            lead time of the file from the manifest, used for GRIB files with leadtime_from_filename.
+
+    **kwargs
+            arguments of read
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    kwargs = dict(kwargs, in_memory=False)
+    # netcdf files are opened without dask, the data variables are not touched at all
+    if "chunks" not in kwargs and get_file_type(filename) in ["NC", "HDF"]:
+        kwargs["chunks"] = None
+    result = __open_dataset(filename, None, None, decode_times=decode_times, leadtime=leadtime, **kwargs)
+    for name, one_var in result.data_vars.items():
+        data = __metadata_placeholder(filename, name, one_var.shape, one_var.dtype)
+        result[name] = xarray.Variable(one_var.dims, data, attrs=one_var.attrs, encoding=one_var.encoding)
     return result
 
 
+def __metadata_placeholder(filename, name, shape, dtype):
+    """
+    create a dask array with one chunk which raises an error when computed.
+    """
+    token = "metadata-only-" + dask.base.tokenize(filename, name, shape, dtype)
+    graph = {(token,) + (0,) * len(shape): (__raise_metadata_only, filename, name)}
+    return dask.array.Array(graph, token, chunks=tuple((size,) for size in shape), dtype=dtype)
+
+
+def __raise_metadata_only(filename, name):
+    """
+    task of placeholder arrays created by read(metadata_only=True)
+    """
+    raise ValueError("variable '%s' of file '%s' was read with metadata_only=True, no data available!"
+                     % (name, filename))
+
+
 def __rename_same_size_dim(datasets):
     """
     Look for dimensions with the same size and rename them to the first name found.
@@ -310,21 +586,31 @@ def __rename_same_size_dim(datasets):
         return datasets
 
 
-def __merge_datasets(datasets):
+def __merge_datasets(datasets, depth=0):
     """
 
     Parameters
     ----------
     datasets
 
+    depth : int
+            recursion depth, only used for profiling.
+
     Returns
     -------
 
     """
+    profiling.count("merge_calls")
+    profiling.maximum("merge_depth", depth)
     # anything to do?
     if len(datasets) == 1:
         return datasets[0]
 
+    # datasets differing only in the values of some dimension coordinates are concatenated directly
+    result = __merge_homogeneous_datasets(datasets)
+    if result is not None:
+        return result
+
     # variables not available in all files are merged separately
     datasets_incomplete = []
     vars_not_in_all_files = set()
@@ -349,7 +635,7 @@ def __merge_datasets(datasets):
                     del ds[one_var]
                     new_unmerged_ds.append(new_ds)
         if len(new_unmerged_ds) > 0:
-            datasets_incomplete.append(__merge_datasets(new_unmerged_ds))
+            datasets_incomplete.append(__merge_datasets(new_unmerged_ds, depth + 1))
 
     # find common coordinates and sort variables according to those coordinates
     # get all coordinates
@@ -405,7 +691,7 @@ def __merge_datasets(datasets):
         if len(different_values) > 1:
             new_datasets = []
             for one_value in different_values:
-                new_datasets.append(__merge_datasets(datasets_with_one_coord_value[one_value]))
+                new_datasets.append(__merge_datasets(datasets_with_one_coord_value[one_value], depth + 1))
             datasets = new_datasets
 
     # are there datasets with ensemble_members attribute?
@@ -422,7 +708,7 @@ def __merge_datasets(datasets):
                 add_ensemble_dim(one_dataset, one_dataset.attrs["ensemble_member"], inplace=True)
             else:
                 logging.warning("Trying to merge ensemble and non-ensemble data. That will possibly fail!")
-        result = __merge_datasets(datasets)
+        result = __merge_datasets(datasets, depth + 1)
     else:
         # try to merge the datasets
         try:
@@ -450,7 +736,165 @@ def __merge_datasets(datasets):
     return result
 
 
-def __open_dataset(filename, client, worker, decode_times=True, **kwargs):
+def __merge_homogeneous_datasets(datasets):
+    """
+    fast path for the merge of datasets with the same variables, dimensions and grid, which differ only in the values
+    of one or more dimension coordinates (e.g., time, ens, or level). Such datasets are arranged in a regular grid
+    based on the first coordinate values and combined with one call of xarray.combine_nested. No coordinate values
+    are compared by xarray.
+
+    Parameters
+    ----------
+    datasets : list of xarray.Dataset
+            datasets to merge
+
+    Returns
+    -------
+    xarray.Dataset or None:
+            None is returned if the datasets are not homogeneous. The general merge has to be used in that case.
+    """
+    first = datasets[0]
+    data_vars = {name: one_var.dims for name, one_var in first.data_vars.items()}
+    coord_names = set(first.coords)
+    for ds in datasets[1:]:
+        if len(ds.data_vars) != len(data_vars) or set(ds.coords) != coord_names:
+            return None
+        for name, dims in data_vars.items():
+            if name not in ds.data_vars or ds[name].dims != dims:
+                return None
+
+    # ensemble members stored as attribute are converted into an ensemble dimension
+    members = [ds.attrs.get("ensemble_member") for ds in datasets]
+    if any(member is not None for member in members):
+        if any(member is None for member in members) or "ens" in first.dims:
+            return None
+        if len(set(members)) > 1:
+            datasets = [add_ensemble_dim(ds, member, inplace=False) for ds, member in zip(datasets, members)]
+            first = datasets[0]
+
+    # find the dimensions with different coordinate values in different datasets
+    varying_dims = []
+    for dim in first.dims:
+        if dim not in first.indexes:
+            if any(ds.sizes[dim] != first.sizes[dim] for ds in datasets[1:]):
+                return None
+            continue
+        first_index = first.indexes[dim]
+        if all(ds.indexes[dim].equals(first_index) for ds in datasets[1:]):
+            continue
+        varying_dims.append(dim)
+    if len(varying_dims) == 0:
+        return None
+
+    # all other coordinates have to be equal
+    for name in coord_names:
+        if name in first.dims or any(dim in first[name].dims for dim in varying_dims):
+            continue
+        first_coord = first.coords[name].variable
+        for ds in datasets[1:]:
+            coord = ds.coords[name].variable
+            if coord._data is not first_coord._data and not coord.equals(first_coord):
+                return None
+
+    # arrange the datasets in a regular grid. All datasets in one row of the grid share the same coordinate values
+    positions = []
+    for dim in varying_dims:
+        blocks = OrderedDict()
+        for ds in datasets:
+            index = ds.indexes[dim]
+            if index.size == 0:
+                return None
+            block = blocks.setdefault(index[0], index)
+            if block is not index and not block.equals(index):
+                return None
+        # the order of the blocks follows the order within the first dataset
+        first_index = first.indexes[dim]
+        descending = bool(first_index.size > 1 and first_index[0] > first_index[1])
+        starts = sorted(blocks.keys(), reverse=descending)
+        # the blocks must not overlap
+        for one_start, next_start in zip(starts[:-1], starts[1:]):
+            last_value = blocks[one_start][-1]
+            if (not descending and last_value >= next_start) or (descending and last_value <= next_start):
+                return None
+        positions.append({one_start: ipos for ipos, one_start in enumerate(starts)})
+    shape = tuple(len(one_positions) for one_positions in positions)
+    if np.prod(shape) != len(datasets):
+        return None
+    grid = np.empty(shape, dtype=object)
+    for ds in datasets:
+        position = tuple(one_positions[ds.indexes[dim][0]] for dim, one_positions in zip(varying_dims, positions))
+        if grid[position] is not None:
+            return None
+        grid[position] = ds
+
+    logging.debug("merging %d homogeneous datasets along %s" % (len(datasets), ", ".join(varying_dims)))
+    result = __concatenate_grid(grid, varying_dims)
+    if result is not None:
+        return result
+    if version.parse(xarray.__version__) >= version.parse('0.17.0'):
+        combine_attrs_methode = 'drop_conflicts'
+    else:
+        combine_attrs_methode = 'override'
+    return xarray.combine_nested(grid.tolist(), concat_dim=varying_dims, data_vars="all", coords="minimal",
+                                 compat="override", join="override", combine_attrs=combine_attrs_methode)
+
+
+def __concatenate_grid(grid, varying_dims):
+    """
+    concatenate a regular grid of datasets without alignment and comparison of the individual datasets. Only possible
+    if every data variable contains all varying dimensions. Coordinates are concatenated along the varying dimensions
+    they contain, coordinates without varying dimension are taken from the first dataset.
+
+    Parameters
+    ----------
+    grid : numpy.ndarray
+            object array of datasets, one array dimension per varying dimension.
+
+    varying_dims : list of str
+            names of the dimensions to concatenate.
+
+    Returns
+    -------
+    xarray.Dataset or None:
+            None if the concatenation is not possible in this simple way.
+    """
+    first = grid.flat[0]
+    for name, one_var in first.data_vars.items():
+        n_varying = len([dim for dim in varying_dims if dim in one_var.dims])
+        if n_varying != len(varying_dims):
+            return None
+
+    def concatenate(sub_grid, name, axes):
+        if len(axes) == 0:
+            return sub_grid.variables[name].data
+        parts = [concatenate(one_sub_grid, name, axes[1:]) for one_sub_grid in sub_grid]
+        if any(isinstance(part, dask.array.Array) for part in parts):
+            return dask.array.concatenate(parts, axis=axes[0])
+        return np.concatenate(parts, axis=axes[0])
+
+    variables = OrderedDict()
+    for name, one_var in first.variables.items():
+        var_varying_dims = [dim for dim in varying_dims if dim in one_var.dims]
+        if len(var_varying_dims) > 0:
+            # the first datasets along all other varying dimensions are sufficient
+            sub_grid = grid[tuple(slice(None) if dim in one_var.dims else 0 for dim in varying_dims)]
+            data = concatenate(sub_grid, name, [one_var.dims.index(dim) for dim in var_varying_dims])
+            variables[name] = xarray.Variable(one_var.dims, data, attrs=one_var.attrs, encoding=one_var.encoding)
+        else:
+            variables[name] = one_var
+
+    # attributes with different values in different datasets are dropped
+    attrs = dict(first.attrs)
+    for ds in grid.flat[1:]:
+        for key in list(attrs.keys()):
+            if key not in ds.attrs or not np.array_equal(np.asarray(ds.attrs[key]), np.asarray(attrs[key])):
+                del attrs[key]
+    return xarray.Dataset({name: variables[name] for name in first.data_vars},
+                          coords={name: variables[name] for name in first.coords},
+                          attrs=attrs)
+
+
+def __open_dataset(filename, client, worker, decode_times=True, leadtime=None, **kwargs):
     """
     read one input file. the type is automatically determined.
 
@@ -465,6 +909,9 @@ def __open_dataset(filename, client, worker, decode_times=True, **kwargs):
     worker: dask.distributed.Worker
             worker object when running inside of a dask cluster
 
+    leadtime : datetime.timedelta
+            lead time of the file from the manifest, used for GRIB files with leadtime_from_filename.
+
     **kwargs:
             additional keyword arguments for the underlying read functions
 
@@ -479,38 +926,86 @@ def __open_dataset(filename, client, worker, decode_times=True, **kwargs):
         raise ValueError("unable to guess the type of the input file '%s'" % filename)
 
     # read the data
-    if file_type in ["NC", "HDF"]:
-        # use h5netcdf to read HDF5-Files
-        engine = None
-        if file_type == "HDF":
-            engine = "h5netcdf"
-        if kwargs.get("in_memory", False) and client is None:
-            result0 = xarray.open_dataset(filename, engine=engine, decode_times=decode_times)
-            result = result0.compute().chunk()
-            result0.close()
-            result.close()
-        else:
-            # The keyword argument create_ens_dim isn't supposed to be passed to xarray.
-            _kwargs = {key: value for key, value in kwargs.items() if key != "create_ens_dim"}
-            result = xarray.open_dataset(filename, engine=engine, decode_times=decode_times, chunks={}, **_kwargs)
-            if client is not None:
-                if worker is not None:
-                    logging.debug("running on worker: %s" % worker.address)
-                    distributed.secede()
+    if profiling.is_active():
+        profiling.count("files_opened")
+        file_info = file_info_cache.stat(filename)
+        if file_info is not None:
+            profiling.count("file_bytes", file_info.size)
+    with profiling.timer("open_%s" % file_type.lower()):
+        if file_type in ["NC", "HDF"]:
+            # use h5netcdf to read HDF5-Files
+            engine = None
+            if file_type == "HDF":
+                engine = "h5netcdf"
+            if kwargs.get("in_memory", False) and client is None:
+                result0 = xarray.open_dataset(filename, engine=engine, decode_times=decode_times)
+                result = result0.compute().chunk()
+                result0.close()
+                result.close()
+            else:
+                # Keyword arguments handled by enstools aren't supposed to be passed to xarray.
+                _kwargs = {key: value for key, value in kwargs.items() if key not in enstools_read_kwargs}
+                result = xarray.open_dataset(filename, engine=engine, decode_times=decode_times,
+                                             chunks=__open_chunks(kwargs.get("chunks", {}), {}), **_kwargs)
+                if client is not None:
+                    if worker is not None:
+                        logging.debug("running on worker: %s" % worker.address)
+                        distributed.secede()
+                        with profiling.timer("persist"):
+                            result = result.persist()
+                        distributed.rejoin()
+                    else:
+                        with profiling.timer("persist"):
+                            result = result.persist()
+        elif file_type == "ZARR":
+            _kwargs = {key: value for key, value in kwargs.items() if key not in enstools_read_kwargs}
+            result = xarray.open_zarr(filename, decode_times=decode_times,
+                                      chunks=__open_chunks(kwargs.get("chunks", {}), {}), **_kwargs)
+            if kwargs.get("in_memory", False):
+                with profiling.timer("persist"):
                     result = result.persist()
-                    distributed.rejoin()
-                else:
+        elif file_type == "REF":
+            # all information is already merged, chunks are read directly from the referenced files
+            result = open_references(filename, decode_times=decode_times)
+            chunks = __open_chunks(kwargs.get("chunks", None), None)
+            if chunks is not None:
+                result = result.chunk(chunks)
+            if kwargs.get("in_memory", False):
+                with profiling.timer("persist"):
                     result = result.persist()
-    elif file_type == "GRIB":
-        result = read_grib_file(filename,
-                                debug=kwargs.get("debug", False),
-                                in_memory=kwargs.get("in_memory", False),
-                                leadtime_from_filename=kwargs.get("leadtime_from_filename", False),
-                                client=client,
-                                worker=worker,
-                                decode_times=decode_times)
-    else:
-        raise ValueError("unknown file type '%s' for file '%s'" % (file_type, filename))
+        elif file_type == "GRIB":
+            result = read_grib_file(filename,
+                                    debug=kwargs.get("debug", False),
+                                    in_memory=kwargs.get("in_memory", False),
+                                    leadtime_from_filename=kwargs.get("leadtime_from_filename", False),
+                                    client=client,
+                                    worker=worker,
+                                    decode_times=decode_times,
+                                    use_index=kwargs.get("grib_index", True),
+                                    index_dir=kwargs.get("grib_index_dir", None),
+                                    batch_messages=kwargs.get("batch_messages", False),
+                                    use_mmap=kwargs.get("grib_mmap", True),
+                                    chunks=__open_chunks(kwargs.get("chunks", None), None),
+                                    variables=kwargs.get("variables", None),
+                                    levels=kwargs.get("levels", None),
+                                    members=kwargs.get("members", None),
+                                    time=kwargs.get("time", None),
+                                    leadtime=leadtime)
+        else:
+            raise ValueError("unknown file type '%s' for file '%s'" % (file_type, filename))
+
+    # the selection is done within read_grib_file for grib files, other files are sub-setted lazily
+    if file_type != "GRIB":
+        result = __select(result, variables=kwargs.get("variables", None), levels=kwargs.get("levels", None),
+                          members=kwargs.get("members", None), time=kwargs.get("time", None))
+
+    # nothing in this file matches the selection, the file is skipped by read
+    if len(result.data_vars) == 0 and __has_selection(kwargs):
+        return result
+
+    # planned chunks of the selected data. The files are opened in parallel, every file is planned on its own
+    if isinstance(kwargs.get("chunks", None), str) and kwargs["chunks"] == "auto":
+        result = result.chunk(plan_dataset_chunks(result, n_workers=1))
 
     # check for additional coordinate variables like staggered lat/lon values
     for one_name, one_var in six.iteritems(result.data_vars):
@@ -530,6 +1025,92 @@ def __open_dataset(filename, client, worker, decode_times=True, **kwargs):
     return result
 
 
+def __open_chunks(chunks, file_chunks):
+    """
+    chunks used to open a file. With chunks="auto", files are opened with the chunks of the file (GRIB: one chunk per
+    message) and rechunked with planned chunks after the selection of variables and levels.
+    """
+    if isinstance(chunks, str) and chunks == "auto":
+        return file_chunks
+    return chunks
+
+
+def __has_selection(kwargs):
+    """
+    True if variables, levels, members or times are selected.
+    """
+    return any(kwargs.get(name, None) is not None for name in ["variables", "levels", "members", "time"])
+
+
+def __check_selected_variables(variables, datasets):
+    """
+    raise a ValueError for selected variables which are not part of any file. Variables of GRIB files may also be
+    selected by name and type of level (e.g., t_isobaricInhPa).
+    """
+    if variables is None:
+        return
+    if isinstance(variables, str):
+        variables = [variables]
+    found = set()
+    for one_ds in datasets:
+        found.update(one_ds.variables)
+    missing = [name for name in variables
+               if name not in found and not any(name.startswith("%s_" % one_name) for one_name in found)]
+    if len(missing) > 0:
+        raise ValueError("the selected variables %s are not part of any input file" % ", ".join(missing))
+
+
+def __select(dataset, variables=None, levels=None, members=None, time=None):
+    """
+    select variables, ensemble members and times from a dataset which was not read by read_grib_file.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+            dataset to subset
+
+    variables : str or list of str
+            names of the data variables to keep
+
+    levels :
+            not supported for other files than GRIB, the name of the vertical dimension is unknown.
+
+    members : int or list of int
+            values of the ens coordinate to keep
+
+    time : datetime-like or list of datetime-like
+            values of the time coordinate to keep
+
+    Returns
+    -------
+    xarray.Dataset
+            the selected part of the dataset, an empty dataset if nothing in this file matches the selection. Files
+            of a multi-file read usually contain only some of the selected variables, times or members. Variables
+            which are not part of any file are rejected by read.
+    """
+    if levels is not None:
+        raise ValueError("the selection of levels is only supported for GRIB files, use Dataset.sel instead")
+    if variables is not None:
+        if isinstance(variables, str):
+            variables = [variables]
+        variables = [name for name in variables if name in dataset.variables]
+        if len(variables) == 0:
+            return xarray.Dataset()
+        dataset = dataset[variables]
+    # values missing in this file are ignored instead of being reindexed
+    selection = {}
+    if members is not None and "ens" in dataset.dims:
+        selection["ens"] = np.flatnonzero(dataset["ens"].isin(np.atleast_1d(members)).values)
+    if time is not None and "time" in dataset.dims:
+        values = np.atleast_1d(np.asarray(time, dtype="datetime64[ns]"))
+        selection["time"] = np.flatnonzero(dataset["time"].isin(values).values)
+    if any(len(indices) == 0 for indices in selection.values()):
+        return xarray.Dataset()
+    if len(selection) > 0:
+        dataset = dataset.isel(selection)
+    return dataset
+
+
 def expand_file_pattern(pattern):
     """
     use glob to find all files matching the pattern
@@ -550,45 +1131,3 @@ def expand_file_pattern(pattern):
         return files
     else:
         return [pattern]
-
-
-def __assign_ensemble_member_number_to_folders(folders):
-    """
-    used internally to extract numbers from the folders and use them as ensemble member numbers. If not all folders
-    contain numbers, or if they are not unique, then create consecutive numbers.
-
-    Parameters
-    ----------
-    folders : list
-            list of absolute paths
-
-    Returns
-    -------
-    dict :
-            dictionary where the key is the absolute path and the value if the ensemble member number
-    """
-
-    # extract all digits from the last parts of the folders
-    digits = []
-    for ifolder, folder in enumerate(folders):
-        prefix, one_path = os.path.split(folder)
-        digits_for_path = ""
-        for letter in one_path:
-            if letter.isdigit():
-                digits_for_path += letter
-        if digits_for_path == "":
-            digits_for_path = ifolder + 1
-        else:
-            digits_for_path = int(digits_for_path)
-        digits.append(digits_for_path)
-
-    # are all numbers unique?
-    digits = np.unique(digits)
-    if len(digits) < len(folders):
-        digits = np.linspace(1, len(folders), len(folders), dtype=np.int32)
-
-    # create the result dictionary
-    result = {}
-    for ifolder in range(len(folders)):
-        result[folders[ifolder]] = digits[ifolder]
-    return result
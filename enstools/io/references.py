@@ -0,0 +1,360 @@
+"""
+Reference maps of NetCDF4/HDF5 files. A reference map stores the merged structure of a set of files together with the
+byte ranges of all chunks of all data variables. Opening a reference map requires neither the metadata of the
+individual files nor the merge step of read, the chunks are read directly from the files when the data is computed.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import json
+import logging
+import os
+import zlib
+import numpy as np
+import xarray
+import dask.array
+import dask.base
+import h5py
+from numcodecs import Shuffle
+from .file_type import get_file_type
+from .paths import clean_paths
+
+# version of the reference map format
+REFERENCES_VERSION = 1
+
+# HDF5 filters, which can be decoded without the HDF5 library
+__FILTER_DEFLATE = 1
+__FILTER_SHUFFLE = 2
+__FILTER_FLETCHER32 = 3
+
+# encoding information of data variables which is required to decode the raw data
+__cf_encoding_keys = ["_FillValue", "missing_value", "scale_factor", "add_offset", "units", "calendar", "_Unsigned"]
+
+
+def create_references(filenames, output=None, decode_times=True, max_open_workers=None):
+    """
+    scan a set of NetCDF4/HDF5 files once and create a reference map of the merged dataset. The map can be opened
+    with open_references or with enstools.io.read.
+
+    Parameters
+    ----------
+    filenames : list of str or str
+            names of individual files or filename pattern. All files are merged in the same way as by read.
+
+    output : str
+            name of a JSON file to store the reference map in. Default: the map is only returned.
+
+    decode_times : bool
+            decode the times while merging the files.
+
+    max_open_workers : int
+            number of threads used to scan the files.
+
+    Returns
+    -------
+    dict:
+            the reference map
+
+    Examples
+    --------
+    >>> create_references("forecast_*.nc", "forecast.json")  # doctest: +SKIP
+    >>> ds = enstools.io.read("forecast.json")  # doctest: +SKIP
+    """
+    from .reader import read, __merge_datasets as merge_datasets
+    filenames = [os.path.abspath(one_file) for one_file in clean_paths(filenames)]
+    for one_file in filenames:
+        if get_file_type(one_file) != "HDF":
+            raise ValueError("reference maps are only supported for NetCDF4/HDF5 files, not for '%s'" % one_file)
+
+    # structure of the individual files and of the merged dataset
+    with ThreadPoolExecutor(max_workers=max_open_workers) as pool:
+        files = list(pool.map(lambda x: (x, read(x, metadata_only=True, decode_times=decode_times),
+                                         __scan_chunks(x)), filenames))
+    merged = merge_datasets([dataset.copy(deep=False) for _, dataset, _ in files])
+
+    references = {"enstools_references": REFERENCES_VERSION,
+                  "files": [[one_file, os.stat(one_file).st_mtime_ns, os.stat(one_file).st_size]
+                            for one_file in filenames],
+                  "attrs": __to_json(merged.attrs),
+                  "coords": {},
+                  "variables": {}}
+
+    # coordinates are stored inline in encoded form
+    for name, one_coord in merged.coords.items():
+        encoded = xarray.conventions.encode_cf_variable(one_coord.variable, name=name)
+        references["coords"][name] = __inline_variable(encoded)
+
+    # data variables are stored as references to the chunks within the files
+    for name, one_var in merged.data_vars.items():
+        references["variables"][name] = __variable_references(name, one_var, merged, files)
+
+    if output is not None:
+        # write to a temporary file first, readers never see an incomplete map
+        tmp_name = "%s.tmp%d" % (output, os.getpid())
+        with open(tmp_name, "w") as f:
+            json.dump(references, f)
+        os.replace(tmp_name, output)
+        logging.debug("reference map of %d files written to %s" % (len(filenames), output))
+    return references
+
+
+def open_references(references, decode_times=True):
+    """
+    open a reference map created by create_references as one lazily chunked dataset.
+
+    Parameters
+    ----------
+    references : str or dict
+            name of a reference file or the reference map itself.
+
+    decode_times : bool
+            decode the times
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    if not isinstance(references, dict):
+        with open(references, "r") as f:
+            references = json.load(f)
+    if references.get("enstools_references", None) != REFERENCES_VERSION:
+        raise ValueError("unsupported reference map version: %s" % references.get("enstools_references", None))
+
+    # the byte ranges are only valid for unchanged files
+    files = []
+    token = dask.base.tokenize(references["files"])
+    for one_file, mtime, size in references["files"]:
+        stat = os.stat(one_file)
+        if stat.st_mtime_ns != mtime or stat.st_size != size:
+            raise IOError("file '%s' was modified after the creation of the reference map" % one_file)
+        files.append(one_file)
+
+    variables = {}
+    for name, one_coord in references["coords"].items():
+        variables[name] = xarray.Variable(one_coord["dims"], __decode_inline(one_coord),
+                                          attrs=one_coord["attrs"])
+    for name, one_var in references["variables"].items():
+        variables[name] = xarray.Variable(one_var["dims"], __create_variable_array(name, one_var, files, token),
+                                          attrs=one_var["attrs"])
+    dataset = xarray.Dataset({name: variables[name] for name in references["variables"]},
+                             coords={name: variables[name] for name in references["coords"]},
+                             attrs=references["attrs"])
+    return xarray.decode_cf(dataset, decode_times=decode_times)
+
+
+def __scan_chunks(filename):
+    """
+    collect the byte ranges of all chunks of all datasets within one file.
+
+    Returns
+    -------
+    dict:
+            for every dataset: storage shape of the chunks, filter pipeline and list of
+            (chunk offset, filter mask, byte offset, size), or inline data of compact datasets.
+    """
+    result = {}
+    with h5py.File(filename, "r") as f:
+        for name, dset in f.items():
+            if not isinstance(dset, h5py.Dataset) or dset.dtype.kind not in "biuf":
+                continue
+            plist = dset.id.get_create_plist()
+            filters = []
+            for ifilter in range(plist.get_nfilters()):
+                code, flags, values, filter_name = plist.get_filter(ifilter)
+                filters.append(code)
+            chunks = []
+            inline = None
+            if dset.chunks is not None:
+                chunk_shape = dset.chunks
+                if hasattr(dset.id, "chunk_iter"):
+                    dset.id.chunk_iter(lambda info: chunks.append(
+                        (info.chunk_offset, info.filter_mask, info.byte_offset, info.size)))
+                else:
+                    for ichunk in range(dset.id.get_num_chunks()):
+                        info = dset.id.get_chunk_info(ichunk)
+                        chunks.append((info.chunk_offset, info.filter_mask, info.byte_offset, info.size))
+            else:
+                chunk_shape = dset.shape
+                offset = dset.id.get_offset()
+                if offset is not None:
+                    chunks.append(((0,) * dset.ndim, 0, offset, dset.id.get_storage_size()))
+                elif dset.id.get_storage_size() > 0:
+                    # compact datasets are stored within the header of the file
+                    inline = dset[()]
+            result[name] = {"dtype": dset.dtype.str, "shape": dset.shape, "chunk_shape": tuple(chunk_shape),
+                            "filters": filters, "chunks": chunks, "inline": inline}
+    return result
+
+
+def __variable_references(name, variable, merged, files):
+    """
+    create the references of one data variable of the merged dataset.
+    """
+    references = {"dims": list(variable.dims), "shape": list(variable.shape), "attrs": {}, "layouts": [],
+                  "chunks": None, "refs": [], "inline": []}
+    boxes = []
+    for ifile, (filename, dataset, chunk_info) in enumerate(files):
+        if name not in dataset.data_vars:
+            continue
+        if name not in chunk_info:
+            raise ValueError("variable '%s' has an unsupported data type for reference maps" % name)
+        if dataset[name].dims != variable.dims:
+            raise ValueError("variable '%s' has different dimensions in different files" % name)
+        info = chunk_info[name]
+        for code in info["filters"]:
+            if code not in [__FILTER_DEFLATE, __FILTER_SHUFFLE, __FILTER_FLETCHER32]:
+                raise ValueError("variable '%s' uses the HDF5 filter %d, which is not supported by reference maps"
+                                 % (name, code))
+        if "dtype" not in references:
+            references["dtype"] = info["dtype"]
+            encoding = dataset[name].encoding
+            attrs = dict(dataset[name].attrs)
+            attrs.update({key: encoding[key] for key in __cf_encoding_keys if key in encoding})
+            references["attrs"] = __to_json(attrs)
+        elif references["dtype"] != info["dtype"]:
+            raise ValueError("variable '%s' has different data types in different files" % name)
+        layout = {"chunk_shape": list(info["chunk_shape"]), "filters": info["filters"]}
+        if layout not in references["layouts"]:
+            references["layouts"].append(layout)
+        ilayout = references["layouts"].index(layout)
+
+        # position of the file within the merged variable
+        start = []
+        for dim, size in zip(variable.dims, dataset[name].shape):
+            if dim in merged.indexes:
+                positions = merged.indexes[dim].get_indexer(dataset.indexes[dim])
+                if np.any(positions < 0) or np.any(positions != positions[0] + np.arange(size)):
+                    raise ValueError("variable '%s' of file '%s' is not a contiguous part of the merged dataset"
+                                     % (name, filename))
+                start.append(int(positions[0]))
+            elif size != merged.sizes[dim]:
+                raise ValueError("dimension '%s' has different sizes in different files" % dim)
+            else:
+                start.append(0)
+
+        # the boxes covered by all chunks within the merged variable
+        def box(offset):
+            return [(first + one_offset, first + min(one_offset + chunk, size))
+                    for first, one_offset, chunk, size in zip(start, offset, info["chunk_shape"], info["shape"])]
+        for offset, filter_mask, byte_offset, nbytes in info["chunks"]:
+            boxes.append((box(offset), [ifile, int(byte_offset), int(nbytes), int(filter_mask), ilayout]))
+        if info["inline"] is not None:
+            boxes.append((box((0,) * len(start)), __inline_array(info["inline"])))
+
+    # the chunks of all files define the chunks of the merged variable
+    boundaries = [{0, size} for size in variable.shape]
+    for one_box, _ in boxes:
+        for idim, (first, last) in enumerate(one_box):
+            boundaries[idim].update((first, last))
+    boundaries = [sorted(one_boundaries) for one_boundaries in boundaries]
+    references["chunks"] = [np.diff(one_boundaries).tolist() for one_boundaries in boundaries]
+    block_ids = [{value: index for index, value in enumerate(one_boundaries)} for one_boundaries in boundaries]
+    used_blocks = set()
+    for one_box, ref in boxes:
+        block = []
+        for idim, (first, last) in enumerate(one_box):
+            index = block_ids[idim][first]
+            if boundaries[idim][index + 1] != last:
+                raise ValueError("the chunks of variable '%s' are not aligned between the files" % name)
+            block.append(index)
+        if tuple(block) in used_blocks:
+            raise ValueError("the files contain overlapping parts of variable '%s'" % name)
+        used_blocks.add(tuple(block))
+        if isinstance(ref, dict):
+            references["inline"].append([block, ref])
+        else:
+            references["refs"].append([block] + ref)
+    return references
+
+
+def __create_variable_array(name, references, files, token):
+    """
+    create a dask array for one data variable with one task per referenced chunk. The token identifies the
+    referenced files including their modification times.
+    """
+    dtype = np.dtype(references["dtype"])
+    chunks = tuple(tuple(one_chunks) for one_chunks in references["chunks"])
+    token = "references-%s-%s" % (name, token)
+
+    # blocks without data are filled with the fill value
+    fill_value = references["attrs"].get("_FillValue", np.nan if dtype.kind == "f" else 0)
+    graph = {}
+    for block in np.ndindex(*[len(one_chunks) for one_chunks in chunks]):
+        block_shape = tuple(one_chunks[index] for one_chunks, index in zip(chunks, block))
+        graph[(token,) + block] = (np.full, block_shape, fill_value, dtype)
+    for block, ifile, byte_offset, nbytes, filter_mask, ilayout in references["refs"]:
+        block_shape = tuple(one_chunks[index] for one_chunks, index in zip(chunks, block))
+        layout = references["layouts"][ilayout]
+        graph[(token,) + tuple(block)] = (__read_chunk, files[ifile], byte_offset, nbytes, filter_mask,
+                                          layout["filters"], dtype, tuple(layout["chunk_shape"]), block_shape)
+    for block, inline in references["inline"]:
+        graph[(token,) + tuple(block)] = __decode_inline(inline)
+    return dask.array.Array(graph, token, chunks=chunks, dtype=dtype)
+
+
+def __read_chunk(filename, byte_offset, nbytes, filter_mask, filters, dtype, chunk_shape, block_shape):
+    """
+    read and decode one chunk of a HDF5 dataset without the HDF5 library.
+    """
+    with open(filename, "rb") as f:
+        f.seek(byte_offset)
+        data = f.read(nbytes)
+    # filters are applied in reverse order, bit i of the mask marks a skipped filter
+    for ifilter in reversed(range(len(filters))):
+        if filter_mask & (1 << ifilter):
+            continue
+        if filters[ifilter] == __FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif filters[ifilter] == __FILTER_SHUFFLE:
+            data = Shuffle(elementsize=dtype.itemsize).decode(data)
+        elif filters[ifilter] == __FILTER_FLETCHER32:
+            data = data[:-4]
+    array = np.frombuffer(data, dtype=dtype).reshape(chunk_shape)
+    # chunks at the edges of a dataset are stored with full size
+    return array[tuple(slice(0, size) for size in block_shape)]
+
+
+def __inline_variable(variable):
+    """
+    store the data and attributes of a small variable within the reference map.
+    """
+    result = __inline_array(np.asarray(variable.values))
+    result["dims"] = list(variable.dims)
+    result["attrs"] = __to_json(variable.attrs)
+    return result
+
+
+def __inline_array(array):
+    """
+    encode a numpy array as base64 string.
+    """
+    if array.dtype.kind in "OSU":
+        return {"dtype": "object", "shape": list(array.shape), "data": __to_json(array)}
+    array = np.ascontiguousarray(array)
+    return {"dtype": array.dtype.str, "shape": list(array.shape),
+            "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def __decode_inline(inline):
+    """
+    decode an array stored by __inline_array
+    """
+    if inline["dtype"] == "object":
+        return np.array(inline["data"], dtype=object).reshape(inline["shape"])
+    return np.frombuffer(base64.b64decode(inline["data"]), dtype=inline["dtype"]).reshape(inline["shape"]).copy()
+
+
+def __to_json(value):
+    """
+    convert attribute values into types supported by json.
+    """
+    if isinstance(value, dict):
+        return {str(key): __to_json(one_value) for key, one_value in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [__to_json(one_value) for one_value in value]
+    if isinstance(value, np.ndarray):
+        return __to_json(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
@@ -0,0 +1,168 @@
+"""
+Write-behind output of datasets produced step by step, e.g., by the post-processing of a forecast one time step at a
+time. Computing the next step and writing the previous step overlap.
+"""
+from pathlib import Path
+import threading
+import logging
+import queue
+from .file_type import get_file_type
+from . import writer
+
+
+class StreamWriter:
+    """
+    Collect datasets along one dimension (usually time) in one NetCDF file or zarr store. Datasets passed to write are
+    computed by the caller and encoded, compressed and written by a background thread. The number of computed datasets
+    waiting to be written is limited by max_queue, write blocks if the queue is full.
+
+    The output is created under a temporary name (<file_path>.tmp) and extended in place. It is renamed to file_path
+    when the writer is closed without errors. Errors of the background thread are raised by the next call of write or
+    by close.
+
+    Examples
+    --------
+    >>> with StreamWriter("forecast.nc", chunking="map") as output:  # doctest: +SKIP
+    ...     for step in range(48):
+    ...         output.write(postprocess(step))
+    """
+    def __init__(self, file_path, append_dim="time", max_queue=2, file_format=None, **kwargs):
+        """
+        Parameters
+        ----------
+        file_path : str or Path
+                name of the file or store to create.
+
+        append_dim : str
+                dimension along which the datasets are collected. Default: "time".
+
+        max_queue : int
+                maximal number of computed datasets waiting to be written. Default: 2.
+
+        file_format : {'NC', 'ZARR'}
+                format of the output, default: based on the file extension.
+
+        **kwargs
+                further arguments of enstools.io.write used to create the output (compression, chunking,
+                chunk_bytes, engine).
+        """
+        self.file_path = Path(file_path).resolve()
+        self.tmp_path = Path(f"{self.file_path}.tmp")
+        self.append_dim = append_dim
+        self.file_format = file_format or get_file_type(self.file_path.name, only_extension=True)
+        if self.file_format not in ["NC", "ZARR"]:
+            raise ValueError("the format '%s' is not supported by StreamWriter!" % self.file_format)
+        self.write_kwargs = kwargs
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.error_raised = False
+        self.aborted = False
+        self.n_written = 0
+        self.closed = False
+        self.end_of_stream = object()
+        writer._remove_store(self.tmp_path)
+        self.thread = threading.Thread(target=self.__write_datasets, name="stream-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, ds):
+        """
+        compute a dataset and hand it over to the background thread.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset or xarray.DataArray
+                next part of the output, all parts need the same variables and dimensions.
+        """
+        if self.closed:
+            raise ValueError("StreamWriter for '%s' is already closed" % self.file_path)
+        self.__raise_error()
+        # the computation is done by the caller, the background thread only encodes and writes
+        self.__put(ds.compute())
+
+    def close(self):
+        """
+        write all remaining datasets, wait for the background thread, and rename the output to its final name.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.__put(self.end_of_stream)
+        self.thread.join()
+        if self.error is not None:
+            writer._remove_store(self.tmp_path)
+            self.__raise_error()
+            return
+        if self.n_written > 0:
+            writer._replace_store(self.tmp_path, self.file_path)
+            logging.debug("StreamWriter: %d datasets written to %s" % (self.n_written, self.file_path))
+
+    def abort(self):
+        """
+        stop the background thread and remove the incomplete output.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.aborted = True
+        self.__put(self.end_of_stream)
+        self.thread.join()
+        writer._remove_store(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __write_datasets(self):
+        """
+        loop of the background thread. After an error, remaining datasets are discarded.
+        """
+        while True:
+            ds = self.queue.get()
+            if ds is self.end_of_stream:
+                return
+            if self.error is not None or self.aborted:
+                continue
+            try:
+                self.__write_one_dataset(ds)
+                self.n_written += 1
+            except BaseException as ex:
+                self.error = ex
+
+    def __write_one_dataset(self, ds):
+        """
+        create the output with the first dataset and append all further datasets in place.
+        """
+        if self.n_written == 0:
+            writer.write(ds, self.tmp_path, file_format=self.file_format, mode="append", append_dim=self.append_dim,
+                         **self.write_kwargs)
+        elif self.file_format == "NC":
+            if not hasattr(ds, "data_vars"):
+                ds = ds.to_dataset()
+            writer._append_netcdf_in_place(ds, self.tmp_path, self.append_dim)
+        else:
+            writer.write(ds, self.tmp_path, file_format=self.file_format, mode="append", append_dim=self.append_dim)
+
+    def __put(self, item):
+        """
+        put an item into the queue, raise errors of the background thread while waiting.
+        """
+        while True:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if item is not self.end_of_stream:
+                    self.__raise_error()
+
+    def __raise_error(self):
+        """
+        raise the error of the background thread once.
+        """
+        if self.error is not None and not self.error_raised:
+            self.error_raised = True
+            raise self.error
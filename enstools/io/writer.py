@@ -1,10 +1,20 @@
 import logging
+import multiprocessing
+import os
+import shutil
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from os import rename
 from typing import Union
 
+import dask
 import dask.array
+import numpy as np
+import pandas
 import six
 import xarray
+import h5netcdf
 from xarray.backends.netCDF4_ import NetCDF4DataStore
 from pathlib import Path
 
@@ -22,8 +32,24 @@ try:
 except ModuleNotFoundError:
     compression_available = False
 
+try:
+    import zarr
+    import numcodecs
+
+    zarr_available = True
+except ModuleNotFoundError:
+    zarr_available = False
+
+from enstools.misc import get_time_dim, get_ensemble_dim
 from .file_type import get_file_type
 
+# parts of names of vertical dimensions
+__vertical_dim_names = ["lev", "height", "depth", "isobaric", "hybrid", "vertical", "pressure", "soil"]
+
+# encoding entries of input files which describe the storage layout and must not be reused for zarr stores
+__storage_encoding_keys = ["chunks", "chunksizes", "preferred_chunks", "compressor", "compressors", "filters",
+                           "zlib", "complevel", "shuffle", "fletcher32", "contiguous", "blosc_shuffle"]
+
 
 def write(ds: Union[xarray.Dataset, xarray.DataArray],
           file_path: Union[str, Path],
@@ -32,6 +58,11 @@ def write(ds: Union[xarray.Dataset, xarray.DataArray],
           compute: bool = True,
           engine: str = "h5netcdf",
           format: str = "NETCDF4",
+          chunking: Union[str, dict, None] = None,
+          chunk_bytes: int = 2 ** 18,
+          processes: Union[int, None] = None,
+          mode: str = "write",
+          append_dim: str = "time",
           ):
     """
     write a xarray dataset to a file
@@ -44,8 +75,8 @@ def write(ds: Union[xarray.Dataset, xarray.DataArray],
     file_path : string or Path
             the file to create
 
-    file_format : {'NC'}
-            string indicating the format to use. if not specified, the file extension if used.
+    file_format : {'NC', 'ZARR'}
+            string indicating the format to use. if not specified, the file extension if used (.zarr for ZARR).
             
     compression : string
             Used to specify the compression mode and optionally additional arguments.
@@ -96,8 +127,57 @@ def write(ds: Union[xarray.Dataset, xarray.DataArray],
             For more details see the corresponding documentation.
 
             Another option would be to pass the path to a YAML configuration file as argument.
+
+            For ZARR stores, only lossless compression is supported. The string "lossless,backend,compression_level"
+            selects a numcodecs.Blosc compressor, alternatively any numcodecs compressor object can be given.
+            Without compression, the default compressor of zarr is used.
     compute : bool 
             Dask delayed feature. Set to true to delay the file writing.
+
+    chunking : {'auto', 'timeseries', 'map'} or dict
+            chunk shapes of the stored arrays, selected for each variable individually:
+
+            - 'map': chunks contain complete horizontal fields. Further levels, members, or times are added until
+              the chunks reach chunk_bytes. Fast access to individual fields.
+            - 'timeseries': chunks contain the complete time dimension for one ensemble member and level, and a
+              horizontal patch as large as possible within chunk_bytes. Fast access to time series of single points.
+            - 'auto': chunks of about chunk_bytes with similar extent in all dimensions (dask's auto chunking).
+            - dict: chunk size per dimension. Dimensions not mentioned are not split.
+
+            For ZARR stores, the dataset is rechunked accordingly and every chunk is written by its own dask task,
+            in parallel on the workers if a dask-distributed client is available. Default: the chunks of the backend
+            (NC) or the dask chunks of the dataset (ZARR).
+
+    chunk_bytes : int
+            target size of the chunks in bytes for chunking='auto', 'timeseries', or 'map'. Reads of a part of a
+            chunk have to decompress the complete chunk, smaller chunks increase the number of chunks.
+            Default: 256 KiB.
+
+    processes : int
+            number of processes writing groups of variables in parallel (NC only, requires compute=True and format
+            NETCDF4). Every process computes, compresses and writes its variables into a temporary file. The final
+            file is assembled by copying the compressed chunks without decoding them again. Default: all variables
+            are written by one call of xarray.Dataset.to_netcdf.
+
+            The processes are started with the 'spawn' method and import the main module of the calling script
+            again. Scripts have to protect their code with ``if __name__ == "__main__":``. Without this guard, the
+            processes fail during startup, a warning is logged and the remaining variables are written by the calling
+            process.
+
+    mode : {'write', 'append'}
+            'write' (default) creates a new file. 'append' adds the dataset along append_dim to an existing file or
+            store, only the new slices are written. The variables, their dimensions and types, and all coordinates
+            without append_dim have to match the existing file, and the new values of append_dim have to follow the
+            existing ones. Variables without append_dim are not written again. A file which does not exist yet is
+            created with an unlimited append_dim.
+
+            NetCDF files are extended in place, the new values are checked and encoded before the file is modified.
+            For ZARR stores, only the new chunks are written and the consolidated metadata is updated at the
+            end, readers using the consolidated metadata (like enstools.io.read) see the new slices only afterwards.
+            Requires compute=True.
+
+    append_dim : str
+            name of the dimension to append to. Default: "time".
     """
 
     file_path = Path(file_path).resolve()
@@ -107,7 +187,7 @@ def write(ds: Union[xarray.Dataset, xarray.DataArray],
         ds = ds.to_dataset()
 
     # select the type of file to create
-    valid_formats = ["NC"]
+    valid_formats = ["NC", "ZARR"]
     if file_format is not None:
         selected_format = file_format
     else:
@@ -115,6 +195,19 @@ def write(ds: Union[xarray.Dataset, xarray.DataArray],
     if selected_format not in valid_formats:
         raise ValueError("the format '%s' is not (yet) supported!" % selected_format)
 
+    if mode not in ["write", "append"]:
+        raise ValueError("unsupported mode '%s', use 'write' or 'append'" % mode)
+    if mode == "append":
+        if not compute:
+            raise ValueError("mode='append' requires compute=True")
+        ds = __append_dim_encoding(ds, append_dim)
+        if selected_format == "ZARR" and os.path.exists(file_path):
+            return __append_zarr(ds, file_path, append_dim)
+
+    if selected_format == "ZARR":
+        return __write_zarr(ds, file_path, compression=compression, chunking=chunking, chunk_bytes=chunk_bytes,
+                            compute=compute)
+
     if compression is not None:
         help_message = "To use the compression argument please install enstools-encoding:\n" \
                        "pip install enstools-encoding"
@@ -135,10 +228,22 @@ def write(ds: Union[xarray.Dataset, xarray.DataArray],
             logging.warning("Using netcdf4 engine. Setting encoding to None")
             dataset_encoding = None
 
+    # select the chunk shapes of all variables
+    if chunking is not None:
+        ds, dataset_encoding = __netcdf_chunk_encoding(ds, chunking, chunk_bytes, dataset_encoding)
+
     # write a netcdf file
     if selected_format == "NC":
         # We can do the trick of changing the name to filename.tmp and changing it back after the process is completed
         # but only if we execute the task here ( i.e. compute==True).
+        if mode == "append":
+            return __append_netcdf(ds, file_path, append_dim, engine=engine, encoding=dataset_encoding,
+                                   format=format)
+        if processes is not None and processes > 1:
+            if not compute or format != "NETCDF4":
+                raise ValueError("writing with multiple processes requires compute=True and format='NETCDF4'")
+            __write_netcdf_parallel(ds, file_path, processes, engine=engine, encoding=dataset_encoding)
+            return None
         if compute:
             final_filename = file_path
             file_path = f"{file_path}.tmp"
@@ -146,3 +251,486 @@ def write(ds: Union[xarray.Dataset, xarray.DataArray],
         if compute:
             rename(file_path, final_filename)
         return task
+
+
+def __netcdf_chunk_encoding(ds, chunking, chunk_bytes, encoding=None):
+    """
+    add the selected chunk shapes to the encoding of all variables.
+
+    Returns
+    -------
+    tuple:
+            shallow copy of the dataset with updated variable encodings and the updated explicit encoding.
+    """
+    ds = ds.copy(deep=False)
+    if encoding is not None:
+        encoding = {name: dict(encoding[name]) for name in encoding}
+    for name, one_var in ds.variables.items():
+        if one_var.ndim == 0 or one_var.size == 0:
+            continue
+        chunks = __storage_chunks(one_var, chunking, chunk_bytes)
+        # an explicit encoding replaces the encoding of the variable
+        var_encoding = encoding[name] if encoding is not None and name in encoding else one_var.encoding
+        var_encoding.pop("contiguous", None)
+        var_encoding["chunksizes"] = chunks
+    return ds, encoding
+
+
+def __storage_chunks(variable, chunking, chunk_bytes):
+    """
+    select the chunk shape of one variable.
+
+    Parameters
+    ----------
+    variable : xarray.Variable
+            the variable to store
+
+    chunking : str or dict
+            access pattern ('auto', 'timeseries', or 'map') or chunk size per dimension
+
+    chunk_bytes : int
+            target size of one chunk in bytes
+
+    Returns
+    -------
+    tuple:
+            chunk size for each dimension of the variable
+    """
+    dims, shape = variable.dims, variable.shape
+    if isinstance(chunking, dict):
+        return tuple(max(min(chunking.get(dim, size), size), 1) for dim, size in zip(dims, shape))
+    if chunking == "auto":
+        chunks = dask.array.core.normalize_chunks("auto", shape, limit=chunk_bytes, dtype=variable.dtype)
+        return tuple(max(one_chunks[0], 1) if len(one_chunks) > 0 else 1 for one_chunks in chunks)
+    if chunking not in ["map", "timeseries"]:
+        raise ValueError("unsupported chunking '%s', use 'auto', 'timeseries', 'map', or a dict" % chunking)
+
+    # horizontal dimensions are the right-most dimensions which are not time, ensemble, or vertical dimensions
+    time_dim = get_time_dim(variable)
+    other_dims = [time_dim, get_ensemble_dim(variable)]
+    horizontal = [dim for dim in dims if dim not in other_dims
+                  and not any(name in dim.lower() for name in __vertical_dim_names)][-2:]
+    sizes = dict(zip(dims, shape))
+    elements = max(chunk_bytes // variable.dtype.itemsize, 1)
+    chunks = {dim: 1 for dim in dims}
+
+    def n_elements():
+        return int(np.prod(list(chunks.values())))
+
+    if chunking == "map":
+        complete, extendable = horizontal, [dim for dim in reversed(dims) if dim not in horizontal]
+    else:
+        complete, extendable = [time_dim] if time_dim is not None else [], horizontal
+
+    # complete dimensions are only split if a chunk would be too large otherwise
+    for dim in complete:
+        chunks[dim] = sizes[dim]
+    for dim in complete:
+        if n_elements() > elements:
+            chunks[dim] = max(elements // (n_elements() // chunks[dim]), 1)
+
+    if chunking == "map":
+        # add levels, members, and times until the target size is reached
+        for dim in extendable:
+            chunks[dim] = int(min(sizes[dim], max(elements // n_elements(), 1)))
+    elif len(extendable) > 0:
+        # a horizontal patch with similar extent in all directions
+        side = max(int((elements // n_elements()) ** (1.0 / len(extendable))), 1)
+        for dim in extendable:
+            chunks[dim] = min(sizes[dim], side)
+        for dim in extendable:
+            chunks[dim] = int(min(sizes[dim], chunks[dim] * max(elements // n_elements(), 1)))
+    return tuple(chunks[dim] for dim in dims)
+
+
+def __write_netcdf_parallel(ds, file_path, processes, engine="h5netcdf", encoding=None):
+    """
+    write groups of variables into temporary files in parallel processes and assemble them into one file.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+            the dataset to store
+
+    file_path : Path
+            the file to create
+
+    processes : int
+            maximal number of processes and groups of variables
+
+    engine : str
+            engine used to write the temporary files
+
+    encoding : dict-like
+            encoding of all variables
+    """
+    # a process started by the parallel write imports an unprotected main module again and would write the same file
+    if getattr(multiprocessing.current_process(), "_inheriting", False):
+        raise RuntimeError("parallel write started while a new process imports the main module. Protect the main "
+                           "module with 'if __name__ == \"__main__\":'.")
+
+    # the first part contains all coordinates and global attributes and becomes the final file
+    groups = __split_variables(ds, processes)
+    tmp_path = f"{file_path}.tmp"
+    part_paths = [tmp_path] + [f"{file_path}.part{ipart}.tmp" for ipart in range(1, len(groups))]
+    parts = [ds.drop_vars([name for name in ds.data_vars if name not in groups[0]])]
+    parts += [ds[group] for group in groups[1:]]
+
+    part_encodings = [None] * len(parts)
+    if encoding is not None:
+        part_encodings = [{name: encoding[name] for name in part.variables if name in encoding} for part in parts]
+
+    try:
+        # the first part is written by this process while the other processes start up
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max(len(parts) - 1, 1), mp_context=context) as pool:
+            futures = [pool.submit(__write_part, part, part_path, engine, part_encoding)
+                       for part, part_path, part_encoding in zip(parts[1:], part_paths[1:], part_encodings[1:])]
+            __write_part(parts[0], part_paths[0], engine, part_encodings[0])
+            broken = []
+            for ipart, future in enumerate(futures, start=1):
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    broken.append(ipart)
+
+        # processes fail during startup if the main module is not protected by 'if __name__ == "__main__":'
+        if len(broken) > 0:
+            logging.warning("write: parallel processes failed to start, %d groups of variables are written serially. "
+                            "Protect the main module with 'if __name__ == \"__main__\":' to write in parallel."
+                            % len(broken))
+            for ipart in broken:
+                _remove_store(part_paths[ipart])
+                __write_part(parts[ipart], part_paths[ipart], engine, part_encodings[ipart])
+
+        # copy the compressed chunks of all other parts into the first part
+        with h5netcdf.File(tmp_path, "a") as destination:
+            for part_path in part_paths[1:]:
+                with h5netcdf.File(part_path, "r") as source:
+                    __copy_variables(source, destination)
+        _replace_store(tmp_path, file_path)
+    except BaseException:
+        _remove_store(tmp_path)
+        raise
+    finally:
+        for part_path in part_paths[1:]:
+            _remove_store(part_path)
+
+
+def __split_variables(ds, n_groups):
+    """
+    distribute the data variables on up to n_groups groups of similar size in bytes.
+    """
+    groups = [[] for _ in range(n_groups)]
+    sizes = [0] * n_groups
+    for name in sorted(ds.data_vars, key=lambda x: ds[x].nbytes, reverse=True):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(name)
+        sizes[smallest] += ds[name].nbytes
+    return [group for group in groups if len(group) > 0]
+
+
+def __write_part(ds, filename, engine, encoding):
+    """
+    write one part of a dataset, executed in a separate process or in this process if the processes failed.
+    """
+    ds.to_netcdf(filename, engine=engine, encoding=encoding, format="NETCDF4")
+
+
+def __copy_variables(source, destination):
+    """
+    copy all variables not yet present in the destination file. Chunked datasets are copied chunk by chunk without
+    decompression, the new datasets use the same creation properties (chunks, filters, fill value).
+    """
+    for name, variable in source.variables.items():
+        if name in destination.variables:
+            continue
+        for dim in variable.dimensions:
+            if dim not in destination.dimensions:
+                destination.dimensions[dim] = source.dimensions[dim].size
+        h5ds = variable._h5ds
+        new_variable = destination.create_variable(name, variable.dimensions, dtype=variable.dtype,
+                                                   dcpl=h5ds.id.get_create_plist())
+        for key, value in variable.attrs.items():
+            new_variable.attrs[key] = value
+        if h5ds.chunks is None:
+            new_variable[...] = h5ds[...]
+            continue
+
+        def copy_chunk(chunk_offset):
+            filter_mask, data = h5ds.id.read_direct_chunk(chunk_offset)
+            new_variable._h5ds.id.write_direct_chunk(chunk_offset, data, filter_mask)
+        if hasattr(h5ds.id, "chunk_iter"):
+            h5ds.id.chunk_iter(lambda info: copy_chunk(info.chunk_offset))
+        else:
+            for ichunk in range(h5ds.id.get_num_chunks()):
+                copy_chunk(h5ds.id.get_chunk_info(ichunk).chunk_offset)
+
+
+def __append_netcdf(ds, file_path, append_dim, engine="h5netcdf", encoding=None, format="NETCDF4"):
+    """
+    append a dataset along an unlimited dimension of a NetCDF4 file.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+            the slices to append
+
+    file_path : Path
+            the file to extend or to create
+
+    append_dim : str
+            name of the unlimited dimension
+
+    engine, encoding, format
+            arguments of to_netcdf used to create a new file
+    """
+    if not os.path.exists(file_path):
+        tmp_path = f"{file_path}.tmp"
+        ds.to_netcdf(tmp_path, engine=engine, encoding=encoding, format=format, unlimited_dims=[append_dim])
+        _replace_store(tmp_path, file_path)
+        return
+
+    # only the new slices are written into the existing file
+    _append_netcdf_in_place(ds, file_path, append_dim)
+
+
+def _append_netcdf_in_place(ds, file_path, append_dim):
+    """
+    append a dataset along an unlimited dimension of a NetCDF4 file. The file is modified in place. All new values
+    are checked and encoded before the file is opened for writing, the file stays untouched if this fails.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+            the slices to append
+
+    file_path : Path or str
+            the existing file
+
+    append_dim : str
+            name of the unlimited dimension
+    """
+    with xarray.open_dataset(file_path, engine="h5netcdf", chunks={}, decode_times=True) as existing:
+        __check_append_schema(existing, ds, append_dim)
+        encodings = {name: dict(one_var.encoding) for name, one_var in existing.variables.items()}
+        old_size = existing.sizes[append_dim]
+    new_size = old_size + ds.sizes[append_dim]
+
+    # new values are encoded like the existing values (units, scale factor, fill value, type)
+    new_values = {}
+    for name, variable in ds.variables.items():
+        if append_dim not in variable.dims:
+            continue
+        variable = variable.copy(deep=False)
+        variable.encoding = encodings[name]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            encoded = xarray.conventions.encode_cf_variable(variable, name=name)
+        if encoded.attrs.get("units", None) != variable.encoding.get("units", encoded.attrs.get("units", None)):
+            raise ValueError("the new values of '%s' can not be stored with the units '%s' of the existing file"
+                             % (name, variable.encoding["units"]))
+        selection = tuple(slice(old_size, new_size) if dim == append_dim else slice(None) for dim in variable.dims)
+        new_values[name] = (selection, np.asarray(encoded.values))
+
+    with h5netcdf.File(file_path, "a") as f:
+        if not f.dimensions[append_dim].isunlimited():
+            raise ValueError("dimension '%s' of file '%s' is not unlimited, appending is not possible"
+                             % (append_dim, file_path))
+        f.resize_dimension(append_dim, new_size)
+        for name, (selection, values) in new_values.items():
+            f.variables[name][selection] = values
+
+
+def __append_dim_encoding(ds, append_dim):
+    """
+    store times along the append dimension in seconds. Otherwise, the units selected by xarray for a new file depend
+    on the first values and are possibly not able to represent values appended later.
+    """
+    if append_dim in ds.coords and np.issubdtype(ds[append_dim].dtype, np.datetime64) \
+            and "units" not in ds[append_dim].encoding and ds.sizes[append_dim] > 0:
+        ds = ds.copy(deep=False)
+        first = pandas.Timestamp(ds[append_dim].values[0])
+        ds.variables[append_dim].encoding["units"] = "seconds since %s" % first.isoformat(sep=" ")
+    return ds
+
+
+def __append_zarr(ds, file_path, append_dim):
+    """
+    append a dataset along one dimension of an existing zarr store.
+    """
+    with xarray.open_zarr(file_path, decode_times=True) as existing:
+        __check_append_schema(existing, ds, append_dim)
+        store_chunks = {name: one_var.encoding.get("chunks") for name, one_var in existing.variables.items()}
+        old_size = existing.sizes[append_dim]
+
+    # the new slices are chunked like the store. The first chunk completes the last chunk of the store
+    variables = {}
+    for name, variable in ds.variables.items():
+        variable = variable.copy(deep=False)
+        for key in __storage_encoding_keys:
+            variable.encoding.pop(key, None)
+        if append_dim in variable.dims and store_chunks.get(name) is not None:
+            chunks = {}
+            for dim, size, chunk in zip(variable.dims, variable.shape, store_chunks[name]):
+                if dim == append_dim:
+                    first = min(chunk - old_size % chunk, size)
+                    chunks[dim] = (first,) + __regular_chunks(size - first, chunk)
+                else:
+                    chunks[dim] = chunk
+            variable = variable.chunk(chunks)
+        variables[name] = variable
+    ds = xarray.Dataset({name: variables[name] for name in ds.data_vars if append_dim in variables[name].dims},
+                        coords={name: variables[name] for name in ds.coords if append_dim in variables[name].dims},
+                        attrs=ds.attrs)
+
+    zarr_kwargs = {}
+    if int(zarr.__version__.split(".")[0]) >= 3:
+        zarr_kwargs["zarr_format"] = 2
+    return ds.to_zarr(file_path, mode="a", append_dim=append_dim, consolidated=True, **zarr_kwargs)
+
+
+def __regular_chunks(size, chunk):
+    """
+    split size into chunks of the given size, the last one may be smaller.
+    """
+    return (chunk,) * (size // chunk) + ((size % chunk,) if size % chunk > 0 else ())
+
+
+def __check_append_schema(existing, ds, append_dim):
+    """
+    check whether a dataset can be appended to an existing dataset along append_dim. Raises a ValueError otherwise.
+    """
+    if append_dim not in existing.dims or append_dim not in ds.dims:
+        raise ValueError("dimension '%s' is not available in the existing and the new dataset" % append_dim)
+    if set(existing.data_vars) != set(ds.data_vars):
+        raise ValueError("the variables of the new dataset (%s) differ from the existing variables (%s)"
+                         % (", ".join(sorted(ds.data_vars)), ", ".join(sorted(existing.data_vars))))
+    for name, variable in ds.variables.items():
+        if name not in existing.variables:
+            raise ValueError("variable '%s' is not available in the existing dataset" % name)
+        old_variable = existing.variables[name]
+        if variable.dims != old_variable.dims:
+            raise ValueError("variable '%s' has the dimensions %s instead of %s" % (name, variable.dims,
+                                                                                   old_variable.dims))
+        for dim, size in zip(variable.dims, variable.shape):
+            if dim != append_dim and size != existing.sizes[dim]:
+                raise ValueError("dimension '%s' has the size %d instead of %d" % (dim, size, existing.sizes[dim]))
+        if not np.can_cast(variable.dtype, old_variable.dtype, casting="same_kind"):
+            raise ValueError("variable '%s' of type %s can not be stored as %s" % (name, variable.dtype,
+                                                                                 old_variable.dtype))
+        if name in ds.coords and append_dim not in variable.dims and not variable.equals(old_variable):
+            raise ValueError("coordinate '%s' differs from the existing coordinate" % name)
+
+    # the new values have to follow the existing values
+    if append_dim in existing.indexes and append_dim in ds.indexes and existing.sizes[append_dim] > 0:
+        if not ds.indexes[append_dim][0] > existing.indexes[append_dim][-1]:
+            raise ValueError("the new values of '%s' do not follow the existing values" % append_dim)
+
+
+def __write_zarr(ds, file_path, compression=None, chunking=None, chunk_bytes=2 ** 18, compute=True):
+    """
+    write a dataset into a zarr store. The store is created under a temporary name and renamed when all chunks are
+    written, also if the computation is delayed.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+            the dataset to store
+
+    file_path : Path
+            name of the store to create
+
+    compression : str or numcodecs.abc.Codec
+            lossless compression specification or compressor object
+
+    chunking : str or dict
+            chunk sizes per dimension or name of an access pattern, see write
+
+    chunk_bytes : int
+            target size of the chunks in bytes
+
+    compute : bool
+            write the data immediately. Otherwise, a dask.delayed object is returned.
+    """
+    if not zarr_available:
+        raise ModuleNotFoundError("To write ZARR stores please install zarr:\npip install zarr")
+    compressor = __zarr_compressor(compression)
+
+    # the dask chunks are the chunks of the store, every chunk is written by one task without locking
+    if isinstance(chunking, str):
+        ds = ds.copy(deep=False)
+        for name, one_var in ds.variables.items():
+            if name not in ds.indexes:
+                ds[name] = one_var.chunk(dict(zip(one_var.dims,
+                                                  __storage_chunks(one_var, chunking, chunk_bytes))))
+    else:
+        ds = ds.chunk({dim: chunking.get(dim, -1) for dim in ds.dims} if chunking is not None else {})
+    # numcodecs compressors are supported by version 2 of the zarr format
+    zarr_kwargs = {}
+    compressor_encoding = {"compressor": compressor}
+    if int(zarr.__version__.split(".")[0]) >= 3:
+        zarr_kwargs["zarr_format"] = 2
+        compressor_encoding = {"compressors": (compressor,)}
+    encoding = {}
+    for name, one_var in ds.variables.items():
+        for key in __storage_encoding_keys:
+            one_var.encoding.pop(key, None)
+        if compressor is not None:
+            encoding[name] = compressor_encoding
+
+    tmp_path = f"{file_path}.tmp"
+    _remove_store(tmp_path)
+    task = ds.to_zarr(tmp_path, mode="w", encoding=encoding, compute=compute, consolidated=True, **zarr_kwargs)
+    if compute:
+        _replace_store(tmp_path, file_path)
+        return task
+    return dask.delayed(_replace_store)(tmp_path, file_path, task)
+
+
+def __zarr_compressor(compression):
+    """
+    convert the compression argument into a numcodecs compressor.
+    """
+    if compression is None or compression == "default":
+        return None
+    if isinstance(compression, numcodecs.abc.Codec):
+        return compression
+    if not isinstance(compression, str) or not compression.startswith("lossless"):
+        raise ValueError("only lossless compression is supported for ZARR stores, got '%s'" % compression)
+    parts = compression.split(",")
+    backend = parts[1] if len(parts) > 1 else "lz4"
+    level = int(parts[2]) if len(parts) > 2 else 9
+    if backend not in numcodecs.blosc.list_compressors():
+        raise ValueError("compression backend '%s' is not available, use one of %s"
+                         % (backend, ", ".join(numcodecs.blosc.list_compressors())))
+    return numcodecs.Blosc(cname=backend, clevel=level, shuffle=numcodecs.Blosc.SHUFFLE)
+
+
+def _replace_store(tmp_path, file_path, *dependencies):
+    """
+    move a completely written store to its final name. A single file replaces an existing file atomically. ZARR
+    stores are directories, which can not be replaced by a single rename: an existing store is moved aside and
+    removed after the new one is in place.
+    """
+    if not os.path.isdir(tmp_path) and not os.path.isdir(file_path):
+        os.replace(tmp_path, file_path)
+        return
+    old_path = None
+    if os.path.exists(file_path):
+        old_path = f"{file_path}.old"
+        _remove_store(old_path)
+        rename(file_path, old_path)
+    rename(tmp_path, file_path)
+    if old_path is not None:
+        _remove_store(old_path)
+
+
+def _remove_store(path):
+    """
+    remove a store or file if it exists.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -451,10 +451,13 @@ def first_element(array):
     float :
             first value.
     """
-    if array.size > 1:
-        return float(array[0])
-    else:
-        return float(array)
+    value = np.asarray(array).ravel()[0]
+    # time stamps are converted to nanoseconds independent of their resolution
+    if np.issubdtype(value.dtype, np.datetime64):
+        value = value.astype("datetime64[ns]").astype(np.int64)
+    elif np.issubdtype(value.dtype, np.timedelta64):
+        value = value.astype("timedelta64[ns]").astype(np.int64)
+    return float(value)
 
 
 def count_ge(array, th=0):
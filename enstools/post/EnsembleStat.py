@@ -6,7 +6,7 @@ from enstools.misc import get_ensemble_dim
 from enstools.core.parallelisation import rechunk_arguments
 
 
-@rechunk_arguments({"time": 1})
+@rechunk_arguments({"time": 1}, reduce_dim_type=["ens"])
 def ensemble_stat(dataset, stat=["mean", "min", "max", "std"], dim=None, ddof=1):
     """
     Compute ensemble mean and standard deviation from an input array or dataset.
@@ -79,6 +79,9 @@ setup(name="enstools",
         'compression': ['enstools-compression',]
         ,
 
+        'zarr': ['zarr',]
+        ,
+
         # you can define other optional groups of dependencies here
     },
       entry_points={
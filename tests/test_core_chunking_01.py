@@ -0,0 +1,99 @@
+import math
+import numpy
+import xarray
+import pytest
+
+from enstools.core import plan_chunks, plan_dataset_chunks
+from enstools.core.parallelisation import rechunk_arguments
+
+
+def chunk_bytes(chunks, dtype):
+    """
+    size of one chunk in bytes
+    """
+    return math.prod(chunks) * numpy.dtype(dtype).itemsize
+
+
+def n_chunks(shape, chunks):
+    """
+    number of chunks of an array
+    """
+    return math.prod(math.ceil(size / chunk) for size, chunk in zip(shape, chunks))
+
+
+def test_plan_chunks_target_bytes():
+    """
+    chunks are close to the target size and split along the leftmost dimensions first
+    """
+    chunks = plan_chunks((100, 500, 600), "float32", n_workers=1, target_bytes="16MB")
+    assert chunks[1:] == (500, 600)
+    assert 8e6 < chunk_bytes(chunks, "float32") <= 16e6
+
+    # the target is limited by the memory per worker
+    chunks = plan_chunks((100, 500, 600), "float32", n_workers=1, worker_memory="40MB")
+    assert chunk_bytes(chunks, "float32") <= 5e6
+
+    # small arrays are not split
+    assert plan_chunks((10, 10), "float64", n_workers=8) == (10, 10)
+    assert plan_chunks(5, "float64", n_workers=8) == (5,)
+
+
+def test_plan_chunks_workers():
+    """
+    large arrays are split into at least one chunk per worker
+    """
+    shape = (4, 1000, 1000)
+    chunks = plan_chunks(shape, "float64", n_workers=16, target_bytes="1GB")
+    assert n_chunks(shape, chunks) >= 16
+
+
+def test_plan_chunks_reduce_and_fixed_dims():
+    """
+    dimensions an operation reduces over are not split, fixed chunks are used as given
+    """
+    shape = (50, 40, 1000, 100)
+    chunks = plan_chunks(shape, "float64", dims=("time", "ens", "y", "x"), reduce_dims=["ens"],
+                         fixed={"time": 1}, n_workers=4, target_bytes="2MB")
+    assert chunks["time"] == 1
+    assert chunks["ens"] == 40
+    assert chunks["y"] < 1000
+    assert chunks["x"] == 100
+
+    # unknown dimensions are rejected
+    with pytest.raises(ValueError):
+        plan_chunks(shape, "float64", dims=("time", "ens", "y", "x"), reduce_dims=["member"])
+
+
+def test_plan_chunks_base_chunks():
+    """
+    planned chunks are multiples of the chunks of the storage
+    """
+    chunks = plan_chunks((4, 1000, 600), "float64", base_chunks=(1, 64, 600), n_workers=1, target_bytes="2MB")
+    assert chunks[0] == 1
+    assert chunks[1] % 64 == 0
+    assert chunks[2] == 600
+
+
+def test_plan_dataset_chunks():
+    """
+    the plan of a dataset is made for its largest variable
+    """
+    ds = xarray.Dataset({"large": (("time", "y", "x"), numpy.zeros((20, 500, 200))),
+                         "small": (("y",), numpy.zeros(500))})
+    ds["large"].encoding["preferred_chunks"] = {"time": 1, "y": 100, "x": 200}
+    chunks = plan_dataset_chunks(ds, reduce_dims=["time"], n_workers=1, target_bytes="4MB")
+    assert chunks == {"time": 20, "y": 100, "x": 200}
+    ds = ds.chunk(chunks)
+    assert ds["small"].chunks == ((100,) * 5,)
+
+
+def test_rechunk_arguments():
+    """
+    dimensions given to the decorator are fixed, reduced dimensions stay in one chunk
+    """
+    @rechunk_arguments({"time": 1}, reduce_dim_type=["ens"])
+    def chunks_of(data, dim=None):
+        return data.chunks
+
+    data = xarray.DataArray(numpy.zeros((3, 20, 10, 10)), dims=("time", "ens", "lat", "lon"))
+    assert chunks_of(data) == ((1, 1, 1), (20,), (10,), (10,))
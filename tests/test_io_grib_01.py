@@ -0,0 +1,317 @@
+import xarray
+import tempfile
+import numpy
+import os
+import shutil
+import pytest
+import enstools.io
+from enstools.io.eccodes.index import get_index_file_name
+
+# test files are created with the official eccodes python interface
+eccodes = pytest.importorskip("eccodes")
+
+
+def create_grib_file(filename, members=(1, 2), levels=(500, 850, 1000), steps=(0, 6), skip=()):
+    """
+    create a grib2 file with temperature on pressure levels and 2m temperature for multiple members and times.
+    Messages listed in skip as (step, member, level) are not written.
+    """
+    with open(filename, "wb") as f:
+        for step in steps:
+            for member in members:
+                for level in levels:
+                    if (step, member, level) in skip:
+                        continue
+                    handle = eccodes.codes_grib_new_from_samples("regular_ll_pl_grib2")
+                    eccodes.codes_set(handle, "productDefinitionTemplateNumber", 1)
+                    eccodes.codes_set(handle, "perturbationNumber", member)
+                    eccodes.codes_set(handle, "level", level)
+                    eccodes.codes_set(handle, "stepRange", step)
+                    npoints = eccodes.codes_get(handle, "Ni") * eccodes.codes_get(handle, "Nj")
+                    eccodes.codes_set_values(handle, numpy.full(npoints, 200.0 + level / 10 + member + step))
+                    eccodes.codes_write(handle, f)
+                    eccodes.codes_release(handle)
+            for member in members:
+                handle = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib2")
+                eccodes.codes_set(handle, "productDefinitionTemplateNumber", 1)
+                eccodes.codes_set(handle, "perturbationNumber", member)
+                eccodes.codes_set(handle, "shortName", "2t")
+                eccodes.codes_set(handle, "stepRange", step)
+                npoints = eccodes.codes_get(handle, "Ni") * eccodes.codes_get(handle, "Nj")
+                eccodes.codes_set_values(handle, numpy.full(npoints, 280.0 + member + step))
+                eccodes.codes_write(handle, f)
+                eccodes.codes_release(handle)
+    return filename
+
+
+@pytest.fixture
+def test_dir():
+    """
+    name of the test directoy
+    """
+    test_dir = tempfile.mkdtemp()
+    yield test_dir
+
+    # cleanup
+    shutil.rmtree(test_dir)
+
+
+@pytest.fixture
+def grib_file(test_dir):
+    """
+    grib2 file with two members, two times and three levels
+    """
+    try:
+        from enstools.io.eccodes import eccodes_cffi
+        eccodes_cffi._eccodes
+    except (ImportError, AttributeError):
+        pytest.skip("eccodes c-library not found")
+    return create_grib_file(os.path.join(test_dir, "ens.grib2"))
+
+
+def test_read_grib_file(grib_file, test_dir):
+    """
+    read a grib file and check the content
+    """
+    ds = enstools.io.read(grib_file, grib_index_dir=test_dir)
+    assert ds["t"].dims == ("time", "ens", "isobaricInhPa", "lat", "lon")
+    assert ds["t"].shape == (2, 2, 3, 31, 16)
+    numpy.testing.assert_array_equal(ds["ens"], [1, 2])
+    numpy.testing.assert_array_equal(ds["isobaricInhPa"], [500, 850, 1000])
+    numpy.testing.assert_allclose(ds["t"].isel(time=1, ens=1, isobaricInhPa=0), 200.0 + 50 + 2 + 6)
+    numpy.testing.assert_allclose(ds["2t"].isel(time=0, ens=0), 281.0)
+
+
+def test_grib_index(grib_file, test_dir):
+    """
+    the second read uses the index written by the first read
+    """
+    index_file = get_index_file_name(grib_file, test_dir)
+    ds1 = enstools.io.read(grib_file, grib_index_dir=test_dir, profile=True)
+    assert os.path.exists(index_file)
+    assert ds1.encoding["read_profile"]["counters"]["grib_files_scanned"] == 1
+
+    # the dataset created from the index is identical
+    index_mtime = os.stat(index_file).st_mtime_ns
+    ds2 = enstools.io.read(grib_file, grib_index_dir=test_dir, profile=True)
+    assert os.stat(index_file).st_mtime_ns == index_mtime
+    assert ds2.encoding["read_profile"]["counters"]["grib_indexes_loaded"] == 1
+    assert "grib_files_scanned" not in ds2.encoding["read_profile"]["counters"]
+    xarray.testing.assert_identical(ds1.compute(), ds2.compute())
+
+    # a modified file invalidates the index
+    create_grib_file(grib_file, members=(1, 2, 3))
+    ds3 = enstools.io.read(grib_file, grib_index_dir=test_dir)
+    numpy.testing.assert_array_equal(ds3["ens"], [1, 2, 3])
+
+    # no index is written if disabled
+    os.remove(index_file)
+    enstools.io.read(grib_file, grib_index=False, grib_index_dir=test_dir)
+    assert not os.path.exists(index_file)
+
+
+@pytest.mark.parametrize("parallel_decoding", [True, False])
+def test_grib_parallel_decoding(grib_file, test_dir, parallel_decoding):
+    """
+    decode messages concurrently with one lock per message or serialised with one global lock
+    """
+    import dask
+    from enstools.io.eccodes import eccodes_cffi
+    default = eccodes_cffi.parallel_decoding
+    # the global lock is used unless parallel decoding is selected
+    assert not default
+    try:
+        eccodes_cffi.set_parallel_decoding(parallel_decoding)
+        with dask.config.set(scheduler="threads", num_workers=4):
+            ds = enstools.io.read(grib_file, grib_index_dir=test_dir).compute()
+    finally:
+        eccodes_cffi.parallel_decoding = default
+    for member in [1, 2]:
+        for step, time in zip([0, 6], ds["time"]):
+            expected = 200.0 + ds["isobaricInhPa"] / 10 + member + step
+            numpy.testing.assert_allclose(ds["t"].sel(ens=member, time=time) - expected, 0.0, atol=1e-3)
+
+
+def test_grib_batch_messages(grib_file, test_dir):
+    """
+    load all levels of one time and member in one task
+    """
+    ds1 = enstools.io.read(grib_file, grib_index_dir=test_dir)
+    ds2 = enstools.io.read(grib_file, grib_index_dir=test_dir, batch_messages=True)
+    assert ds1["t"].data.numblocks == (2, 2, 3, 1, 1)
+    assert ds2["t"].data.numblocks == (2, 2, 1, 1, 1)
+    xarray.testing.assert_identical(ds1.compute(), ds2.compute())
+
+
+def test_grib_mmap(grib_file, test_dir):
+    """
+    scanning and decoding from a memory-mapped file gives the same result as reading through file objects
+    """
+    ds1 = enstools.io.read(grib_file, grib_index=False, grib_mmap=False)
+    ds2 = enstools.io.read(grib_file, grib_index=False, grib_mmap=True, batch_messages=True)
+    xarray.testing.assert_identical(ds1.compute(), ds2.compute())
+
+
+def test_grib_chunks(grib_file, test_dir):
+    """
+    the dask chunks of grib variables are configurable per dimension
+    """
+    ds1 = enstools.io.read(grib_file, grib_index_dir=test_dir)
+    ds2 = enstools.io.read(grib_file, grib_index_dir=test_dir, chunks={"isobaricInhPa": -1, "lon": 8})
+    ds3 = enstools.io.read(grib_file, grib_index_dir=test_dir, chunks=-1)
+    assert ds2["t"].chunks == ((1, 1), (1, 1), (3,), (31,), (8, 8))
+    assert ds3["t"].data.numblocks == (1, 1, 1, 1, 1)
+    xarray.testing.assert_identical(ds1.compute(), ds2.compute())
+    xarray.testing.assert_identical(ds1.compute(), ds3.compute())
+
+
+def test_grib_missing_messages(test_dir):
+    """
+    missing messages are filled with the missing value, blocks without messages share one constant block
+    """
+    try:
+        from enstools.io.eccodes import eccodes_cffi
+        eccodes_cffi._eccodes
+    except (ImportError, AttributeError):
+        pytest.skip("eccodes c-library not found")
+    grib_file = create_grib_file(os.path.join(test_dir, "gap.grib2"), skip=[(6, 2, 850), (6, 2, 1000)])
+    ds = enstools.io.read(grib_file, grib_index_dir=test_dir)
+    assert ds.attrs["grib_completeness"] == "2t: 4/4, t: 10/12"
+    fill_value = ds["t"].encoding["_FillValue"]
+    numpy.testing.assert_array_equal(ds["t"].isel(time=1, ens=1, isobaricInhPa=[1, 2]), fill_value)
+    assert not numpy.any(ds["t"].isel(time=0) == fill_value)
+
+    # two missing blocks, one constant task
+    graph = dict(ds["t"].data.__dask_graph__())
+    missing_keys = [key for key in graph if "-missing" in key[0]]
+    assert len(missing_keys) == 1
+    assert len(graph) == 13
+
+    # computed blocks without messages are writable
+    assert all(block.compute().flags.writeable for block in ds["t"].data.to_delayed().flat)
+    assert "grib_completeness" not in enstools.io.read(create_grib_file(grib_file), grib_index_dir=test_dir).attrs
+
+
+def test_grib_key_reader(grib_file):
+    """
+    the bulk key reader returns the same values as reading the keys one by one
+    """
+    from enstools.io.eccodes import eccodes_cffi
+    with eccodes_cffi.open_grib_file(grib_file) as gfile:
+        msg = eccodes_cffi.GribMessage(gfile, 0)
+        reader = eccodes_cffi.KeyReader(["level", "shortName", "missingValue", "indicatorOfParameter", "values"])
+        values, failed = reader.read(msg.handle)
+        assert values == {"level": 500, "shortName": "t", "missingValue": 9999.0, "indicatorOfParameter": None}
+        assert failed == ["values"]
+        for key in ["level", "shortName", "missingValue"]:
+            msg.cache.pop(key)
+            assert msg[key] == values[key]
+        del msg
+
+
+@pytest.mark.parametrize("read_ahead", [0, 2])
+def test_iter_grib_fields(grib_file, test_dir, read_ahead):
+    """
+    iterate over selected fields without creating a dataset
+    """
+    from enstools.io.eccodes import iter_grib_fields
+    ds = enstools.io.read(grib_file, grib_index_dir=test_dir).compute()
+    fields = list(iter_grib_fields(grib_file, filter={"name": "t", "level": [500, 1000]}, read_ahead=read_ahead,
+                                   index_dir=test_dir))
+    assert len(fields) == 8
+    for field in fields:
+        assert field.variable_id == ("t", "isobaricInhPa")
+        assert field.level in [500, 1000]
+        numpy.testing.assert_array_equal(field.values, ds["t"].sel(time=field.time, ens=field.member,
+                                                                   isobaricInhPa=field.level))
+
+    # callable filter and early stop of the iteration
+    fields = iter_grib_fields(grib_file, filter=lambda msg: msg.member == 2, read_ahead=read_ahead, index_dir=test_dir)
+    assert next(fields).member == 2
+    fields.close()
+    with pytest.raises(ValueError):
+        next(iter_grib_fields(grib_file, filter={"unknown": 1}, index_dir=test_dir))
+
+    # times as numpy.datetime64 values of a dataset
+    fields = list(iter_grib_fields(grib_file, filter={"name": "2t", "time": ds["time"].values[1:]},
+                                   read_ahead=read_ahead, index_dir=test_dir))
+    assert len(fields) == 2
+    assert all(numpy.datetime64(field.time, "ns") == ds["time"].values[1] for field in fields)
+    assert len(list(iter_grib_fields(grib_file, filter={"time": ds["time"].values[0]}, index_dir=test_dir))) == 8
+    with pytest.raises(ValueError):
+        next(iter_grib_fields(grib_file, filter={"time": "not a time"}, index_dir=test_dir))
+
+
+def test_grib_selection(grib_file, test_dir):
+    """
+    select variables, levels, members and times before any message is decoded
+    """
+    ds1 = enstools.io.read(grib_file, grib_index_dir=test_dir)
+    ds2 = enstools.io.read(grib_file, grib_index_dir=test_dir, variables="t", levels=[500, 1000], members=[2],
+                           time=ds1["time"].values[1:])
+    assert list(ds2.data_vars) == ["t"]
+    assert ds2["t"].shape == (1, 2, 31, 16)
+    assert ds2.attrs["ensemble_member"] == 2
+    assert len(dict(ds2["t"].data.__dask_graph__())) == 2
+    xarray.testing.assert_equal(ds2["t"].compute(), ds1["t"].sel(ens=2, isobaricInhPa=[500, 1000]).isel(time=[1]).drop_vars("ens"))
+
+    # names including the type of level
+    ds3 = enstools.io.read(grib_file, grib_index_dir=test_dir, variables=["2t_heightAboveGround"])
+    assert list(ds3.data_vars) == ["2t"]
+
+    with pytest.raises(ValueError):
+        enstools.io.read(grib_file, grib_index_dir=test_dir, variables="unknown")
+    with pytest.raises(ValueError):
+        enstools.io.read(grib_file, grib_index_dir=test_dir, variables=["t", "unknown"])
+
+
+def test_grib_selection_multiple_files(grib_file, test_dir):
+    """
+    files without messages matching the selection are skipped
+    """
+    step0 = create_grib_file(os.path.join(test_dir, "step0.grib2"), steps=(0,))
+    step6 = create_grib_file(os.path.join(test_dir, "step6.grib2"), steps=(6,))
+    ds1 = enstools.io.read(grib_file, grib_index_dir=test_dir)
+    ds2 = enstools.io.read([step0, step6], grib_index_dir=test_dir, variables="t", time=ds1["time"].values[1])
+    assert ds2["t"].sizes["time"] == 1
+    xarray.testing.assert_equal(ds2["t"].compute(), ds1["t"].isel(time=[1]))
+
+    with pytest.raises(ValueError):
+        enstools.io.read([step0, step6], grib_index_dir=test_dir, levels=[300])
+
+
+def test_grib_coordinate_cache(grib_file, test_dir):
+    """
+    files on the same grid share one coordinate array
+    """
+    from enstools.io.eccodes.index import get_index, coordinate_cache
+    other_file = create_grib_file(os.path.join(test_dir, "other.grib2"), members=(3,))
+    index1 = get_index(grib_file, index_dir=test_dir)
+    index2 = get_index(other_file, use_index=False)
+    assert index1.coordinates["lon"][1] is index2.coordinates["lon"][1]
+    assert not index1.coordinates["lon"][1].flags.writeable
+
+    # arrays read from the index are shared as well
+    coordinate_cache.clear()
+    index1 = get_index(grib_file, index_dir=test_dir)
+    index2 = get_index(other_file, index_dir=test_dir)
+    assert index1.coordinates["lat"][1] is index2.coordinates["lat"][1]
+    numpy.testing.assert_array_equal(index1.coordinates["lat"][1], numpy.arange(60, -1, -2))
+
+
+def test_grib_leadtime_from_filename(grib_file, test_dir):
+    """
+    the valid time is calculated from the init time and the lead time of the manifest
+    """
+    from datetime import timedelta
+    from enstools.io.eccodes.index import get_index
+    cosmo_file = create_grib_file(os.path.join(test_dir, "lfff00063000.grib2"), steps=(0,))
+    init_time = enstools.io.read(cosmo_file, grib_index=False)["time"].values[0]
+    ds = enstools.io.read(cosmo_file, grib_index=False, leadtime_from_filename=True)
+    assert ds["time"].values[0] == init_time + numpy.timedelta64(390, "m")
+
+    # a lead time given by the caller is not parsed from the file name again
+    index = get_index(cosmo_file, leadtime_from_filename=True, use_index=False, leadtime=timedelta(hours=1))
+    assert numpy.datetime64(index.messages[0].time) == init_time + numpy.timedelta64(1, "h")
+    with pytest.raises(IOError):
+        get_index(grib_file, leadtime_from_filename=True, use_index=False)
@@ -4,6 +4,10 @@ import tempfile
 import numpy
 import os
 import shutil
+import json
+import gc
+import threading
+import dask
 import enstools.io
 import pytest
 
@@ -101,3 +105,339 @@ def test_open_with_wrong_pattern():
     """
     with numpy.testing.assert_raises(FileNotFoundError):
         ds = enstools.io.read("/non/existing/file/pattern_*.nc")
+
+
+def test_read_homogeneous_files(test_dir):
+    """
+    read files which differ only in time and ensemble member
+    """
+    filenames = []
+    expected = numpy.random.rand(6, 3, 5, 4)
+    for member in [1, 2, 3]:
+        for itime in [0, 2, 4]:
+            ds = xarray.Dataset({"noise": (("time", "ens", "lat", "lon"),
+                                           expected[itime:itime + 2, member - 1:member, ...])},
+                                coords={"time": numpy.arange(itime, itime + 2),
+                                        "ens": [member],
+                                        "lat": numpy.linspace(4, 0, 5),
+                                        "lon": numpy.linspace(1, 4, 4)},
+                                attrs={"member": member, "model": "test"})
+            filenames.append(os.path.join(test_dir, "%d_%d.nc" % (member, itime)))
+            ds.to_netcdf(filenames[-1])
+    # the order of the files is not important
+    ds = enstools.io.read(list(reversed(filenames)))
+    assert_equal(ds["noise"].dims, ("time", "ens", "lat", "lon"))
+    numpy.testing.assert_array_equal(ds["time"], numpy.arange(6))
+    numpy.testing.assert_array_equal(ds["ens"], [1, 2, 3])
+    numpy.testing.assert_array_equal(ds["lat"], numpy.linspace(4, 0, 5))
+    numpy.testing.assert_array_equal(ds["noise"], expected)
+    assert ds.attrs == {"model": "test"}
+
+
+def test_read_metadata_only(file1, file2):
+    """
+    read only the structure of two files
+    """
+    ds = enstools.io.read([file1, file2])
+    metadata = enstools.io.read([file1, file2], metadata_only=True)
+    assert_equal(metadata["noise"].shape, (14, 5, 6))
+    xarray.testing.assert_identical(metadata.drop_vars("noise"), ds.drop_vars("noise"))
+    assert metadata["noise"].dtype == ds["noise"].dtype
+    with pytest.raises(ValueError):
+        metadata["noise"].values
+
+
+def test_read_max_open_files(file1, file2):
+    """
+    open files with a limited number of threads and open files
+    """
+    ds1 = enstools.io.read([file1, file2])
+    ds2 = enstools.io.read([file1, file2], max_open_workers=2, max_open_files=1)
+    xarray.testing.assert_identical(ds1.compute(), ds2.compute())
+
+
+def test_read_cache(file1, file2):
+    """
+    repeated reads of the same files are served from the cache
+    """
+    from enstools.io import dataset_cache
+    dataset_cache.invalidate()
+    info = dataset_cache.info()
+    ds1 = enstools.io.read([file1, file2], cache=True)
+    ds2 = enstools.io.read([file1, file2], cache=True)
+    assert dataset_cache.info()["misses"] == info["misses"] + 1
+    assert dataset_cache.info()["hits"] == info["hits"] + 1
+    assert ds1 is not ds2
+    xarray.testing.assert_identical(ds1, ds2)
+
+    # other arguments create other entries, the files are discovered only once per call
+    ds4 = enstools.io.read([file1, file2], cache=True, drop_unused=True, profile=True)
+    assert dataset_cache.info()["datasets"] == 2
+    assert ds4.encoding["read_profile"]["timers"]["discover"]["calls"] == 1
+
+    # modified files are not served from the cache
+    xarray.Dataset({"noise": (("time",), numpy.zeros(3))}, coords={"time": [1, 2, 3]}).to_netcdf(file1 + ".tmp")
+    os.replace(file1 + ".tmp", file1)
+    ds3 = enstools.io.read(file1, cache=True)
+    assert ds3["noise"].shape == (3,)
+
+    # explicit invalidation
+    dataset_cache.invalidate(file1)
+    assert dataset_cache.info()["datasets"] == 0
+
+
+def test_read_cache_eviction(file1, file2):
+    """
+    evicted datasets are closed when the last copy handed out to a caller is not used anymore
+    """
+    from enstools.io.cache import DatasetCache
+    cache = DatasetCache(max_files=1)
+    closed = []
+
+    def open_files(filenames):
+        ds = xarray.open_dataset(filenames[0])
+        ds.set_close(lambda: closed.append(filenames[0]))
+        return ds
+
+    ds1 = cache.get_or_read(open_files, [file1])
+    cache.get_or_read(open_files, [file2])
+    assert cache.info()["evictions"] == 1
+    assert closed == []
+    assert ds1["noise"].values.shape == (7, 5, 6)
+    del ds1
+    gc.collect()
+    assert closed == [file1]
+
+    # datasets without copies in use are closed immediately
+    cache.invalidate()
+    assert closed == [file1, file2]
+
+
+def test_read_references(test_dir, file1, file2):
+    """
+    create a reference map of two files and open it as one dataset
+    """
+    ds1 = enstools.io.read([file1, file2])
+    ref_file = os.path.join(test_dir, "references.json")
+    enstools.io.create_references([file1, file2], ref_file)
+    assert enstools.io.get_file_type(ref_file) == "REF"
+    ds2 = enstools.io.read(ref_file)
+    assert ds2["noise"].chunks is not None
+    xarray.testing.assert_identical(ds1.compute(), ds2.compute())
+
+    # compressed files are decoded without the HDF5 library
+    compressed = os.path.join(test_dir, "compressed.nc")
+    ds1.to_netcdf(compressed, encoding={"noise": {"zlib": True, "shuffle": True, "chunksizes": (2, 5, 6)}})
+    ds3 = enstools.io.open_references(enstools.io.create_references(compressed))
+    assert ds3["noise"].chunks[0] == (2,) * 7
+    xarray.testing.assert_identical(ds1.compute(), ds3.compute())
+
+    # the byte ranges of modified files are not valid anymore
+    xarray.Dataset({"noise": (("time",), numpy.zeros(3))}, coords={"time": [1, 2, 3]}).to_netcdf(file1 + ".tmp")
+    os.replace(file1 + ".tmp", file1)
+    with pytest.raises(IOError):
+        enstools.io.read(ref_file)
+
+
+def test_file_info_cache(test_dir, file1, file2):
+    """
+    patterns are expanded like glob and file types are cached until a file is modified
+    """
+    import glob
+    from enstools.io.paths import clean_paths
+    from enstools.io.file_info import file_info_cache
+    open(os.path.join(test_dir, ".hidden.nc"), "w").close()
+    pattern = os.path.join(test_dir, "*.nc")
+    assert sorted(clean_paths(pattern)) == sorted(clean_paths(glob.glob(pattern)))
+    assert len(clean_paths(pattern)) == 2
+
+    # the type is determined once
+    file_info_cache.clear()
+    assert enstools.io.get_file_type(file1) == "HDF"
+    assert len(file_info_cache.types) == 1
+    assert enstools.io.get_file_type(file1) == "HDF"
+    assert len(file_info_cache.types) == 1
+
+    # a modified file is checked again
+    with open(file1 + ".tmp", "wb") as f:
+        f.write(b"GRIB" + bytes(100))
+    os.replace(file1 + ".tmp", file1)
+    assert enstools.io.get_file_type(file1) == "GRIB"
+
+    # within one scope, every file is only stat'ed once
+    with file_info_cache.scope():
+        info = file_info_cache.stat(file2)
+        os.remove(file2)
+        assert file_info_cache.stat(file2) == info
+    assert file_info_cache.stat(file2) is None
+
+    # a scope is not shared with concurrent calls in other threads
+    with file_info_cache.scope():
+        info = file_info_cache.stat(file1)
+        os.remove(file1)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(file_info_cache.stat(file1)))
+        thread.start()
+        thread.join()
+        assert results == [None]
+        assert file_info_cache.stat(file1) == info
+
+
+def test_create_manifest(test_dir):
+    """
+    find files in member folders and read the member numbers from folder and file names
+    """
+    ds = xarray.Dataset({"noise": (("time", "lat"), numpy.random.rand(2, 6))},
+                        coords={"time": [1, 2], "lat": numpy.linspace(1, 6, 6)})
+    for member in range(1, 4):
+        os.mkdir(os.path.join(test_dir, "m%02d" % member))
+        for step in range(3 if member < 3 else 2):
+            filename = os.path.join(test_dir, "m%02d" % member, "lfff00%02d0000_P%d.nc" % (step, member))
+            ds.assign_coords(time=ds["time"] + 2 * step).to_netcdf(filename)
+    pattern = os.path.join(test_dir, "m*", "lfff*.nc")
+    manifest = enstools.io.create_manifest(pattern, member_by_filename=r"_P(\d+)\.nc")
+    assert len(manifest) == 8
+    assert sorted(manifest["member"].unique()) == [1, 2, 3]
+    assert manifest["complete"].sum() == 6
+    assert manifest["leadtime"].max() == numpy.timedelta64(2, "h")
+    assert set(manifest["folder"]) == set(os.path.realpath(os.path.join(test_dir, "m%02d" % m)) for m in range(1, 4))
+
+    # the incomplete member is not read
+    for kwargs in [{"member_by_filename": r"_P(\d+)\.nc"}, {"members_by_folder": True}]:
+        ds2 = enstools.io.read(pattern, **kwargs)
+        assert_equal(ds2["ens"].values, [1, 2])
+        assert dict(ds2["noise"].sizes) == {"time": 6, "ens": 2, "lat": 6}
+
+    with pytest.raises(IOError):
+        enstools.io.create_manifest(pattern, member_by_filename=r"_X(\d+)")
+
+
+def test_read_constant(test_dir, file1, file2):
+    """
+    add variables from a file with constant data
+    """
+    constant = os.path.join(test_dir, "constant.nc")
+    xarray.Dataset({"orography": (("time", "lat", "lon"), numpy.random.rand(1, 6, 5)),
+                    "noise": (("lat",), numpy.arange(6.))},
+                   coords={"time": [0.], "lon": numpy.linspace(1, 5, 5),
+                           "lat": numpy.linspace(1, 6, 6)[::-1]}).to_netcdf(constant)
+    ds1 = enstools.io.read([file1, file2])
+    ds2 = enstools.io.read([file1, file2], constant=constant)
+    assert set(ds2.data_vars) == {"noise", "orography", "noise_constant"}
+    assert dict(ds2["orography"].sizes) == {"lat": 6, "lon": 5}
+    xarray.testing.assert_identical(ds1["noise"], ds2["noise"])
+    # the constant data is aligned with the coordinates of the other files
+    assert_equal(ds2["noise_constant"].values, numpy.arange(6.)[::-1])
+    ds3 = enstools.io.read([file1, file2], constant=constant, metadata_only=True)
+    assert set(ds3.data_vars) == set(ds2.data_vars)
+
+
+def test_read_in_memory(file1, file2):
+    """
+    load the merged data into memory within a memory budget
+    """
+    ds1 = enstools.io.read([file1, file2])
+    ds2 = enstools.io.read([file1, file2], in_memory=True)
+    assert ds2["noise"].chunks == ds1["noise"].chunks
+    xarray.testing.assert_identical(ds1.compute(), ds2.compute())
+    # the data is not read from the files anymore
+    os.remove(file1)
+    xarray.testing.assert_identical(ds1["noise"].isel(time=0).compute(), ds2["noise"].isel(time=0).compute())
+
+    # too large selections are rejected before reading
+    with pytest.raises(MemoryError):
+        enstools.io.read(file2, in_memory=True, memory_limit="1kB")
+
+
+def test_read_profile(file1, file2):
+    """
+    collect timers and counters of the steps of read
+    """
+    ds = enstools.io.read([file1, file2], profile=True)
+    report = ds.encoding["read_profile"]
+    assert report["counters"]["files_opened"] == 2
+    assert report["counters"]["file_bytes"] == os.path.getsize(file1) + os.path.getsize(file2)
+    assert {"read", "discover", "open_all", "merge"} <= set(report["timers"])
+    assert report["timers"]["read"]["seconds"] <= report["wall_time"]
+
+    # several calls are collected by the context manager
+    with enstools.io.profile_read() as profile:
+        enstools.io.read(file1, in_memory=True)
+        enstools.io.read([file1, file2])
+    report = json.loads(profile.to_json())
+    assert report["timers"]["read"]["calls"] == 2
+    assert report["counters"]["files_opened"] == 3
+    assert report["counters"]["bytes_loaded"] > 0
+
+
+def test_read_profile_concurrent(file1, file2):
+    """
+    profiles of concurrent reads in different threads are kept apart
+    """
+    reports = {}
+    started = threading.Event()
+    finished = threading.Event()
+
+    def first():
+        with enstools.io.profile_read() as profile:
+            started.set()
+            finished.wait(timeout=60)
+            enstools.io.read(file1)
+        reports["first"] = profile.report()
+
+    def second():
+        started.wait(timeout=60)
+        reports["second"] = enstools.io.read([file1, file2], profile=True).encoding["read_profile"]
+        finished.set()
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert reports["first"]["counters"]["files_opened"] == 1
+    assert reports["first"]["counters"]["file_bytes"] == os.path.getsize(file1)
+    assert reports["second"]["counters"]["files_opened"] == 2
+    assert reports["second"]["timers"]["read"]["calls"] == 1
+
+
+def test_read_planned_chunks(file1, file2):
+    """
+    read with chunks planned based on their size in bytes
+    """
+    ds1 = enstools.io.read([file1, file2])
+    ds2 = enstools.io.read([file1, file2], chunks="auto")
+    assert ds2["noise"].chunks == ds1["noise"].chunks
+    with dask.config.set({"array.chunk-size": "1kB"}):
+        ds3 = enstools.io.read([file1, file2], chunks="auto")
+    assert ds3["noise"].chunks == ((4, 3, 4, 3), (5,), (6,))
+    xarray.testing.assert_identical(ds1.compute(), ds3.compute())
+
+
+def test_read_selection_multiple_files(test_dir):
+    """
+    files without the selected times or members are skipped
+    """
+    for hour in range(2):
+        for member in [1, 2]:
+            ds = xarray.Dataset({"t": (("time", "lat"), numpy.full((1, 3), hour + 10 * member))},
+                                coords={"time": [numpy.datetime64("2020-01-01T%02d" % hour, "ns")],
+                                        "lat": [1.0, 2.0, 3.0]})
+            ds.to_netcdf(os.path.join(test_dir, "m%d_%02d.nc" % (member, hour)))
+    pattern = os.path.join(test_dir, "m*.nc")
+    ds = enstools.io.read(pattern, time="2020-01-01T01", member_by_filename=r"m(\d)_")
+    assert ds["t"].sizes["time"] == 1
+    numpy.testing.assert_array_equal(ds["t"].isel(time=0).values[:, 0], [11, 21])
+
+    # ensemble members from file names
+    ds = enstools.io.read(pattern, members=[2], member_by_filename=r"m(\d)_")
+    numpy.testing.assert_array_equal(ds["ens"], [2])
+    assert ds["t"].sizes["time"] == 2
+
+    # an error is raised only if no file matches
+    with pytest.raises(ValueError):
+        enstools.io.read(pattern, time="2020-01-02T00", member_by_filename=r"m(\d)_")
+
+    # variables which are not part of any file are rejected
+    with pytest.raises(ValueError):
+        enstools.io.read(pattern, variables=["t", "unknown"], member_by_filename=r"m(\d)_")
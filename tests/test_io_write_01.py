@@ -4,6 +4,9 @@ import tempfile
 import numpy
 import os
 import shutil
+import subprocess
+import sys
+import textwrap
 import enstools.io
 import pytest
 
@@ -38,3 +41,165 @@ def test_write_file(test_dir):
     ds2 = enstools.io.read(filename)
     assert_equal(ds2["noise"].shape, (7, 5, 6))
     assert_equal(ds2["noise"].dims, ("time", "lon", "lat"))
+
+
+def test_write_zarr(test_dir):
+    """
+    create a zarr store with a selected chunk layout and compressor
+    """
+    pytest.importorskip("zarr")
+    ds = xarray.Dataset({"noise": (("time", "lon", "lat"), numpy.random.rand(7, 5, 6))},
+                        coords={"lon": numpy.linspace(1, 5, 5),
+                                "lat": numpy.linspace(1, 6, 6),
+                                "time": numpy.linspace(1, 7, 7)})
+    filename = os.path.join(test_dir, "01.zarr")
+    enstools.io.write(ds, filename, chunking={"time": 2}, compression="lossless,zlib,5")
+    assert os.listdir(test_dir) == ["01.zarr"]
+    ds2 = enstools.io.read(filename)
+    assert_equal(ds2["noise"].chunks, ((2, 2, 2, 1), (5,), (6,)))
+    xarray.testing.assert_identical(ds, ds2.compute())
+
+    # delayed writing replaces the existing store when computed
+    task = enstools.io.write(ds * 2, filename, compute=False)
+    xarray.testing.assert_identical(ds, enstools.io.read(filename).compute())
+    task.compute()
+    assert os.listdir(test_dir) == ["01.zarr"]
+    xarray.testing.assert_identical(ds * 2, enstools.io.read(filename).compute())
+
+    with pytest.raises(ValueError):
+        enstools.io.write(ds, filename, compression="lossy,zfp,rate,4")
+
+
+def test_write_parallel(test_dir):
+    """
+    write groups of variables in parallel processes and assemble them into one file
+    """
+    ds = xarray.Dataset({"noise%d" % i: (("time", "lon", "lat"), numpy.random.rand(7, 5, 6)) for i in range(3)},
+                        coords={"lon": numpy.linspace(1, 5, 5),
+                                "lat": numpy.linspace(1, 6, 6),
+                                "time": numpy.linspace(1, 7, 7)},
+                        attrs={"title": "test"})
+    ds["level"] = (("z",), numpy.arange(4))
+    ds["noise1"].encoding = {"zlib": True, "shuffle": True, "chunksizes": (2, 5, 6)}
+    filename = os.path.join(test_dir, "01.nc")
+    enstools.io.write(ds, filename, processes=2)
+    assert os.listdir(test_dir) == ["01.nc"]
+
+    # the compressed chunks are copied unchanged
+    ds2 = enstools.io.read(filename)
+    assert ds2["noise1"].encoding["zlib"]
+    assert_equal(ds2["noise1"].encoding["chunksizes"], (2, 5, 6))
+    xarray.testing.assert_identical(ds, ds2.compute()[list(ds.data_vars)])
+
+
+def test_write_parallel_unguarded_script(test_dir):
+    """
+    scripts without 'if __name__ == "__main__":' fall back to writing in one process
+    """
+    filename = os.path.join(test_dir, "01.nc")
+    script = os.path.join(test_dir, "script.py")
+    with open(script, "w") as f:
+        f.write(textwrap.dedent("""
+            import numpy
+            import xarray
+            import enstools.io
+            ds = xarray.Dataset({"noise%%d" %% i: (("time", "lat"), numpy.ones((3, 4)) * i) for i in range(3)})
+            enstools.io.write(ds, %r, processes=2)
+            """ % filename))
+    result = subprocess.run([sys.executable, script], capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert "written serially" in result.stderr
+    ds = enstools.io.read(filename).compute()
+    assert sorted(ds.data_vars) == ["noise0", "noise1", "noise2"]
+    assert_equal(ds["noise2"].values, numpy.ones((3, 4)) * 2)
+
+
+@pytest.mark.parametrize("extension", ["nc", "zarr"])
+def test_write_append(test_dir, extension):
+    """
+    append time steps to a NetCDF file or zarr store
+    """
+    if extension == "zarr":
+        pytest.importorskip("zarr")
+    times = numpy.datetime64("2020-01-01") + numpy.arange(10) * numpy.timedelta64(1, "h")
+    ds = xarray.Dataset({"noise": (("time", "lat"), numpy.random.rand(10, 6).astype("f4")),
+                         "orography": (("lat",), numpy.linspace(1, 6, 6))},
+                        coords={"time": times, "lat": numpy.linspace(1, 6, 6)})
+    filename = os.path.join(test_dir, "01." + extension)
+    enstools.io.write(ds.isel(time=slice(0, 3)), filename, mode="append", chunking={"time": 2})
+    inode = os.stat(filename).st_ino
+    for itime in range(3, 10, 3):
+        enstools.io.write(ds.isel(time=slice(itime, itime + 3)), filename, mode="append", chunking={"time": 2})
+    assert os.listdir(test_dir) == ["01." + extension]
+    if extension == "nc":
+        # new slices are written into the existing file
+        assert os.stat(filename).st_ino == inode
+    xarray.testing.assert_identical(ds, enstools.io.read(filename).compute())
+
+    # incompatible datasets are rejected
+    with pytest.raises(ValueError):
+        enstools.io.write(ds.isel(time=[9]), filename, mode="append")
+    with pytest.raises(ValueError):
+        enstools.io.write(ds.isel(time=[9], lat=[0]).assign_coords(time=[times[-1] + 1]), filename, mode="append")
+    if extension == "nc":
+        # times not representable in the units of the file are rejected before the file is modified
+        with pytest.raises(ValueError):
+            enstools.io.write(ds.isel(time=[9]).assign_coords(time=[times[-1] + numpy.timedelta64(500, "ms")]),
+                              filename, mode="append")
+    xarray.testing.assert_identical(ds, enstools.io.read(filename).compute())
+
+
+def test_write_chunking(test_dir):
+    """
+    select the chunk shapes from the access pattern
+    """
+    ds = xarray.Dataset({"noise": (("time", "ens", "lat", "lon"), numpy.random.rand(8, 4, 30, 40).astype("f4"))},
+                        coords={"time": numpy.arange(8),
+                                "ens": numpy.arange(1, 5),
+                                "lat": numpy.linspace(1, 30, 30),
+                                "lon": numpy.linspace(1, 40, 40)})
+    expected = {"map": (1, 4, 30, 40), "timeseries": (8, 1, 25, 25), "auto": (8, 4, 12, 12),
+                "dict": (2, 4, 30, 40)}
+    for chunking, chunks in expected.items():
+        filename = os.path.join(test_dir, "%s.nc" % chunking)
+        enstools.io.write(ds, filename, chunking={"time": 2} if chunking == "dict" else chunking,
+                          chunk_bytes=20000)
+        ds2 = enstools.io.read(filename)
+        assert_equal(ds2["noise"].encoding["chunksizes"], chunks)
+        xarray.testing.assert_identical(ds, ds2.compute())
+
+    with pytest.raises(ValueError):
+        enstools.io.write(ds, os.path.join(test_dir, "error.nc"), chunking="unknown")
+
+
+@pytest.mark.parametrize("extension", ["nc", "zarr"])
+def test_stream_writer(test_dir, extension):
+    """
+    write time steps one by one in a background thread
+    """
+    if extension == "zarr":
+        pytest.importorskip("zarr")
+    times = numpy.datetime64("2020-01-01") + numpy.arange(6) * numpy.timedelta64(1, "h")
+    ds = xarray.Dataset({"noise": (("time", "lat"), numpy.random.rand(6, 5).astype("f4"))},
+                        coords={"time": times, "lat": numpy.linspace(1, 5, 5)})
+    filename = os.path.join(test_dir, "01." + extension)
+    with enstools.io.StreamWriter(filename, chunking="map") as output:
+        for itime in range(6):
+            output.write(ds.isel(time=[itime]))
+    assert os.listdir(test_dir) == ["01." + extension]
+    xarray.testing.assert_identical(ds, enstools.io.read(filename).compute())
+
+    # an existing output is replaced when the new one is complete
+    with enstools.io.StreamWriter(filename, chunking="map") as output:
+        output.write(ds.isel(time=[0, 1]))
+    assert os.listdir(test_dir) == ["01." + extension]
+    xarray.testing.assert_identical(ds.isel(time=[0, 1]), enstools.io.read(filename).compute())
+
+    # errors of the background thread are raised in the caller, the incomplete output is removed
+    filename = os.path.join(test_dir, "02." + extension)
+    with pytest.raises(ValueError):
+        with enstools.io.StreamWriter(filename) as output:
+            output.write(ds.isel(time=[0]))
+            output.write(ds.isel(time=[1], lat=[0]))
+            output.close()
+    assert not os.path.exists(filename) and not os.path.exists(filename + ".tmp")